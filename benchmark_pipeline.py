@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""
+Reproducible throughput benchmark for the Cash Back pipeline
+
+Generates a synthetic merged PDF and Excel policy list, times every stage
+(Excel load, scan, lookup, write+encrypt, print bundle, zip, merge, send against a mock
+Brevo transport) and saves the timings as JSON so runs can be compared
+across commits.
+
+Usage:
+    python benchmark_pipeline.py --policies 500 --workers 2
+    python benchmark_pipeline.py --compare benchmark_results/a.json benchmark_results/b.json
+"""
+import io
+import os
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from contextlib import contextmanager, redirect_stdout
+
+RESULTS_FOLDER = "benchmark_results"
+
+# Lines of Cash Back Form body per page, like the real letters
+BODY_LINES = 40
+
+
+def _random_policy_number(rng, slash_format):
+    """Policy number in the 00407/0054316 or 29031933 format"""
+    if slash_format:
+        return f"{rng.randint(1, 999):05d}/{rng.randint(0, 9999999):07d}"
+    return str(rng.randint(10000000, 99999999))
+
+
+def _noise_line(rng, line_no):
+    """Body text with the kind of digits that sit next to policy numbers
+
+    Dates, amounts, phone and account numbers - near misses for the
+    policy formats, never a full 8-digit or 5/7-digit match.
+    """
+    choices = [
+        f"Payment date {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/20{rng.randint(18, 25)}",
+        f"Cash back amount Rs {rng.randint(1000, 999999):,}.{rng.randint(0, 99):02d}",
+        f"Call us on 230 {rng.randint(200, 699)} {rng.randint(1000, 9999)}",
+        f"Bank account {rng.randint(1000000, 9999999)} branch {rng.randint(100, 999)}",
+        f"Reference {rng.randint(100000000, 999999999)} period {rng.randint(1, 12)}/{rng.randint(2018, 2025)}",
+    ]
+    return f"{line_no:02d}. {rng.choice(choices)} - terms and conditions apply as per policy schedule"
+
+
+def generate_dataset(output_folder, policies=200, email_ratio=0.7, nic_ratio=0.9,
+                     slash_ratio=0.5, seed=42):
+    """Write a merged policy PDF and matching Excel file
+
+    Each policy gets 1-4 pages with the policy number in the letter
+    header. ``email_ratio`` and ``nic_ratio`` control how many Excel rows
+    have an email and a NIC. Returns a dict with the file paths and the
+    expected page assignment.
+    """
+    import pandas as pd
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    rng = random.Random(seed)
+    output_folder = Path(output_folder)
+    output_folder.mkdir(parents=True, exist_ok=True)
+    pdf_path = output_folder / "merged_policies.pdf"
+    excel_path = output_folder / "policies.xlsx"
+
+    used = set()
+    rows = []
+    expected = {}
+    page_num = 0
+
+    pdf = canvas.Canvas(str(pdf_path), pagesize=A4)
+    width, height = A4
+    for i in range(policies):
+        policy_number = _random_policy_number(rng, rng.random() < slash_ratio)
+        while policy_number in used:
+            policy_number = _random_policy_number(rng, '/' in policy_number)
+        used.add(policy_number)
+
+        page_total = rng.randint(1, 4)
+        expected[policy_number] = list(range(page_num, page_num + page_total))
+        page_num += page_total
+
+        for page in range(page_total):
+            pdf.setFont("Helvetica-Bold", 14)
+            pdf.drawString(50, height - 50, "NIC Life Insurance Mauritius")
+            pdf.setFont("Helvetica", 11)
+            pdf.drawString(50, height - 75, f"Policy No: {policy_number}")
+            pdf.drawString(350, height - 75, f"Page {page + 1} of {page_total}")
+            pdf.setFont("Helvetica", 9)
+            for line_no in range(BODY_LINES):
+                pdf.drawString(50, height - 110 - line_no * 17, _noise_line(rng, line_no + 1))
+            pdf.showPage()
+
+        has_email = rng.random() < email_ratio
+        rows.append({
+            # Excel stores the 8-digit numbers as numbers
+            'Policy No': policy_number if '/' in policy_number else int(policy_number),
+            'Owner 1 Email': f"client{i}@example.com" if has_email else None,
+            'NIC': f"N{rng.randint(0, 99999999):08d}" if rng.random() < nic_ratio else None,
+        })
+    pdf.save()
+    pd.DataFrame(rows).to_excel(excel_path, index=False)
+
+    return {
+        'pdf_path': str(pdf_path),
+        'excel_path': str(excel_path),
+        'policies': policies,
+        'pages': page_num,
+        'pdf_bytes': os.path.getsize(pdf_path),
+        'expected': expected,
+    }
+
+
+class MockSendResponse:
+    def __init__(self, message_id):
+        self.message_id = message_id
+
+
+class MockTransactionalEmailsApi:
+    """Stand-in for sib_api_v3_sdk.TransactionalEmailsApi
+
+    Sleeps ``latency`` seconds per call to model the HTTPS round trip and
+    records the payload size instead of sending anything.
+    """
+
+    def __init__(self, latency=0.02):
+        self.latency = latency
+        self.calls = 0
+        self.attachment_bytes = 0
+
+    def send_transac_email(self, send_smtp_email):
+        time.sleep(self.latency)
+        self.calls += 1
+        for attachment in send_smtp_email.attachment or []:
+            self.attachment_bytes += len(attachment['content'])
+        return MockSendResponse(f"<mock-{self.calls}@benchmark>")
+
+
+@contextmanager
+def _working_directory(path):
+    """The pipeline writes relative to the current directory"""
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield
+    finally:
+        os.chdir(previous)
+
+
+def _git_commit():
+    """Current commit and whether the tree has local changes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=here,
+                                capture_output=True, text=True, timeout=30).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=here,
+                                    capture_output=True, text=True, timeout=60).stdout.strip())
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown', False
+    return commit or 'unknown', dirty
+
+
+class StageTimer:
+    """Times pipeline stages and keeps going when one of them fails"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, items=None):
+        print(f"⏱️  {name}...", end=' ', flush=True)
+        started = time.perf_counter()
+        try:
+            result = func()
+            error = None
+        except Exception as e:
+            result = None
+            error = f"{type(e).__name__}: {e}"
+        seconds = time.perf_counter() - started
+
+        count = items(result) if items and error is None else None
+        self.stages[name] = {
+            'seconds': round(seconds, 4),
+            'ok': error is None,
+            'items': count,
+            'per_second': round(count / seconds, 2) if count and seconds else None,
+            'error': error,
+        }
+        print(f"{seconds:.2f}s" if error is None else f"❌ {error}")
+        return result
+
+
+def run_benchmark(policies=200, workers=1, header_only=False, email_ratio=0.7, nic_ratio=0.9,
+                  send_latency=0.02, seed=42, keep_files=False):
+    """Generate a dataset and time each stage of the pipeline"""
+    import pandas as pd
+    import PyPDF2
+
+    from email_dispatch import TokenBucket
+    from policy_index import build_policy_index
+    from policy_manifest import policy_fingerprint, save_manifest
+    from policy_scanner import open_pdf_reader, page_count, scan_policy_pages
+    from policy_writer import (WITH_EMAIL_FOLDER, WITHOUT_EMAIL_FOLDER, plan_policy_output, write_policy_pdfs,
+                               write_print_bundle)
+    from production_config import ProductionConfig
+    from send_ledger import SendLedger
+
+    # Same cap on worker processes as the app
+    workers = ProductionConfig.worker_count(workers)
+    work_folder = tempfile.mkdtemp(prefix='cashback_bench_')
+    timer = StageTimer()
+
+    print(f"🏗️  Generating {policies} synthetic policies in {work_folder}")
+    started = time.perf_counter()
+    dataset = generate_dataset(work_folder, policies, email_ratio, nic_ratio, seed=seed)
+    generate_seconds = time.perf_counter() - started
+    print(f"📄 {dataset['pages']} pages, {dataset['pdf_bytes'] / 1024 / 1024:.1f} MB ({generate_seconds:.1f}s)")
+
+    with _working_directory(work_folder):
+        def load_excel():
+            return build_policy_index(pd.read_excel(dataset['excel_path']))
+        policy_index = timer.run('excel_load', load_excel, items=lambda index: len(index.records))
+
+        with open(dataset['pdf_path'], 'rb') as pdf_file_handle:
+            pdf_reader = open_pdf_reader(pdf_file_handle)
+            total_pages = page_count(pdf_reader)
+
+            def scan():
+                known = [record.policy_no for record in policy_index.records] if policy_index else None
+                return scan_policy_pages(pdf_reader, dataset['pdf_path'], total_pages, max_workers=workers,
+                                         known_policies=known, header_only=header_only)
+            policy_pages = timer.run('scan', scan, items=lambda _: total_pages) or {}
+
+            def lookup():
+                return [plan_policy_output(policy_number, pages, policy_index)
+                        for policy_number, pages in policy_pages.items()]
+            jobs = timer.run('lookup', lookup, items=len) or []
+
+            def write():
+                # Fingerprinted and saved to the manifest like the app's two-pass run
+                for job in jobs:
+                    job['fingerprint'] = policy_fingerprint(pdf_reader, job)
+                written = write_policy_pdfs(pdf_reader, dataset['pdf_path'], jobs, max_workers=workers)
+                save_manifest({job['policy_number']: {'path': job['path'], 'fingerprint': job['fingerprint']}
+                               for job in jobs})
+                return written
+            results = timer.run('write_encrypt', write, items=len) or []
+
+            def print_bundle():
+                # The split-time alternative to the merge stage below
+                bundle_jobs = [job for job in jobs if not job['has_email']]
+                return write_print_bundle(pdf_reader, bundle_jobs, output_path='print_bundle.pdf',
+                                          index_path='print_bundle_index.json')
+            timer.run('print_bundle', print_bundle, items=lambda bundle: bundle['policies'])
+
+        def make_zips():
+            # Same as create_download_zip in the Streamlit app
+            sizes = []
+            for folder in (WITH_EMAIL_FOLDER, WITHOUT_EMAIL_FOLDER):
+                zip_buffer = io.BytesIO()
+                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                    for file_path in Path(folder).glob("*.pdf"):
+                        zip_file.write(file_path, file_path.name)
+                sizes.append(len(zip_buffer.getvalue()))
+            return sizes
+        timer.run('zip', make_zips, items=lambda _: len(results))
+
+        def merge():
+            from merge_final import merge_all_pdfs
+            output = io.StringIO()
+            with redirect_stdout(output):
+                merged = merge_all_pdfs()
+            if not merged:
+                lines = [line for line in output.getvalue().splitlines() if line.strip()]
+                raise RuntimeError(lines[-1] if lines else "merge_all_pdfs() reported a failure")
+            return len(list(Path(WITHOUT_EMAIL_FOLDER).glob("*.pdf")))
+        timer.run('merge', merge, items=lambda merged: merged)
+
+        transport = MockTransactionalEmailsApi(latency=send_latency)
+
+        def send():
+            from send_emails_brevo import send_policy_emails
+            # A fresh ledger in the work folder and no rate limit - the mock's latency is what is timed
+            with redirect_stdout(io.StringIO()):
+                send_policy_emails(api_instance=transport, excel_path=dataset['excel_path'],
+                                   pdf_folder=WITH_EMAIL_FOLDER,
+                                   ledger=SendLedger(Path(work_folder) / "send_ledger.sqlite3"),
+                                   rate_limiter=TokenBucket(0))
+            return transport.calls
+        timer.run('send', send, items=lambda calls: calls)
+
+    # Check the scan found what was generated, so a fast but wrong change shows up
+    found = {policy_number: pages for policy_number, pages in policy_pages.items()}
+    wrong = sum(found.get(policy_number) != pages for policy_number, pages in dataset['expected'].items())
+
+    commit, dirty = _git_commit()
+    report = {
+        'commit': commit,
+        'dirty': dirty,
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pypdf2': getattr(PyPDF2, '__version__', 'unknown'),
+        'cpu_count': os.cpu_count(),
+        'params': {
+            'policies': policies,
+            'workers': workers,
+            'header_only': header_only,
+            'email_ratio': email_ratio,
+            'nic_ratio': nic_ratio,
+            'send_latency': send_latency,
+            'seed': seed,
+        },
+        'dataset': {
+            'pages': dataset['pages'],
+            'pdf_bytes': dataset['pdf_bytes'],
+            'generate_seconds': round(generate_seconds, 2),
+        },
+        'checks': {
+            'policies_found': len(found),
+            'wrong_page_assignments': wrong,
+            'encrypted': sum(result['encrypted'] for result in results),
+            'emails_sent': transport.calls,
+        },
+        'stages': timer.stages,
+        'total_seconds': round(sum(stage['seconds'] for stage in timer.stages.values()), 4),
+    }
+
+    if keep_files:
+        print(f"📁 Files kept in {work_folder}")
+    else:
+        import shutil
+        shutil.rmtree(work_folder, ignore_errors=True)
+    return report
+
+
+def save_report(report, folder=RESULTS_FOLDER):
+    """Write a run to benchmark_results/<timestamp>_<commit>.json"""
+    Path(folder).mkdir(parents=True, exist_ok=True)
+    stamp = report['timestamp'].replace(':', '').replace('-', '')
+    suffix = '-dirty' if report['dirty'] else ''
+    path = Path(folder) / f"{stamp}_{report['commit']}{suffix}_{report['params']['policies']}p.json"
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    return path
+
+
+def compare_reports(baseline_path, candidate_path):
+    """Print stage timings of two saved runs side by side"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(candidate_path, encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    if baseline['params'] != candidate['params']:
+        print("⚠️  Runs used different parameters - timings are not directly comparable")
+    print(f"{'stage':<15}{baseline['commit']:>12}{candidate['commit']:>12}{'speed-up':>10}")
+    print("-" * 49)
+    names = list(baseline['stages']) + [name for name in candidate['stages'] if name not in baseline['stages']]
+    for name in names + ['total']:
+        if name == 'total':
+            before, after = baseline['total_seconds'], candidate['total_seconds']
+        else:
+            before = baseline['stages'].get(name, {}).get('seconds')
+            after = candidate['stages'].get(name, {}).get('seconds')
+        speedup = f"{before / after:.2f}x" if before and after else '-'
+        before_text = f"{before:.2f}s" if before is not None else '-'
+        after_text = f"{after:.2f}s" if after is not None else '-'
+        print(f"{name:<15}{before_text:>12}{after_text:>12}{speedup:>10}")
+
+
+def print_report(report):
+    print(f"\n📊 BENCHMARK - commit {report['commit']}{' (dirty)' if report['dirty'] else ''}")
+    print(f"   {report['params']['policies']} policies, {report['dataset']['pages']} pages, "
+          f"{report['params']['workers']} worker(s)")
+    for name, stage in report['stages'].items():
+        rate = f"{stage['per_second']:.1f}/s" if stage['per_second'] else ''
+        status = '✅' if stage['ok'] else '❌'
+        print(f"   {status} {name:<15}{stage['seconds']:>8.2f}s  {rate}")
+        if stage['error']:
+            print(f"      {stage['error']}")
+    checks = report['checks']
+    print(f"   🔍 {checks['policies_found']} policies found, "
+          f"{checks['wrong_page_assignments']} wrong page assignments")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Cash Back PDF pipeline")
+    parser.add_argument('--policies', type=int, default=200, help="number of synthetic policies")
+    parser.add_argument('--workers', type=int, default=1, help="PDF worker processes")
+    parser.add_argument('--header-only', action='store_true', help="header-only policy detection")
+    parser.add_argument('--email-ratio', type=float, default=0.7, help="share of rows with an email")
+    parser.add_argument('--nic-ratio', type=float, default=0.9, help="share of rows with a NIC")
+    parser.add_argument('--send-latency', type=float, default=0.02, help="mock API latency in seconds")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--keep-files', action='store_true', help="keep the generated work folder")
+    parser.add_argument('--output', default=RESULTS_FOLDER, help="folder for the JSON results")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help="compare two saved result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        return
+
+    # Run from the repo so the pipeline modules import
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    report = run_benchmark(args.policies, args.workers, args.header_only, args.email_ratio,
+                           args.nic_ratio, args.send_latency, args.seed, args.keep_files)
+    print_report(report)
+    path = save_report(report, args.output)
+    print(f"\n💾 Results saved to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+HTTP transport for the Brevo SDK - pooled keep-alive connections with timeouts
+
+The SDK's default urllib3 pool has no timeouts and throws away
+connections beyond its size, so parallel sends keep paying new TLS
+handshakes. This pool is sized to the send workers, blocks instead of
+overflowing, and counts connections and handshake time.
+"""
+import time
+import socket
+import threading
+
+import certifi
+import urllib3
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from production_config import ProductionConfig
+
+
+class ConnectionStats:
+    """Thread-safe counters of requests, new connections and handshake time"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections = 0
+        self.handshake_ms = 0.0
+        self._lock = threading.Lock()
+
+    def request(self):
+        with self._lock:
+            self.requests += 1
+
+    def connected(self, elapsed_ms):
+        with self._lock:
+            self.connections += 1
+            self.handshake_ms += elapsed_ms
+
+    def track(self, connection):
+        """Time every (re)connect of a new pool connection - TCP plus TLS"""
+        connect = connection.connect
+
+        def timed_connect():
+            started = time.perf_counter()
+            connect()
+            self.connected((time.perf_counter() - started) * 1000)
+
+        connection.connect = timed_connect
+        return connection
+
+    def snapshot(self):
+        with self._lock:
+            reused = max(0, self.requests - self.connections)
+            return {
+                'requests': self.requests,
+                'connections': self.connections,
+                'reused': reused,
+                'reuse_rate': reused / self.requests if self.requests else 0.0,
+                'handshake_ms': self.handshake_ms / self.connections if self.connections else None,
+            }
+
+
+class _TrackedPoolMixin:
+    stats = None
+
+    def _new_conn(self):
+        connection = super()._new_conn()
+        return self.stats.track(connection) if self.stats is not None else connection
+
+
+class TrackedHTTPConnectionPool(_TrackedPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class TrackedHTTPSConnectionPool(_TrackedPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class _TrackedManagerMixin:
+    """Applies the manager's default timeout and records ConnectionStats
+
+    The SDK passes ``timeout=None`` on every request unless a per-call
+    ``_request_timeout`` is given, which would disable the pool timeout.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = ConnectionStats()
+        self.pool_classes_by_scheme = {'http': TrackedHTTPConnectionPool, 'https': TrackedHTTPSConnectionPool}
+
+    def _new_pool(self, scheme, host, port, request_context=None):
+        pool = super()._new_pool(scheme, host, port, request_context)
+        pool.stats = self.stats
+        return pool
+
+    def urlopen(self, method, url, redirect=True, **kw):
+        if kw.get('timeout') is None:
+            kw.pop('timeout', None)
+        self.stats.request()
+        return super().urlopen(method, url, redirect=redirect, **kw)
+
+
+class BrevoPoolManager(_TrackedManagerMixin, urllib3.PoolManager):
+    pass
+
+
+class BrevoProxyManager(_TrackedManagerMixin, urllib3.ProxyManager):
+    """Same, for deployments that reach Brevo through configuration.proxy"""
+
+
+def default_pool_size():
+    """One connection per possible send in flight"""
+    if ProductionConfig.BREVO_POOL_SIZE:
+        return ProductionConfig.BREVO_POOL_SIZE
+    if ProductionConfig.EMAIL_ADAPTIVE_CONCURRENCY:
+        return max(ProductionConfig.MAX_WORKERS, ProductionConfig.EMAIL_MAX_CONCURRENCY)
+    return ProductionConfig.MAX_WORKERS
+
+
+def _keepalive_socket_options():
+    options = list(HTTPConnection.default_socket_options) + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+    # Probe idle connections so a dropped one is noticed before the next send
+    if hasattr(socket, 'TCP_KEEPIDLE'):
+        options += [(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60), (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 15)]
+    return options
+
+
+def build_pool_manager(configuration, pool_size=None):
+    """urllib3 pool for a sib_api_v3_sdk Configuration, tuned from ProductionConfig
+
+    Takes the same TLS, client certificate and proxy settings from the
+    configuration as the SDK's own RESTClientObject. Connection-level
+    retries only cover failures to connect - the email was never sent,
+    so retrying cannot send it twice. Errors after the request went out
+    are left to send_retry.
+    """
+    pool_size = pool_size or default_pool_size()
+    pool_args = {}
+    if configuration.assert_hostname is not None:
+        pool_args['assert_hostname'] = configuration.assert_hostname
+    if configuration.proxy:
+        manager_class = BrevoProxyManager
+        pool_args['proxy_url'] = configuration.proxy
+    else:
+        manager_class = BrevoPoolManager
+    return manager_class(
+        num_pools=4,
+        maxsize=pool_size,
+        block=True,  # Wait for a free connection instead of opening throwaway ones
+        cert_reqs='CERT_REQUIRED' if configuration.verify_ssl else 'CERT_NONE',
+        ca_certs=configuration.ssl_ca_cert or certifi.where(),
+        cert_file=configuration.cert_file,
+        key_file=configuration.key_file,
+        timeout=urllib3.Timeout(connect=ProductionConfig.BREVO_CONNECT_TIMEOUT,
+                                read=ProductionConfig.BREVO_READ_TIMEOUT),
+        retries=urllib3.Retry(total=None, connect=ProductionConfig.BREVO_CONNECT_RETRIES, read=0,
+                              redirect=3, status=0, other=0, backoff_factor=0.2, raise_on_status=False),
+        socket_options=_keepalive_socket_options(),
+        **pool_args
+    )
+
+
+def connection_stats(api_instance):
+    """Connection reuse of a client built by setup_brevo_client, or None"""
+    rest_client = getattr(getattr(api_instance, 'api_client', None), 'rest_client', None)
+    stats = getattr(getattr(rest_client, 'pool_manager', None), 'stats', None)
+    return stats.snapshot() if isinstance(stats, ConnectionStats) else None
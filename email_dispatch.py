@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Concurrent email dispatch governed by a token-bucket rate limiter
+"""
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class TokenBucket:
+    """Thread-safe token bucket allowing ``rate`` requests per second
+
+    Up to ``burst`` requests (default: one second's worth) may go out
+    back to back after an idle spell. A rate of 0 disables limiting.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst) if burst else max(1.0, self.rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a request may be sent; returns the seconds waited"""
+        if self.rate <= 0:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                wait = (1 - self._tokens) / self.rate
+            # Sleep outside the lock so other threads can check in
+            time.sleep(wait)
+            waited += wait
+
+
+class AIMDController:
+    """Adaptive limit on sends in flight (additive increase, multiplicative decrease)
+
+    The window grows by about one slot per window of successful sends
+    while latency stays near its running baseline - throttled and failed
+    sends neither grow it nor move the baseline - and is cut by
+    ``decrease`` on a 429 or when latency jumps past ``spike_factor``
+    times the baseline - at most once per round trip, so a burst of 429s
+    from the same window only counts once.
+    """
+
+    def __init__(self, initial, minimum=1, maximum=16, decrease=0.5, spike_factor=2.0):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.window = float(min(max(initial, self.minimum), self.maximum))
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.in_flight = 0
+        self.baseline_ms = None
+        self._last_cut = 0.0
+        self._completed = deque()
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Block until the window has room for another send"""
+        with self._condition:
+            while self.in_flight >= int(self.window):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def _cut(self, now):
+        # One cut per round trip (or per second before the first sample)
+        if now - self._last_cut >= (self.baseline_ms or 1000) / 1000:
+            self.window = max(self.minimum, self.window * self.decrease)
+            self._last_cut = now
+
+    def throttled(self):
+        """Report a 429 straight away, without waiting for the send to finish"""
+        with self._condition:
+            self._cut(time.monotonic())
+
+    def release(self, latency_ms=None, outcome='ok'):
+        """A send finished; adjust the window from its latency
+
+        ``outcome`` is 'ok', 'throttled' (a 429 on the way) or 'failed'.
+        Only successful sends count towards throughput and growth.
+        """
+        with self._condition:
+            now = time.monotonic()
+            self.in_flight -= 1
+            if outcome == 'ok':
+                self._completed.append(now)
+
+            if latency_ms is not None:
+                if self.baseline_ms is not None and latency_ms > self.spike_factor * self.baseline_ms:
+                    self._cut(now)
+                elif outcome == 'ok':
+                    self.baseline_ms = latency_ms if self.baseline_ms is None else \
+                        0.9 * self.baseline_ms + 0.1 * latency_ms
+                    self.window = min(self.maximum, self.window + 1 / self.window)
+            self._condition.notify_all()
+
+    def stats(self, period=10.0):
+        """Current window, sends in flight, throughput over ``period`` seconds and latency"""
+        with self._condition:
+            now = time.monotonic()
+            while self._completed and now - self._completed[0] > period:
+                self._completed.popleft()
+            span = min(period, now - self._completed[0]) if self._completed else 0
+            return {
+                'window': self.window,
+                'in_flight': self.in_flight,
+                'throughput': len(self._completed) / span if span > 0 else 0.0,
+                'latency_ms': self.baseline_ms,
+            }
+
+
+class ByteBudget:
+    """Caps the bytes of prepared payloads held in memory at once
+
+    A payload larger than the whole budget is still let through when
+    nothing else is held, so one huge attachment cannot stall the run.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size):
+        with self._condition:
+            while self.used and self.used + size > self.max_bytes:
+                self._condition.wait()
+            self.used += size
+
+    def release(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+def send_concurrently(tasks, send_one, max_workers=1, rate_limiter=None, on_result=None, concurrency=None,
+                      prepare=None, max_prefetch_bytes=64 * 1024 * 1024):
+    """Run ``send_one(task)`` for every task on a bounded thread pool
+
+    Each call first takes a token from ``rate_limiter``. With an
+    AIMDController as ``concurrency`` the pool is sized to its maximum and
+    the controller decides how many sends are actually in flight, using
+    each result's ``latency_ms``, ``ok`` and ``throttled``.
+
+    With ``prepare`` the sends become a pipeline: a prefetch thread runs
+    ``prepare(task)`` -> ``(payload, size)`` ahead of the network workers
+    (read, encode, render) and ``send_one`` receives the payload. Prepared
+    payloads count against ``max_prefetch_bytes`` until their send
+    finishes, so memory is bounded by bytes rather than by task count.
+
+    ``on_result`` is called on the calling thread as sends finish, so a
+    policy's output lines can be printed together instead of interleaving
+    with other threads. Returns the results in task order.
+    """
+    if concurrency is not None:
+        max_workers = concurrency.maximum
+    budget = ByteBudget(max_prefetch_bytes) if prepare is not None else None
+    finished = queue.Queue()
+    results = [None] * len(tasks)
+
+    def run(item, size):
+        if concurrency is not None:
+            concurrency.acquire()
+        result = None
+        try:
+            if rate_limiter is not None:
+                rate_limiter.acquire()
+            result = send_one(item)
+            return result
+        finally:
+            if concurrency is not None:
+                if result is None or not result.get('ok', True):
+                    outcome = 'failed'
+                else:
+                    outcome = 'throttled' if result.get('throttled') else 'ok'
+                concurrency.release(result.get('latency_ms') if result else None, outcome)
+            if budget is not None:
+                budget.release(size)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix='brevo-send') as executor:
+        def submit(index, item, size):
+            future = executor.submit(run, item, size)
+            future.add_done_callback(lambda done, index=index: finished.put((index, done)))
+
+        def produce():
+            for index, task in enumerate(tasks):
+                try:
+                    payload, size = prepare(task)
+                except Exception as e:
+                    failed = Future()
+                    failed.set_exception(e)
+                    finished.put((index, failed))
+                    continue
+                budget.acquire(size)
+                submit(index, payload, size)
+
+        if prepare is None:
+            for index, task in enumerate(tasks):
+                submit(index, task, 0)
+        else:
+            threading.Thread(target=produce, name='brevo-prefetch', daemon=True).start()
+
+        for _ in range(len(tasks)):
+            index, future = finished.get()
+            results[index] = future.result()
+            if on_result:
+                on_result(results[index])
+    return results
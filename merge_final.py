@@ -1,13 +1,16 @@
 #!/usr/bin/env python3
 """
-Final working PDF merger using PdfFileMerger
+Final working PDF merger - streams pages straight into the output file
 """
 
-import PyPDF2
 import os
 
+from pdf_stream_merge import StreamingPdfWriter, merge_volumes
+from policy_scanner import extract_page_text, open_pdf_reader, page_count
+from production_config import ProductionConfig
+
 def merge_all_pdfs():
-    """Merge all PDFs using the robust PdfFileMerger approach"""
+    """Merge all PDFs, one source file open at a time"""
     
     input_folder = "policies_without_email"
     output_file = "policies_for_printing.pdf"
@@ -43,10 +46,16 @@ def merge_all_pdfs():
             return False
     
     try:
-        # Use PdfFileMerger for robust merging
-        merger = PyPDF2.PdfFileMerger()
+        # Pages are written as each file is appended, so memory stays flat
+        try:
+            merger = StreamingPdfWriter(output_file)
+        except Exception as e:
+            print(f"❌ Error writing output file: {e}")
+            print("Make sure no PDF viewer has the file open")
+            return False
         
         successful_merges = 0
+        input_size = 0
         
         for i, pdf_path in enumerate(pdf_files):
             # Show progress every 50 files
@@ -57,20 +66,20 @@ def merge_all_pdfs():
                 # Add entire PDF file to merger
                 merger.append(pdf_path)
                 successful_merges += 1
+                input_size += os.path.getsize(pdf_path)
                             
             except Exception as e:
                 print(f"⚠️  Error processing {os.path.basename(pdf_path)}: {e}")
                 continue
         
         if successful_merges == 0:
+            merger.abort()
             print("❌ No PDFs could be merged")
             return False
         
-        # Write merged PDF
+        # Finish the merged PDF (page tree and cross-reference table)
         print(f"💾 Writing merged PDF with {successful_merges} files...")
         try:
-            with open(output_file, 'wb') as output:
-                merger.write(output)
             merger.close()
             print(f"✅ Successfully wrote to {output_file}")
         except Exception as e:
@@ -84,23 +93,25 @@ def merge_all_pdfs():
         # Count pages in final PDF
         try:
             with open(output_file, 'rb') as f:
-                reader = PyPDF2.PdfFileReader(f)
-                total_pages = reader.numPages
+                total_pages = page_count(open_pdf_reader(f))
         except:
             total_pages = "Unknown"
         
         print(f"✅ Successfully merged {successful_merges} PDFs")
         print(f"📊 Total pages: {total_pages}")
         print(f"💾 Output file: {output_file}")
-        print(f"📏 File size: {file_size / 1024 / 1024:.1f} MB")
+        print(f"📏 File size: {file_size / 1024 / 1024:.1f} MB "
+              f"(inputs {input_size / 1024 / 1024:.1f} MB)")
+        if merger.optimize:
+            print(f"🗜️  Shared {merger.stats['duplicates']} duplicate fonts/images, "
+                  f"compressed {merger.stats['compressed_streams']} streams")
         
         # Test first page to verify content
         try:
             with open(output_file, 'rb') as f:
-                reader = PyPDF2.PdfFileReader(f)
-                if reader.numPages > 0:
-                    page = reader.getPage(0)
-                    text = page.extractText()
+                reader = open_pdf_reader(f)
+                if page_count(reader) > 0:
+                    text = extract_page_text(reader, 0)
                     if len(text) > 0:
                         print(f"✅ Content verified: First page has {len(text)} characters")
                     else:
@@ -116,7 +127,47 @@ def merge_all_pdfs():
         traceback.print_exc()
         return False
 
+def merge_print_volumes(max_workers=None):
+    """Merge into print volumes of PRINT_VOLUME_MAX_PAGES pages / PRINT_VOLUME_MAX_MB MB"""
+    
+    input_folder = "policies_without_email"
+    output_prefix = "policies_for_printing"
+    
+    if not os.path.exists(input_folder):
+        print(f"❌ Folder '{input_folder}' not found")
+        return False
+    
+    pdf_files = sorted(os.path.join(input_folder, file) for file in os.listdir(input_folder) if file.endswith('.pdf'))
+    if not pdf_files:
+        print(f"❌ No PDF files found in '{input_folder}' folder")
+        return False
+    
+    max_workers = ProductionConfig.worker_count(max_workers)
+    print(f"📁 Found {len(pdf_files)} PDF files to merge into volumes "
+          f"(max {ProductionConfig.PRINT_VOLUME_MAX_PAGES} pages / {ProductionConfig.PRINT_VOLUME_MAX_MB} MB, "
+          f"{max_workers} worker(s))")
+    
+    def report_progress(done, total):
+        print(f"📚 Volume {done}/{total} written")
+    
+    volumes, index_path = merge_volumes(pdf_files, output_prefix, max_workers=max_workers,
+                                        progress_callback=report_progress)
+    
+    for volume in volumes:
+        print(f"✅ {volume['path']}: {len(volume['files'])} PDFs, {volume['pages']} pages, "
+              f"{volume['size'] / 1024 / 1024:.1f} MB (inputs {volume['input_size'] / 1024 / 1024:.1f} MB)")
+        for filename, error in volume['failed']:
+            print(f"⚠️  Error processing {filename}: {error}")
+    print(f"📋 Volume index: {index_path}")
+    return any(volume['files'] for volume in volumes)
+
 if __name__ == "__main__":
+    import sys
+    
     print("FINAL PDF MERGER FOR PRINTING")
     print("=" * 35)
-    merge_all_pdfs()
\ No newline at end of file
+    # --volumes splits the print run into several smaller files
+    if "--volumes" in sys.argv:
+        merge_print_volumes()
+    else:
+        merge_all_pdfs()
\ No newline at end of file
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Per-policy PDF compaction - smaller email attachments
+
+Pages split from the big source PDF keep the whole document's resource
+dictionaries, so every policy file would carry fonts and images it never
+draws. compact_page builds a copy of a source page for the PDF writer
+with only the resources its content uses, the content stream
+Flate-compressed and, optionally, images drawn above a DPI threshold
+resampled. The source page is never modified - the reader is shared by
+every policy.
+"""
+import io
+import re
+import zlib
+import math
+
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, EncodedStreamObject, NameObject, NumberObject
+
+try:
+    from PyPDF2.generic import ContentStream
+except ImportError:
+    # Older PyPDF2 version
+    from PyPDF2.pdf import ContentStream
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# Resource categories whose entries are only used by name from the content stream
+PRUNABLE_RESOURCES = ('/Font', '/XObject', '/ExtGState', '/ColorSpace', '/Pattern', '/Shading', '/Properties')
+
+NAME_PATTERN = re.compile(rb"/([^\s/\[\]()<>{}%]+)")
+
+JPEG_QUALITY = 85
+
+
+def _stream_size(obj):
+    obj = obj.get_object()
+    return len(obj._data) if hasattr(obj, '_data') else 0
+
+
+def _content_data(page):
+    """Decoded content of a page (its content streams joined), whether it is
+    all compressed already, and its stored size"""
+    contents = page.get('/Contents')
+    if contents is None:
+        return b'', True, 0
+    contents = contents.get_object()
+    streams = [stream.get_object() for stream in contents] if isinstance(contents, list) else [contents]
+    filtered = all('/Filter' in stream for stream in streams)
+    return b"\n".join(stream.get_data() for stream in streams), filtered, sum(map(_stream_size, streams))
+
+
+def _used_names(data):
+    """Every name in a content stream - a superset of the resources it uses"""
+    names = set()
+    for match in NAME_PATTERN.finditer(data):
+        name = re.sub(rb"#([0-9A-Fa-f]{2})", lambda m: bytes([int(m.group(1), 16)]), match.group(1))
+        names.add("/" + name.decode('latin-1'))
+    return names
+
+
+def _image_scales(data, pdf_reader, images, max_image_dpi):
+    """Downscale factor for each image drawn at more than ``max_image_dpi``
+
+    Follows the transformation matrix to the size each image is drawn at;
+    an image drawn several times is judged by its largest placement.
+    """
+    dpi = {}
+    ctm = [1, 0, 0, 1, 0, 0]
+    stack = []
+    content = DecodedStreamObject()
+    content._data = data
+    try:
+        operations = ContentStream(content, pdf_reader).operations
+    except Exception:
+        return {}
+    for operands, operator in operations:
+        if operator == b'q':
+            stack.append(ctm)
+        elif operator == b'Q' and stack:
+            ctm = stack.pop()
+        elif operator == b'cm' and len(operands) == 6:
+            a, b, c, d, e, f = (float(value) for value in operands)
+            ctm = [a * ctm[0] + b * ctm[2], a * ctm[1] + b * ctm[3],
+                   c * ctm[0] + d * ctm[2], c * ctm[1] + d * ctm[3],
+                   e * ctm[0] + f * ctm[2] + ctm[4], e * ctm[1] + f * ctm[3] + ctm[5]]
+        elif operator == b'Do' and operands and operands[0] in images:
+            image = images[operands[0]]
+            width_in = math.hypot(ctm[0], ctm[1]) / 72
+            height_in = math.hypot(ctm[2], ctm[3]) / 72
+            if width_in <= 0 or height_in <= 0:
+                continue
+            placement = min(image['/Width'] / width_in, image['/Height'] / height_in)
+            dpi[operands[0]] = min(dpi.get(operands[0], placement), placement)
+    return {name: max_image_dpi / value for name, value in dpi.items() if value > max_image_dpi}
+
+
+def _resample_image(image, scale):
+    """Smaller copy of an image XObject, or None when it cannot be done safely
+
+    Handles 8-bit RGB and greyscale images stored as JPEG or Flate data;
+    masked images are left alone because the mask would no longer fit.
+    """
+    if any(key in image for key in ('/SMask', '/Mask', '/ImageMask', '/Decode')):
+        return None
+    if image.get('/BitsPerComponent') != 8 or image.get('/ColorSpace') not in ('/DeviceRGB', '/DeviceGray'):
+        return None
+    mode = 'RGB' if image['/ColorSpace'] == '/DeviceRGB' else 'L'
+    width = max(1, int(image['/Width'] * scale))
+    height = max(1, int(image['/Height'] * scale))
+
+    filters = image.get('/Filter') or []
+    filters = [filters] if isinstance(filters, str) else list(filters)
+    # get_data undoes every filter but leaves the JPEG data of /DCTDecode as it is
+    if filters and filters[-1] == '/DCTDecode':
+        picture = Image.open(io.BytesIO(image.get_data()))
+        if picture.mode != mode:
+            return None
+        buffer = io.BytesIO()
+        picture.resize((width, height), Image.LANCZOS).save(buffer, 'JPEG', quality=JPEG_QUALITY)
+        data = buffer.getvalue()
+        filters = '/DCTDecode'
+    elif all(name in ('/FlateDecode', '/ASCII85Decode', '/ASCIIHexDecode', '/LZWDecode') for name in filters):
+        picture = Image.frombytes(mode, (image['/Width'], image['/Height']), image.get_data())
+        data = zlib.compress(picture.resize((width, height), Image.LANCZOS).tobytes(), 6)
+        filters = '/FlateDecode'
+    else:
+        return None
+
+    resampled = EncodedStreamObject()
+    resampled._data = data
+    for key, value in image.items():
+        if key not in ('/Length', '/DecodeParms'):
+            resampled[NameObject(key)] = value
+    resampled[NameObject('/Filter')] = NameObject(filters)
+    resampled[NameObject('/Width')] = NumberObject(width)
+    resampled[NameObject('/Height')] = NumberObject(height)
+    return resampled
+
+
+def _resource_parts(category, value):
+    """The streams that make a resource entry expensive - for fonts, the font files"""
+    if category != '/Font':
+        return [value]
+    descriptor = value.get_object().get('/FontDescriptor')
+    descriptor = descriptor.get_object() if descriptor is not None else {}
+    return [descriptor[key] for key in ('/FontFile', '/FontFile2', '/FontFile3') if key in descriptor]
+
+
+def _object_key(ref):
+    return (ref.idnum, ref.generation) if hasattr(ref, 'idnum') else id(ref)
+
+
+def new_compaction_state(add_object=None):
+    """Per-output-file state shared by compact_page calls
+
+    Holds the resampled copy of each image, so an image shared by several
+    pages is resampled once, and the pruned and kept resource streams, so
+    pruned_bytes only counts what no page of the file uses. ``add_object``
+    (the writer's) makes each copy one indirect object - a direct stream
+    would be copied again for every page that uses it.
+    """
+    return {'images': {}, 'pruned': {}, 'kept': set(), 'add_object': add_object}
+
+
+def pruned_bytes(state):
+    """Bytes of resource streams that no page of the output file uses"""
+    return sum(size for key, size in state['pruned'].items() if key not in state['kept'])
+
+
+def _replace_stream(target, source):
+    """Give an existing stream object the data and entries of another"""
+    for key in list(target.keys()):
+        del target[key]
+    for key, value in source.items():
+        if key != '/Length':
+            target[NameObject(key)] = value
+    target._data = source._data
+    if hasattr(target, 'decoded_self'):
+        target.decoded_self = None
+
+
+def _resampled(state, ref, image, scale):
+    """Resampled copy of an image, shared by every page of the file that draws it
+
+    Returns ``(stream, saved)``; ``stream`` is None where the original is
+    kept. A page that draws the image larger than the shared copy allows
+    raises the copy's resolution in place, so the pages already added use
+    the better copy too and the file still holds a single image.
+    """
+    key = _object_key(ref)
+    entry = state['images'].get(key)
+    if entry is not None and scale <= entry['scale']:
+        return entry['stream'], 0
+
+    try:
+        stream = _resample_image(image, scale)
+    except Exception:
+        stream = None
+    if stream is None or len(stream._data) >= len(image._data):
+        # Not worth it at this size - full resolution
+        stream, scale = image, 1.0
+
+    if entry is None:
+        if stream is image:
+            state['images'][key] = {'stream': None, 'scale': 1.0, 'size': len(image._data)}
+            return None, 0
+        size = len(stream._data)
+        if state['add_object'] is not None:
+            stream = state['add_object'](stream)
+        state['images'][key] = {'stream': stream, 'scale': scale, 'size': size}
+        return stream, len(image._data) - size
+
+    _replace_stream(entry['stream'].get_object(), stream)
+    saved = entry['size'] - len(stream._data)
+    entry.update(scale=scale, size=len(stream._data))
+    return entry['stream'], saved
+
+
+def compact_page(page, pdf_reader, max_image_dpi=0, state=None):
+    """Compacted copy of a source page for the PDF writer
+
+    Returns ``(page_copy, saved)`` - ``saved`` is the bytes saved by
+    content compression and resampling. Pass the same ``state`` (from
+    new_compaction_state) for every page of one output file and add
+    pruned_bytes(state) once the file is done. Pages whose resources
+    cannot be pruned safely (form XObjects without their own resources
+    use the page's) keep them all.
+    """
+    state = state if state is not None else new_compaction_state()
+    page_copy = page.__class__(pdf_reader)
+    for key, value in page.items():
+        page_copy[NameObject(key)] = value
+    saved = 0
+    data, filtered, before = _content_data(page)
+
+    if not filtered:
+        # Joining the streams changes nothing - a viewer reads them as one
+        compressed = EncodedStreamObject()
+        compressed._data = zlib.compress(data, 6)
+        compressed[NameObject('/Filter')] = NameObject('/FlateDecode')
+        if len(compressed._data) < before:
+            page_copy[NameObject('/Contents')] = compressed
+            saved += before - len(compressed._data)
+
+    resources = page.get('/Resources')
+    if resources is None:
+        return page_copy, saved
+    resources = resources.get_object()
+    xobjects = resources.get('/XObject')
+    xobjects = xobjects.get_object() if xobjects is not None else DictionaryObject()
+    if any(xobject.get_object().get('/Subtype') == '/Form' and '/Resources' not in xobject.get_object()
+           for xobject in xobjects.values()):
+        for category, entries in resources.items():
+            if category in PRUNABLE_RESOURCES:
+                for value in entries.get_object().values():
+                    state['kept'].update(_object_key(part) for part in _resource_parts(category, value))
+        return page_copy, saved
+
+    used = _used_names(data)
+    new_resources = DictionaryObject()
+    for category, entries in resources.items():
+        if category not in PRUNABLE_RESOURCES:
+            new_resources[NameObject(category)] = entries
+            continue
+        entries = entries.get_object()
+        kept = DictionaryObject()
+        for name, value in entries.items():
+            parts = _resource_parts(category, value)
+            if name in used:
+                kept[NameObject(name)] = value
+                state['kept'].update(_object_key(part) for part in parts)
+            else:
+                state['pruned'].update((_object_key(part), _stream_size(part)) for part in parts)
+        new_resources[NameObject(category)] = kept
+
+    if max_image_dpi and Image is not None and '/XObject' in new_resources:
+        kept = new_resources['/XObject']
+        images = {name: value.get_object() for name, value in kept.items()
+                  if value.get_object().get('/Subtype') == '/Image'}
+        for name, scale in _image_scales(data, pdf_reader, images, max_image_dpi).items():
+            resampled, image_saved = _resampled(state, kept[name], images[name], scale)
+            saved += image_saved
+            if resampled is not None:
+                kept[NameObject(name)] = resampled
+
+    page_copy[NameObject('/Resources')] = new_resources
+    return page_copy, saved
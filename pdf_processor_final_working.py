@@ -1,13 +1,30 @@
 import streamlit as st
 import pandas as pd
-import PyPDF2
-import re
 import os
 import zipfile
 import time
+import hashlib
+import threading
 from pathlib import Path
 from io import BytesIO
 
+from policy_index import build_policy_index
+from policy_scanner import (iter_policy_runs, open_pdf_reader, page_count, scan_policy_pages, scan_uses_pool,
+                            spill_to_tmpfs)
+from policy_writer import (extract_bundled_policies, plan_policy_output, write_policy_pdf, write_policy_pdfs,
+                           write_print_bundle, write_uses_pool)
+from scan_cache import ScanCache
+from pdf_stream_merge import StreamingPdfWriter, merge_volumes
+from policy_manifest import discard_manifest, load_manifest, plan_incremental, policy_fingerprint, save_manifest
+from production_config import ProductionConfig
+from send_emails_brevo import DEFAULT_EXCEL_FILE, DEFAULT_PDF_FOLDER
+from send_events import format_event, open_event_pipe, read_events
+from sender_daemon import submit_send_job
+from send_ledger import SendLedger
+
+# Send ledger campaign used by the email sender (its default Excel file name)
+EMAIL_CAMPAIGN = "Compile CBOpt Nov25"
+
 # Set page config
 st.set_page_config(
     page_title="PDF Policy Processor",
@@ -21,39 +38,37 @@ if 'results' not in st.session_state:
 if 'processing_done' not in st.session_state:
     st.session_state.processing_done = False
 
-def process_uploaded_files(pdf_file, excel_file, progress_bar, status_text):
-    """Process uploaded PDF and Excel files"""
-    
-    # Save uploaded files to current directory
-    pdf_path = "temp_uploaded.pdf"
-    excel_path = "temp_uploaded.xlsx"
-    
-    with open(pdf_path, "wb") as f:
-        f.write(pdf_file.getvalue())
+def process_uploaded_files(pdf_file, excel_file, progress_bar, status_text, pdf_workers=1,
+                           header_only=False, streaming=False, incremental=False, print_bundle=False):
+    """Process uploaded PDF and Excel files
     
-    with open(excel_path, "wb") as f:
-        f.write(excel_file.getvalue())
+    With ``print_bundle`` the policies without email go straight from the
+    uploaded PDF into policies_print_bundle.pdf instead of one file each.
+    """
     
-    # Read Excel data
+    # Read Excel data straight from the upload buffer
     try:
-        df = pd.read_excel(excel_path)
+        excel_file.seek(0)
+        df = pd.read_excel(excel_file)
         st.success(f"✅ Excel file loaded: {len(df)} policies found")
     except Exception as e:
         st.error(f"❌ Error reading Excel file: {e}")
         return None
     
-    # Read PDF and keep file open during processing
+    # Index the Excel rows once so each policy lookup is a dict hit
+    policy_index = build_policy_index(df)
+    index_problems = policy_index.problems()
+    if index_problems:
+        st.warning(f"⚠️ {len(index_problems)} duplicate or ambiguous policy numbers in Excel")
+        with st.expander("📋 Duplicate / ambiguous policy numbers"):
+            for message in index_problems:
+                st.text(f"• {message}")
+    
+    # Read PDF straight from the upload buffer (no temp file copy)
     try:
-        pdf_file_handle = open(pdf_path, 'rb')
-        
-        # Handle both old and new PyPDF2 versions
-        try:
-            pdf_reader = PyPDF2.PdfReader(pdf_file_handle)
-            total_pages = len(pdf_reader.pages)
-        except AttributeError:
-            # Older PyPDF2 version
-            pdf_reader = PyPDF2.PdfFileReader(pdf_file_handle)
-            total_pages = pdf_reader.numPages
+        pdf_file.seek(0)
+        pdf_reader = open_pdf_reader(pdf_file)
+        total_pages = page_count(pdf_reader)
         
         st.success(f"✅ PDF file loaded: {total_pages} pages")
     except Exception as e:
@@ -64,76 +79,188 @@ def process_uploaded_files(pdf_file, excel_file, progress_bar, status_text):
     os.makedirs("policies_with_email", exist_ok=True)
     os.makedirs("policies_without_email", exist_ok=True)
     
-    # Clean old PDF files from previous sessions
-    import glob
-    for old_file in glob.glob("policies_with_email/*.pdf"):
-        os.remove(old_file)
-    for old_file in glob.glob("policies_without_email/*.pdf"):
-        os.remove(old_file)
+    # Incremental runs compare against the last manifest instead of starting over
+    previous_manifest = load_manifest() if incremental else None
+    if incremental and previous_manifest is None:
+        st.info("ℹ️ No previous run manifest found - doing a full rebuild")
     
-    st.info("🧹 Cleaned old PDF files from previous sessions")
+    if previous_manifest is None:
+        # Clean old PDF files from previous sessions
+        import glob
+        for old_file in glob.glob("policies_with_email/*.pdf"):
+            os.remove(old_file)
+        for old_file in glob.glob("policies_without_email/*.pdf"):
+            os.remove(old_file)
+        
+        st.info("🧹 Cleaned old PDF files from previous sessions")
+    else:
+        # Incremental runs write through the manifest-driven write stage
+        streaming = False
     
-    # First pass: collect all pages for each policy
-    policy_pages = {}  # Dictionary to store policy_number -> list of pages
+    if print_bundle:
+        # Individual files for these come from the bundle, only when asked for
+        import glob
+        for old_file in glob.glob("policies_without_email/*.pdf"):
+            os.remove(old_file)
     
-    status_text.text("🔍 Scanning PDF for policies...")
+    known_policies = [record.policy_no for record in policy_index.records]
+    
+    # Re-uploads of the same PDF reuse the page assignments of the last scan
+    pdf_sha256 = hashlib.sha256(pdf_file.getbuffer()).hexdigest()
+    scan_cache = ScanCache()
+    cache_key = scan_cache.make_key(pdf_sha256, known_policies, header_only)
+    policy_pages = scan_cache.get(cache_key)
+    policies_written = False
+    # Bytes compaction kept out of each policy file (a rewritten policy counts once)
+    compact_saved = {}
+    
+    # Worker processes need a file; the upload is spilled to tmpfs only once a pool will open it
+    pdf_path = None
     
     try:
-        for page_num in range(total_pages):
-            progress_bar.progress((page_num + 1) / (total_pages * 2))  # First half of progress
-            status_text.text(f"📄 Scanning page {page_num + 1}/{total_pages}")
+        if policy_pages is not None:
+            st.info(f"⚡ Same PDF scanned before - reusing page assignments for {len(policy_pages)} policies")
+        elif streaming:
+            # Single pass: write each policy as soon as its page run closes
+            status_text.text("🔍 Scanning and splitting PDF in one pass...")
             
-            # Handle both old and new PyPDF2 versions
-            try:
-                page = pdf_reader.pages[page_num]
-                text = page.extract_text()
-            except AttributeError:
-                # Older PyPDF2 version
-                page = pdf_reader.getPage(page_num)
-                text = page.extractText()
+            policy_pages = {}
+            runs = iter_policy_runs(
+                pdf_reader,
+                total_pages,
+                known_policies=known_policies,
+                header_only=header_only
+            )
+            for policy_number, pages in runs:
+                progress_bar.progress((pages[-1] + 1) / total_pages)
+                
+                if policy_number in policy_pages:
+                    # Non-contiguous repeat: merge with the earlier run and rewrite
+                    policy_pages[policy_number].extend(pages)
+                    status_text.text(f"🔁 Merging pages for policy {policy_number} ({len(policy_pages[policy_number])} pages)")
+                else:
+                    policy_pages[policy_number] = pages
+                    status_text.text(f"💾 Creating PDF for policy {policy_number} ({len(pages)} pages)")
+                
+                if print_bundle and not plan_policy_output(policy_number, pages, policy_index)['has_email']:
+                    continue  # Goes into the print bundle once the scan is done
+                result = save_policy_pdf(pdf_reader, policy_pages[policy_number], policy_number, policy_index)
+                compact_saved[policy_number] = result['compact_saved']
             
-            # Look for policy numbers (both formats: 00407/0054316 and 29031933)
-            policy_patterns = [
-                r'\b\d{5}/\d{7}\b',  # Format: 00407/0054316
-                r'\b\d{8}\b'         # Format: 29031933
+            policies_found = len(policy_pages)
+            policies_written = True
+            scan_cache.put(cache_key, pdf_sha256, total_pages, policy_pages)
+            # Fingerprinting would read every page again - the next incremental run rebuilds instead
+            discard_manifest()
+        else:
+            # First pass: collect all pages for each policy
+            status_text.text("🔍 Scanning PDF for policies...")
+            
+            def report_scan_progress(pages_done):
+                progress_bar.progress(pages_done / (total_pages * 2))  # First half of progress
+                status_text.text(f"📄 Scanning page {pages_done}/{total_pages}")
+            
+            if scan_uses_pool(total_pages, pdf_workers):
+                status_text.text(f"🔍 Scanning PDF for policies with {pdf_workers} workers...")
+                pdf_path = spill_to_tmpfs(pdf_file.getbuffer())
+            
+            policy_pages = scan_policy_pages(
+                pdf_reader,
+                pdf_path,
+                total_pages,
+                max_workers=pdf_workers,
+                progress_callback=report_scan_progress,
+                known_policies=known_policies,
+                header_only=header_only
+            )
+            scan_cache.put(cache_key, pdf_sha256, total_pages, policy_pages)
+        
+        if not policies_written:
+            # Second pass: create PDFs for each policy
+            jobs = [
+                plan_policy_output(policy_number, pages, policy_index)
+                for policy_number, pages in policy_pages.items()
             ]
+            policies_found = len(jobs)
             
-            policy_match = None
-            for pattern in policy_patterns:
-                match = re.search(pattern, text)
-                if match:
-                    policy_match = match
-                    break
+            # Only rewrite policies whose pages or Excel row changed
+            fingerprints = {job['policy_number']: policy_fingerprint(pdf_reader, job) for job in jobs}
+            for job in jobs:
+                # Written into the PDF too - the sender keys its ledger on it
+                job['fingerprint'] = fingerprints[job['policy_number']]
+            jobs_to_write, unchanged, stale_paths, manifest_entries = plan_incremental(
+                previous_manifest or {}, jobs, fingerprints
+            )
+            for stale_path in stale_paths:
+                os.remove(stale_path)
+            jobs = jobs_to_write
+            if print_bundle:
+                jobs = [job for job in jobs if job['has_email']]
+            if previous_manifest is not None:
+                st.info(
+                    f"♻️ Incremental run: {len(jobs)} policies to write, "
+                    f"{unchanged} unchanged, {len(stale_paths)} old files removed"
+                )
+            
+            def report_write_progress(policies_done, policy_number):
+                progress_bar.progress(0.5 + policies_done / (len(jobs) * 2))  # Second half
+                status_text.text(f"💾 Created PDF for policy {policy_number} ({policies_done}/{len(jobs)})")
+            
+            if pdf_path is None and write_uses_pool(len(jobs), pdf_workers):
+                pdf_path = spill_to_tmpfs(pdf_file.getbuffer())
+            write_results = write_policy_pdfs(
+                pdf_reader,
+                pdf_path,
+                jobs,
+                max_workers=pdf_workers,
+                progress_callback=report_write_progress
+            )
+            save_manifest(manifest_entries)
+            compact_saved.update((result['policy_number'], result['compact_saved']) for result in write_results)
             
-            if policy_match:
-                policy_number = policy_match.group(0)
-                if policy_number not in policy_pages:
-                    policy_pages[policy_number] = []
-                policy_pages[policy_number].append(page_num)
-        
-        # Second pass: create PDFs for each policy
-        policies_found = 0
-        for policy_number, pages in policy_pages.items():
-            progress_bar.progress(0.5 + (policies_found + 1) / (len(policy_pages) * 2))  # Second half
-            status_text.text(f"💾 Creating PDF for policy {policy_number} ({len(pages)} pages)")
+            # Warnings come back with the results instead of from the workers
+            write_warnings = [warning for result in write_results for warning in result['warnings']]
+            if write_warnings:
+                st.warning(f"⚠️ {len(write_warnings)} warnings while creating policy PDFs")
+                with st.expander("📋 PDF creation warnings"):
+                    for warning in write_warnings:
+                        st.text(warning)
+        
+        # Policies without email: page ranges routed from the upload into one printable PDF
+        bundle = None
+        if print_bundle:
+            bundle_jobs = [
+                job for job in (
+                    plan_policy_output(policy_number, pages, policy_index)
+                    for policy_number, pages in policy_pages.items()
+                )
+                if not job['has_email']
+            ]
             
-            save_policy_pdf(pdf_reader, pages, policy_number, df)
-            policies_found += 1
+            def report_bundle_progress(policies_done, policy_number):
+                status_text.text(f"🖨️ Added policy {policy_number} to the print bundle "
+                                 f"({policies_done}/{len(bundle_jobs)})")
+            
+            if bundle_jobs:
+                bundle = write_print_bundle(pdf_reader, bundle_jobs, progress_callback=report_bundle_progress)
         
-    finally:
-        # Close the PDF file
-        pdf_file_handle.close()
+        # Excel policies with no pages in the PDF
+        missing_from_pdf = policy_index.missing_policies(policy_pages)
         
-        # Clean up temp files
-        try:
-            os.remove(pdf_path)
-            os.remove(excel_path)
-        except:
-            pass
+    finally:
+        # Clean up the spill file
+        if pdf_path:
+            try:
+                os.remove(pdf_path)
+            except OSError:
+                pass
     
     # Count results
     policies_with_email = len(list(Path("policies_with_email").glob("*.pdf")))
-    policies_without_email = len(list(Path("policies_without_email").glob("*.pdf")))
+    if bundle is not None:
+        policies_without_email = bundle['policies']
+    else:
+        policies_without_email = len(list(Path("policies_without_email").glob("*.pdf")))
     
     status_text.text("✅ Processing completed!")
     progress_bar.progress(1.0)
@@ -141,97 +268,20 @@ def process_uploaded_files(pdf_file, excel_file, progress_bar, status_text):
     return {
         'total_found': policies_found,
         'with_email': policies_with_email,
-        'without_email': policies_without_email
+        'without_email': policies_without_email,
+        'missing_from_pdf': missing_from_pdf,
+        'print_bundle': bundle,
+        'compact_saved': sum(compact_saved.values())
     }
 
-def save_policy_pdf(pdf_reader, page_numbers, policy_number, df):
+def save_policy_pdf(pdf_reader, page_numbers, policy_number, policy_index):
     """Save individual policy as PDF with password protection"""
+    job = plan_policy_output(policy_number, page_numbers, policy_index)
+    result = write_policy_pdf(pdf_reader, job)
     
-    # Check if policy has email and NIC
-    has_email = False
-    email = None
-    nic_password = None
-    
-    # Look for policy in Excel (try both formats) - using column names for flexibility
-    for _, row in df.iterrows():
-        # Get policy number from first column or 'Policy No' column
-        if 'Policy No' in df.columns:
-            excel_policy = str(row['Policy No']).strip()
-        else:
-            excel_policy = str(row.iloc[0]).strip()
-        
-        # Get email from 'Owner 1 Email' column or similar
-        excel_email = None
-        for email_col in ['Owner 1 Email', 'Email', 'Owner Email', 'email']:
-            if email_col in df.columns and pd.notna(row[email_col]):
-                excel_email = str(row[email_col]).strip()
-                break
-        
-        # Get NIC from 'NIC' column
-        excel_nic = None
-        if 'NIC' in df.columns and pd.notna(row['NIC']):
-            excel_nic = str(row['NIC']).strip()
-        
-        # Check if policies match (handle different formats)
-        if (excel_policy == policy_number or 
-            excel_policy.replace('/', '') == policy_number.replace('/', '') or
-            excel_policy.lstrip('0') == policy_number.lstrip('0')):
-            
-            if excel_email and '@' in excel_email:
-                has_email = True
-                email = excel_email
-            
-            if excel_nic:
-                nic_password = excel_nic
-            
-            break
-    
-    # Create new PDF - handle both old and new PyPDF2 versions
-    try:
-        from PyPDF2 import PdfWriter
-        writer = PdfWriter()
-        
-        for page_num in page_numbers:
-            try:
-                if page_num < len(pdf_reader.pages):
-                    writer.add_page(pdf_reader.pages[page_num])
-            except AttributeError:
-                # Older PyPDF2 version
-                if page_num < pdf_reader.numPages:
-                    writer.addPage(pdf_reader.getPage(page_num))
-    except ImportError:
-        # Very old PyPDF2 version
-        from PyPDF2 import PdfFileWriter
-        writer = PdfFileWriter()
-        
-        for page_num in page_numbers:
-            if page_num < pdf_reader.numPages:
-                writer.addPage(pdf_reader.getPage(page_num))
-    
-    # Add password protection ONLY if policy has email (will be sent electronically)
-    if has_email and nic_password:
-        try:
-            # For newer PyPDF2 versions
-            writer.encrypt(nic_password)
-        except AttributeError:
-            try:
-                # For older PyPDF2 versions
-                writer.encrypt(user_pwd=nic_password, owner_pwd=nic_password)
-            except:
-                # If encryption fails, continue without password
-                st.warning(f"⚠️ Could not encrypt PDF for policy {policy_number}")
-    elif has_email and not nic_password:
-        st.warning(f"⚠️ Policy {policy_number} has email but no NIC for password protection")
-    
-    # Save to appropriate folder
-    folder = "policies_with_email" if has_email else "policies_without_email"
-    # Replace invalid filename characters
-    safe_policy_number = policy_number.replace('/', '_').replace('\\', '_')
-    filename = f"{safe_policy_number}.pdf"
-    filepath = Path(folder) / filename
-    
-    with open(filepath, 'wb') as output_file:
-        writer.write(output_file)
+    for warning in result['warnings']:
+        st.warning(warning)
+    return result
 
 def create_download_zip(folder_path, zip_name):
     """Create ZIP file for download"""
@@ -288,8 +338,8 @@ def check_pdf_files_without_email():
                 return len(pdf_files)
     return 0
 
-def send_emails_via_subprocess():
-    """Send emails using subprocess to run the existing email script"""
+def send_emails_via_subprocess(replay_dead_letters=False):
+    """Send emails through the resident sender service, or a subprocess running the email script"""
     import subprocess
     import sys
     
@@ -302,147 +352,176 @@ def send_emails_via_subprocess():
     output_placeholder = st.empty()
     
     try:
-        # Prepare the command with automated flag
-        cmd = [sys.executable, "send_emails_brevo.py", "--automated"]
-        
-        # Set up environment variables
-        env = os.environ.copy()
-        env['BREVO_API_KEY'] = os.getenv('BREVO_API_KEY', '')
-        
-        if not env['BREVO_API_KEY']:
-            st.error("❌ BREVO_API_KEY not set. Please set your API key in environment variables.")
-            st.code("set BREVO_API_KEY=your-api-key-here")
-            return
+        output_lines = []
+        process = None
         
-        status_placeholder.info("🚀 Starting email sending process...")
-        
-        # Start the subprocess with UTF-8 encoding
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            env=env,
-            encoding='utf-8',
-            errors='replace'
-        )
+        # The resident sender starts at once with a warm Brevo client; without
+        # it, run the email script as a subprocess
+        try:
+            events = submit_send_job({
+                'campaign': EMAIL_CAMPAIGN,
+                'excel_path': str(Path(DEFAULT_EXCEL_FILE).resolve()),
+                'pdf_folder': str(Path(DEFAULT_PDF_FOLDER).resolve()),
+                'replay_dead_letters': replay_dead_letters,
+            })
+            status_placeholder.info("🚀 Email job handed to the sender service...")
+        except OSError:
+            events = None
+        
+        if events is None:
+            # Prepare the command with automated flag
+            cmd = [sys.executable, "send_emails_brevo.py", "--automated", "--campaign", EMAIL_CAMPAIGN]
+            if replay_dead_letters:
+                cmd.append("--replay-dead-letters")
+            
+            # Set up environment variables
+            env = os.environ.copy()
+            env['BREVO_API_KEY'] = os.getenv('BREVO_API_KEY', '')
+            
+            if not env['BREVO_API_KEY']:
+                st.error("❌ BREVO_API_KEY not set. Please set your API key in environment variables.")
+                st.code("set BREVO_API_KEY=your-api-key-here")
+                return
+            
+            status_placeholder.info("🚀 Starting email sending process...")
+            
+            # Start the subprocess with UTF-8 encoding; progress comes back as JSON
+            # events on a dedicated pipe, stdout is only shown as recent activity
+            popen_kwargs = {}
+            events_reader, events_write_fd = open_event_pipe(env, popen_kwargs)
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                bufsize=1,
+                env=env,
+                encoding='utf-8',
+                errors='replace',
+                **popen_kwargs
+            )
+            os.close(events_write_fd)
+            events = read_events(events_reader)
+            
+            # Drain stdout in the background so the sender never blocks on a full pipe
+            output_thread = threading.Thread(
+                target=lambda: output_lines.extend(line.rstrip() for line in process.stdout), daemon=True
+            )
+            output_thread.start()
         
         # Initialize counters and timing
         sent_count = 0
         failed_count = 0
         total_count = 0
-        output_lines = []
         failed_emails = []  # Track failed emails with details
         successful_emails = []  # Track successful emails
         start_time = time.time()
-        last_email_time = start_time
-        
-        # Read output in real-time
-        while True:
-            try:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    line = output.strip()
-                    output_lines.append(line)
-            except UnicodeDecodeError as e:
-                # Handle encoding errors gracefully
-                line = f"⚠️ Encoding error in output: {str(e)}"
-                output_lines.append(line)
+        last_render = 0.0
+        send_window = None  # Adaptive concurrency window reported by the sender
+        send_throughput = None
+        completed = False
+        
+        # Read events in real-time
+        for event in events:
+            kind = event.get('event')
+            if process is None:
+                # The service's own log is in its journal - show the events instead
+                output_lines.append(format_event(event))
+            if kind == 'start':
+                total_count = event['total']
+                progress_placeholder.info(f"📁 {total_count} policies to send for campaign '{event['campaign']}' "
+                                          f"({event['skipped']} already sent, {event['rejected']} rejected)")
+            elif kind == 'sent':
+                sent_count += 1
+                successful_emails.append({
+                    'email': event['email'],
+                    'policy': event['policy'],
+                    'timestamp': time.strftime("%H:%M:%S", time.localtime(event['time']))
+                })
+            elif kind == 'failed':
+                failed_count += 1
+                failed_emails.append({
+                    'email': event['email'],
+                    'policy': event['policy'],
+                    'reason': event['error'],
+                    'timestamp': time.strftime("%H:%M:%S", time.localtime(event['time']))
+                })
+            elif kind == 'retry':
+                status_placeholder.warning(f"🔁 Retry {event['attempt']} for policy {event['policy']} "
+                                           f"in {event['delay']:.1f}s - {event['error']}")
+            elif kind == 'window':
+                send_window, send_throughput = event['window'], event['throughput']
+            elif kind == 'done':
+                completed = True
+                status_placeholder.success("🎉 Email sending completed!")
+            elif kind == 'error':
+                status_placeholder.error(f"❌ {event['message']}")
+            
+            # Redraw a few times a second rather than on every event
+            if kind not in ('done', 'error') and time.time() - last_render < 0.25:
                 continue
-                
-                # Parse different types of output
-                if "✅ Sent to" in line:
-                    sent_count += 1
-                    last_email_time = time.time()
-                    
-                    # Extract email and policy info from success message
-                    import re
-                    match = re.search(r'Sent to (.+?) - Policy: (.+)', line)
-                    if match:
-                        email, policy = match.groups()
-                        successful_emails.append({
-                            'email': email.strip(),
-                            'policy': policy.strip(),
-                            'timestamp': time.strftime("%H:%M:%S")
-                        })
-                    
-                    status_placeholder.success(f"📧 Successfully sent email #{sent_count}")
-                    
-                elif "❌ Failed" in line or ("Error" in line and "@" in line):
-                    failed_count += 1
-                    
-                    # Extract failure details
-                    import re
-                    # Try to extract email and policy from failure message
-                    email_match = re.search(r'(?:Failed to send to|Error.*?)(.+?@.+?)(?:\s|$)', line)
-                    policy_match = re.search(r'Policy: (.+?)(?:\s|$)', line)
-                    
-                    failed_info = {
-                        'email': email_match.group(1).strip() if email_match else 'Unknown',
-                        'policy': policy_match.group(1).strip() if policy_match else 'Unknown',
-                        'reason': line.strip(),
-                        'timestamp': time.strftime("%H:%M:%S")
-                    }
-                    failed_emails.append(failed_info)
-                    
+            last_render = time.time()
+            if kind in ('sent', 'failed'):
+                if failed_count:
                     status_placeholder.error(f"❌ Email failed (Total failures: {failed_count})")
-                elif "📊 Loaded" in line and "policies" in line:
-                    # Extract total count from "📊 Loaded X policies from Excel"
-                    import re
-                    match = re.search(r'(\d+) policies', line)
-                    if match:
-                        total_count = int(match.group(1))
-                elif "📁 Found" in line and "PDF files" in line:
-                    progress_placeholder.info(line)
-                elif "🎉 EMAIL SENDING COMPLETED" in line:
-                    status_placeholder.success("🎉 Email sending completed!")
+                else:
+                    status_placeholder.success(f"📧 Successfully sent email #{sent_count}")
+            
+            # Update progress bar and metrics
+            if total_count > 0:
+                processed = sent_count + failed_count
+                progress = min(1.0, processed / total_count)
+                remaining = total_count - processed
                 
-                # Update progress bar and metrics
-                if total_count > 0:
-                    processed = sent_count + failed_count
-                    progress = processed / total_count
-                    remaining = total_count - processed
-                    
-                    # Calculate estimated time remaining
-                    elapsed_time = time.time() - start_time
-                    if processed > 0:
-                        avg_time_per_email = elapsed_time / processed
-                        eta_seconds = avg_time_per_email * remaining
-                        eta_minutes = int(eta_seconds // 60)
-                        eta_seconds = int(eta_seconds % 60)
-                        eta_text = f" (ETA: {eta_minutes}m {eta_seconds}s)" if remaining > 0 else " (Complete!)"
-                    else:
-                        eta_text = ""
-                    
-                    # Enhanced progress bar with detailed info
-                    progress_placeholder.progress(
-                        progress, 
-                        f"📊 Progress: {processed}/{total_count} emails processed ({progress*100:.1f}%){eta_text}"
-                    )
-                    
-                    # Real-time metrics
-                    with metrics_placeholder.container():
-                        col1, col2, col3, col4 = st.columns(4)
-                        with col1:
-                            st.metric("✅ Sent", sent_count, delta=None)
-                        with col2:
-                            st.metric("❌ Failed", failed_count, delta=None)
-                        with col3:
-                            st.metric("⏳ Remaining", remaining, delta=None)
-                        with col4:
-                            success_rate = (sent_count / processed * 100) if processed > 0 else 0
-                            st.metric("📈 Success Rate", f"{success_rate:.1f}%", delta=None)
+                # Calculate estimated time remaining
+                elapsed_time = time.time() - start_time
+                if processed > 0:
+                    avg_time_per_email = elapsed_time / processed
+                    eta_seconds = avg_time_per_email * remaining
+                    eta_minutes = int(eta_seconds // 60)
+                    eta_seconds = int(eta_seconds % 60)
+                    eta_text = f" (ETA: {eta_minutes}m {eta_seconds}s)" if remaining > 0 else " (Complete!)"
+                else:
+                    eta_text = ""
                 
-                # Show recent output with better formatting
-                if output_lines:
-                    recent_output = "\n".join(output_lines[-8:])  # Show last 8 lines
-                    output_placeholder.text_area("📋 Recent Activity:", recent_output, height=180)
-        
+                # Enhanced progress bar with detailed info
+                progress_placeholder.progress(
+                    progress, 
+                    f"📊 Progress: {processed}/{total_count} emails processed ({progress*100:.1f}%){eta_text}"
+                )
+                
+                # Real-time metrics
+                with metrics_placeholder.container():
+                    columns = st.columns(6 if send_window is not None else 4)
+                    with columns[0]:
+                        st.metric("✅ Sent", sent_count, delta=None)
+                    with columns[1]:
+                        st.metric("❌ Failed", failed_count, delta=None)
+                    with columns[2]:
+                        st.metric("⏳ Remaining", remaining, delta=None)
+                    with columns[3]:
+                        success_rate = (sent_count / processed * 100) if processed > 0 else 0
+                        st.metric("📈 Success Rate", f"{success_rate:.1f}%", delta=None)
+                    if send_window is not None:
+                        with columns[4]:
+                            st.metric("🚦 Send Window", f"{send_window:.1f}", delta=None,
+                                      help="Emails in flight, adjusted to Brevo's 429s and latency")
+                        with columns[5]:
+                            st.metric("⚡ Throughput", f"{send_throughput:.1f}/s", delta=None)
+            
+            # Show recent output with better formatting
+            if output_lines:
+                recent_output = "\n".join(output_lines[-8:])  # Show last 8 lines
+                output_placeholder.text_area("📋 Recent Activity:", recent_output, height=180)
+    
         # Wait for process to complete
-        return_code = process.wait()
+        if process is not None:
+            return_code = process.wait()
+            output_thread.join(timeout=5)
+        else:
+            return_code = 0 if completed else 1
+        if output_lines:
+            output_placeholder.text_area("📋 Recent Activity:", "\n".join(output_lines[-8:]), height=180)
         
         # Show final results with enhanced feedback
         total_time = time.time() - start_time
@@ -601,8 +680,8 @@ def send_emails_via_subprocess():
         st.error(f"❌ Error running email script: {str(e)}")
         st.exception(e)
 
-def merge_pdfs_for_printing():
-    """Merge PDFs without email addresses into a single printable file"""
+def merge_pdfs_for_printing(volumes=False):
+    """Merge PDFs without email addresses into a single printable file, or into print volumes"""
     st.subheader("🔗 Merging PDFs for Printing...")
     
     # Create placeholders for updates
@@ -643,6 +722,10 @@ def merge_pdfs_for_printing():
         
         status_placeholder.success(f"📁 Found {len(pdf_files)} PDF files to merge")
         
+        if volumes:
+            merge_print_volumes_ui(pdf_files, status_placeholder, progress_placeholder)
+            return
+        
         # Delete existing output file if it exists
         if os.path.exists(output_file):
             try:
@@ -656,9 +739,11 @@ def merge_pdfs_for_printing():
         # Initialize progress tracking
         progress_placeholder.progress(0, "Starting PDF merge...")
         
-        # Use PyPDF2 PdfFileMerger for robust merging
-        merger = PyPDF2.PdfFileMerger()
+        # Stream pages into the output as each file is appended - memory stays
+        # flat however many policies there are
+        merger = StreamingPdfWriter(output_file)
         successful_merges = 0
+        input_size = 0
         failed_files = []
         
         # Merge PDFs with progress updates
@@ -674,6 +759,7 @@ def merge_pdfs_for_printing():
                 # Add PDF to merger
                 merger.append(str(pdf_path))
                 successful_merges += 1
+                input_size += pdf_path.stat().st_size
                 
                 # Show details every 10 files or for small batches
                 if i % 10 == 0 or len(pdf_files) <= 20:
@@ -685,16 +771,15 @@ def merge_pdfs_for_printing():
                 continue
         
         if successful_merges == 0:
+            merger.abort()
             st.error("❌ No PDFs could be merged")
             return
         
-        # Write the merged PDF
+        # Finish the merged PDF
         status_placeholder.info("💾 Writing merged PDF file...")
         progress_placeholder.progress(0.95, "Finalizing merged PDF...")
         
         try:
-            with open(output_file, 'wb') as output:
-                merger.write(output)
             merger.close()
             
         except Exception as e:
@@ -708,8 +793,7 @@ def merge_pdfs_for_printing():
         # Count pages in final PDF
         try:
             with open(output_file, 'rb') as f:
-                reader = PyPDF2.PdfFileReader(f)
-                total_pages = reader.numPages
+                total_pages = page_count(open_pdf_reader(f))
         except:
             total_pages = "Unknown"
         
@@ -727,7 +811,9 @@ def merge_pdfs_for_printing():
         with col2:
             st.metric("📊 Total Pages", total_pages)
         with col3:
-            st.metric("💾 File Size", f"{file_size / 1024 / 1024:.1f} MB")
+            # Delta against the separate policy PDFs - shared fonts/images are stored once
+            st.metric("💾 File Size", f"{file_size / 1024 / 1024:.1f} MB",
+                      delta=f"{(file_size - input_size) / 1024 / 1024:+.1f} MB", delta_color="inverse")
         with col4:
             st.metric("❌ Failed", len(failed_files))
         
@@ -751,7 +837,9 @@ def merge_pdfs_for_printing():
             - **Output File**: {output_file}
             - **Successfully Merged**: {successful_merges} PDFs
             - **Total Pages**: {total_pages}
-            - **File Size**: {file_size / 1024 / 1024:.1f} MB
+            - **File Size**: {file_size / 1024 / 1024:.1f} MB (before merging: {input_size / 1024 / 1024:.1f} MB)
+            - **Duplicate Fonts/Images Shared**: {merger.stats['duplicates']}
+            - **Streams Compressed**: {merger.stats['compressed_streams']}
             """)
             
             if failed_files:
@@ -776,6 +864,64 @@ def merge_pdfs_for_printing():
         st.error(f"❌ Error during PDF merging: {str(e)}")
         st.exception(e)
 
+def merge_print_volumes_ui(pdf_files, status_placeholder, progress_placeholder):
+    """Build print volumes in parallel and offer each one for download"""
+    max_workers = ProductionConfig.worker_count()
+    status_placeholder.info(
+        f"📚 Building volumes of up to {ProductionConfig.PRINT_VOLUME_MAX_PAGES} pages / "
+        f"{ProductionConfig.PRINT_VOLUME_MAX_MB} MB with {max_workers} worker(s)..."
+    )
+    
+    def report_progress(done, total):
+        progress_placeholder.progress(done / total, f"Volume {done}/{total} written")
+    
+    volumes, index_path = merge_volumes(pdf_files, "policies_for_printing", max_workers=max_workers,
+                                        progress_callback=report_progress)
+    failed_files = [failure for volume in volumes for failure in volume['failed']]
+    
+    progress_placeholder.progress(1.0, "✅ Print volumes completed!")
+    st.success(f"🎉 Created {len(volumes)} print volumes!")
+    
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.metric("📚 Volumes", len(volumes))
+    with col2:
+        st.metric("📄 PDFs Merged", sum(len(volume['files']) for volume in volumes))
+    with col3:
+        st.metric("📊 Total Pages", sum(volume['pages'] for volume in volumes))
+    with col4:
+        st.metric("❌ Failed", len(failed_files))
+    input_size = sum(volume['input_size'] for volume in volumes)
+    output_size = sum(volume['size'] for volume in volumes)
+    st.caption(f"💾 {output_size / 1024 / 1024:.1f} MB in total, {input_size / 1024 / 1024:.1f} MB before merging - "
+               f"{sum(volume['stats']['duplicates'] for volume in volumes)} duplicate fonts/images shared")
+    
+    # One download per volume, in print order
+    for number, volume in enumerate(volumes, 1):
+        with open(volume['path'], 'rb') as f:
+            st.download_button(
+                label=f"📥 Volume {number}: {len(volume['files'])} policies, {volume['pages']} pages "
+                      f"({volume['size'] / 1024 / 1024:.1f} MB)",
+                data=f.read(),
+                file_name=os.path.basename(volume['path']),
+                mime="application/pdf",
+                key=f"download_volume_{number}",
+                use_container_width=True
+            )
+    with open(index_path, 'rb') as f:
+        st.download_button(
+            label="📋 Download Volume Index (CSV)",
+            data=f.read(),
+            file_name=os.path.basename(index_path),
+            mime="text/csv",
+            key="download_volume_index"
+        )
+    
+    if failed_files:
+        with st.expander("⚠️ Failed Files"):
+            for filename, error in failed_files:
+                st.text(f"• {filename}: {error}")
+
 def main():
     st.title("📄 PDF Policy Processor")
     st.markdown("Extract individual policies from merged PDF and organize by email availability")
@@ -795,6 +941,39 @@ def main():
         if excel_file:
             st.success(f"✅ Excel uploaded: {excel_file.name}")
     
+    # Processing options
+    st.sidebar.header("⚙️ Processing Options")
+    pdf_workers = st.sidebar.number_input(
+        "PDF workers",
+        min_value=1,
+        max_value=os.cpu_count() or 1,
+        value=ProductionConfig.worker_count(),
+        help="Processes used to scan pages and write policy PDFs (MAX_WORKERS). Use 1 on single-CPU servers."
+    )
+    header_only = st.sidebar.checkbox(
+        "Header-only policy detection",
+        value=False,
+        help="Read only the letter header to find the policy number; falls back to the full page when nothing matches."
+    )
+    streaming = st.sidebar.checkbox(
+        "Streaming split (single pass)",
+        value=False,
+        help="Write each policy PDF as soon as its pages end instead of scanning the whole PDF first, "
+             "dropping parsed PDF objects every STREAM_WINDOW_PAGES pages. Scans on one core; the next "
+             "incremental run does a full rebuild."
+    )
+    incremental = st.sidebar.checkbox(
+        "Incremental re-processing",
+        value=False,
+        help="Only rewrite policies whose pages, email or NIC changed since the last run. Overrides streaming split."
+    )
+    print_bundle = st.sidebar.checkbox(
+        "Build print bundle while splitting",
+        value=False,
+        help="Copy policies without email straight into one printable PDF instead of one file each. "
+             "Individual files can still be created from the bundle."
+    )
+    
     # Processing section
     if pdf_file and excel_file and not st.session_state.processing_done:
         st.markdown("---")
@@ -805,7 +984,14 @@ def main():
             
             # Process files
             with st.spinner("Processing files..."):
-                results = process_uploaded_files(pdf_file, excel_file, progress_bar, status_text)
+                results = process_uploaded_files(
+                    pdf_file, excel_file, progress_bar, status_text,
+                    pdf_workers=ProductionConfig.worker_count(pdf_workers),
+                    header_only=header_only,
+                    streaming=streaming,
+                    incremental=incremental,
+                    print_bundle=print_bundle
+                )
                 
                 # STORE IN SESSION STATE
                 st.session_state.results = results
@@ -829,6 +1015,21 @@ def main():
         with col3:
             st.metric("❌ Without Email", results['without_email'])
         
+        if results.get('compact_saved'):
+            st.caption(f"🗜️ Compacting the policy PDFs saved about "
+                       f"{results['compact_saved'] / 1024 / 1024:.1f} MB of unused fonts, images and "
+                       f"uncompressed content")
+        
+        missing_from_pdf = results.get('missing_from_pdf', [])
+        if missing_from_pdf:
+            st.warning(f"⚠️ {len(missing_from_pdf)} policies in the Excel file were not found in the PDF")
+            with st.expander("📋 Expected but not found in PDF"):
+                st.dataframe(
+                    pd.DataFrame({'Policy No': missing_from_pdf}),
+                    hide_index=True,
+                    use_container_width=True
+                )
+        
         # Download options
         st.markdown("---")
         st.subheader("📥 Download Results")
@@ -847,7 +1048,27 @@ def main():
                 )
         
         with col2:
-            if results['without_email'] > 0:
+            bundle = results.get('print_bundle')
+            if bundle and os.path.exists(bundle['path']):
+                with open(bundle['path'], 'rb') as f:
+                    st.download_button(
+                        label="🖨️ Download Print Bundle (Policies WITHOUT Email)",
+                        data=f.read(),
+                        file_name=os.path.basename(bundle['path']),
+                        mime="application/pdf",
+                        key="download_print_bundle"
+                    )
+                if st.button("📂 Create Individual PDFs", key="extract_bundle_btn"):
+                    extracted = extract_bundled_policies(bundle['index_path'])
+                    st.success(f"✅ Created {len(extracted)} individual PDFs from the bundle")
+                    st.download_button(
+                        label="❓ Download Policies WITHOUT Email",
+                        data=create_download_zip("policies_without_email", "policies_without_email.zip"),
+                        file_name="policies_without_email.zip",
+                        mime="application/zip",
+                        key="download_without_email"
+                    )
+            elif results['without_email'] > 0:
                 zip_data = create_download_zip("policies_without_email", "policies_without_email.zip")
                 st.download_button(
                     label="❓ Download Policies WITHOUT Email",
@@ -905,6 +1126,22 @@ def main():
             else:
                 st.button("📧 Send Emails Now", disabled=True, use_container_width=True)
                 st.caption("⚠️ Upload and process files first")
+            
+            # Sends that ran out of retries (Brevo outages, rate limits)
+            try:
+                dead_letters = SendLedger().dead_letters(EMAIL_CAMPAIGN)
+            except Exception:
+                dead_letters = []
+            if dead_letters:
+                st.warning(f"📮 {len(dead_letters)} emails failed after all retries")
+                with st.expander("📋 Dead letters"):
+                    st.dataframe(
+                        pd.DataFrame(dead_letters)[['policy_number', 'email', 'attempts', 'error']],
+                        hide_index=True,
+                        use_container_width=True
+                    )
+                if st.button("🔁 Replay Dead Letters", use_container_width=True):
+                    send_emails_via_subprocess(replay_dead_letters=True)
         
         # PDF Merging Section for Printing
         st.markdown("---")
@@ -912,6 +1149,11 @@ def main():
         
         # Check if we have PDFs without email addresses
         pdf_without_email_count = check_pdf_files_without_email()
+        bundle = st.session_state.results.get('print_bundle')
+        if bundle and os.path.exists(bundle['path']):
+            st.success(f"✅ Print bundle built while splitting: {bundle['policies']} policies, "
+                       f"{bundle['pages']} pages ({bundle['size'] / 1024 / 1024:.1f} MB) - "
+                       f"download it from the results above")
         
         col1, col2 = st.columns(2)
         
@@ -926,8 +1168,14 @@ def main():
         with col2:
             st.subheader("🔗 Merge PDFs")
             if pdf_without_email_count > 0:
+                split_volumes = st.checkbox(
+                    "📚 Split into print volumes",
+                    value=False,
+                    help="Several smaller PDFs (PRINT_VOLUME_MAX_PAGES pages / PRINT_VOLUME_MAX_MB MB each) "
+                         "built in parallel, with an index of which policy is in which volume"
+                )
                 if st.button("🖨️ Create Printable PDF", type="secondary", use_container_width=True):
-                    merge_pdfs_for_printing()
+                    merge_pdfs_for_printing(volumes=split_volumes)
             else:
                 st.button("🖨️ Create Printable PDF", disabled=True, use_container_width=True)
                 st.caption("⚠️ No PDFs without email addresses to merge")
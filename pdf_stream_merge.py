@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+"""
+Streaming PDF merge - pages are written to the output as they are appended
+
+PdfFileMerger keeps every source document's object graph in memory until
+write(); this writer copies each appended page's objects straight to the
+output file and drops the source reader afterwards. Only the page and
+object offsets (eight bytes each) are kept until the xref is written,
+plus a digest per font or image that later policies can share.
+"""
+import io
+import os
+import csv
+import zlib
+import hashlib
+import glob
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2.generic import (ArrayObject, DecodedStreamObject, DictionaryObject, EncodedStreamObject,
+                            IndirectObject, NameObject, NullObject, NumberObject, StreamObject)
+
+from policy_scanner import open_pdf_reader, page_count
+from production_config import ProductionConfig
+
+# Page attributes a page may inherit from its /Pages ancestors
+INHERITABLE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+CATALOG_ID = 1
+PAGES_ID = 2
+
+# Non-stream objects shared between policies when identical (fonts and their parts)
+SHARED_TYPES = ('/Font', '/FontDescriptor', '/Encoding', '/ExtGState', '/Pattern', '/Shading')
+
+# Objects packed into each compressed object stream
+OBJECT_STREAM_SIZE = 200
+
+
+def _get_object(obj):
+    """Resolve an indirect object - handle both old and new PyPDF2 versions"""
+    try:
+        return obj.get_object()
+    except AttributeError:
+        return obj.getObject()
+
+
+def _write_object(obj, stream):
+    try:
+        obj.write_to_stream(stream, None)
+    except AttributeError:
+        # Older PyPDF2 version
+        obj.writeToStream(stream, None)
+
+
+def _get_page(pdf_reader, page_num):
+    try:
+        return pdf_reader.pages[page_num]
+    except AttributeError:
+        return pdf_reader.getPage(page_num)
+
+
+class StreamingPdfWriter:
+    """Append PDFs (or page ranges of an open reader) straight into one output file
+
+    Objects are numbered as they are first referenced, so every source
+    object shared by the appended pages is written once per source.
+    Page objects are inlined with the attributes they inherit, because
+    the output has a single flat page tree.
+
+    With ``optimize`` (default PRINT_OPTIMIZE) the output is compacted as
+    it is written: fonts, images, form XObjects and other streams that
+    are identical to one already written become references to it,
+    uncompressed streams are Flate-compressed, and the remaining objects
+    are packed into compressed object streams with an xref stream.
+    """
+
+    def __init__(self, output_path, optimize=None):
+        self.output_path = output_path
+        self.optimize = ProductionConfig.PRINT_OPTIMIZE if optimize is None else optimize
+        self.page_ids = array('q')
+        # Byte offset per object number (-1 until written); object 0 is the
+        # free-list head, 1 and 2 are the catalog and page tree written on close.
+        # For an object inside an object stream: the stream's number and the index in it
+        self._offsets = array('q', [-1, -1, -1])
+        self._containers = array('q', [-1, -1, -1])
+        self._file = open(output_path, 'wb')
+        self._file.write(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        self._ids = {}
+        self._pending = []
+        # Content digest -> output object, for objects worth sharing
+        self._shared = {}
+        self._claimed = {}
+        self._digests = {}
+        self._batch = []
+        self.stats = {'duplicates': 0, 'duplicate_bytes': 0, 'compressed_streams': 0,
+                      'compression_saved': 0, 'object_streams': 0}
+
+    @property
+    def pages_written(self):
+        return len(self.page_ids)
+
+    def _allocate(self):
+        self._offsets.append(-1)
+        self._containers.append(-1)
+        return len(self._offsets) - 1
+
+    def _digest(self, obj, visiting):
+        """Content hash of an object and everything it references, or None
+
+        None for anything that reaches a page (its meaning depends on
+        where it sits) or a reference cycle.
+        """
+        if isinstance(obj, IndirectObject):
+            key = (obj.idnum, obj.generation)
+            if key in self._digests:
+                return self._digests[key]
+            if key in visiting:
+                return None
+            target = _get_object(obj)
+            if isinstance(target, DictionaryObject) and target.get('/Type') in ('/Page', '/Pages'):
+                digest = None
+            else:
+                visiting.add(key)
+                digest = self._digest(target, visiting)
+                visiting.discard(key)
+            self._digests[key] = digest
+            return digest
+
+        digest = hashlib.blake2b(digest_size=16)
+        if isinstance(obj, DictionaryObject):
+            digest.update(b'S' if isinstance(obj, StreamObject) else b'D')
+            for key in sorted(obj.keys()):
+                if key == '/Length':
+                    continue
+                value = self._digest(obj[key], visiting)
+                if value is None:
+                    return None
+                digest.update(key.encode('utf-8', 'replace') + b'\0' + value)
+            if isinstance(obj, StreamObject):
+                digest.update(obj._data)
+        elif isinstance(obj, ArrayObject):
+            digest.update(b'A')
+            for item in obj:
+                value = self._digest(item, visiting)
+                if value is None:
+                    return None
+                digest.update(value)
+        else:
+            buffer = io.BytesIO()
+            _write_object(obj, buffer)
+            digest.update(b'P' + buffer.getvalue())
+        return digest.digest()
+
+    def _ref(self, ref):
+        """Output reference for a source reference, queueing the object for writing"""
+        key = (ref.idnum, ref.generation)
+        new_id = self._ids.get(key)
+        if new_id is None:
+            target = _get_object(ref)
+            # Pages that are not being copied (and page tree nodes) become null
+            if isinstance(target, DictionaryObject) and target.get('/Type') in ('/Page', '/Pages'):
+                return NullObject()
+            digest = None
+            if self.optimize and (isinstance(target, StreamObject) or
+                                  (isinstance(target, DictionaryObject) and target.get('/Type') in SHARED_TYPES)):
+                digest = self._digest(ref, set())
+                shared = self._shared.get(digest, self._claimed.get(digest)) if digest else None
+                if shared is not None:
+                    # Same font / image / XObject as one already in the output
+                    self._ids[key] = shared
+                    self.stats['duplicates'] += 1
+                    self.stats['duplicate_bytes'] += len(target._data) if isinstance(target, StreamObject) else 0
+                    return IndirectObject(shared, 0, None)
+            new_id = self._allocate()
+            self._ids[key] = new_id
+            if digest:
+                self._claimed[digest] = new_id
+            self._pending.append((new_id, target))
+        return IndirectObject(new_id, 0, None)
+
+    def _remap(self, obj):
+        """Copy of a source object with its references renumbered for the output"""
+        if isinstance(obj, IndirectObject):
+            return self._ref(obj)
+        if isinstance(obj, StreamObject):
+            copy = EncodedStreamObject() if '/Filter' in obj else DecodedStreamObject()
+            copy._data = obj._data
+            if self.optimize and '/Filter' not in obj and len(obj._data) > 64:
+                compressed = zlib.compress(obj._data, 6)
+                if len(compressed) < len(obj._data):
+                    copy = EncodedStreamObject()
+                    copy._data = compressed
+                    copy[NameObject('/Filter')] = NameObject('/FlateDecode')
+                    self.stats['compressed_streams'] += 1
+                    self.stats['compression_saved'] += len(obj._data) - len(compressed)
+            for key, value in obj.items():
+                if key != '/Length':
+                    copy[NameObject(key)] = self._remap(value)
+            return copy
+        if isinstance(obj, DictionaryObject):
+            copy = DictionaryObject()
+            for key, value in obj.items():
+                copy[NameObject(key)] = self._remap(value)
+            return copy
+        if isinstance(obj, ArrayObject):
+            return ArrayObject([self._remap(value) for value in obj])
+        return obj
+
+    def _write_direct(self, object_id, obj):
+        self._offsets[object_id] = self._file.tell()
+        self._file.write(f"{object_id} 0 obj\n".encode('ascii'))
+        _write_object(obj, self._file)
+        self._file.write(b"\nendobj\n")
+
+    def _emit(self, object_id, obj):
+        if not self.optimize or isinstance(obj, StreamObject):
+            self._write_direct(object_id, obj)
+            return
+        # Small objects wait for the next object stream
+        buffer = io.BytesIO()
+        _write_object(obj, buffer)
+        self._batch.append((object_id, buffer.getvalue()))
+        if len(self._batch) >= OBJECT_STREAM_SIZE:
+            self._flush_object_stream()
+
+    def _flush_object_stream(self):
+        if not self._batch:
+            return
+        stream_id = self._allocate()
+        header = []
+        offset = 0
+        for index, (object_id, body) in enumerate(self._batch):
+            header.append(f"{object_id} {offset}")
+            offset += len(body) + 1
+            self._containers[object_id] = stream_id
+            self._offsets[object_id] = index
+        header = (" ".join(header) + "\n").encode('ascii')
+        stream = EncodedStreamObject()
+        stream._data = zlib.compress(header + b"\n".join(body for _, body in self._batch) + b"\n", 6)
+        stream[NameObject('/Type')] = NameObject('/ObjStm')
+        stream[NameObject('/N')] = NumberObject(len(self._batch))
+        stream[NameObject('/First')] = NumberObject(len(header))
+        stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+        self._write_direct(stream_id, stream)
+        self._batch = []
+        self.stats['object_streams'] += 1
+
+    def _drain(self):
+        while self._pending:
+            object_id, obj = self._pending.pop()
+            self._emit(object_id, self._remap(obj))
+
+    def _page_dict(self, page):
+        copy = DictionaryObject()
+        for key, value in page.items():
+            if key != '/Parent':
+                copy[NameObject(key)] = self._remap(value)
+        # Inline what the page inherits from its /Pages ancestors
+        parent = page.get('/Parent')
+        while parent is not None and any(key not in copy for key in INHERITABLE_ATTRIBUTES):
+            parent = _get_object(parent)
+            for key in INHERITABLE_ATTRIBUTES:
+                if key not in copy and key in parent:
+                    copy[NameObject(key)] = self._remap(parent[key])
+            parent = parent.get('/Parent')
+        copy[NameObject('/Parent')] = IndirectObject(PAGES_ID, 0, None)
+        return copy
+
+    def append_pages(self, pdf_reader, page_numbers=None):
+        """Copy pages of an open reader; returns the number of pages written
+
+        Page ids are reserved up front, so links and annotations that
+        point at another copied page resolve to its new number.
+        """
+        if page_numbers is None:
+            page_numbers = range(page_count(pdf_reader))
+        pages = [_get_page(pdf_reader, page_num) for page_num in page_numbers]
+        new_ids = []
+        for page in pages:
+            new_id = self._allocate()
+            new_ids.append(new_id)
+            reference = getattr(page, 'indirect_reference', None) or getattr(page, 'indirect_ref', None)
+            if reference is not None:
+                self._ids[(reference.idnum, reference.generation)] = new_id
+
+        try:
+            for new_id, page in zip(new_ids, pages):
+                self._emit(new_id, self._page_dict(page))
+                self._drain()
+            # Shareable from now on - a failed document's objects never are
+            self._shared.update(self._claimed)
+        finally:
+            # Source numbering means nothing for the next reader
+            self._ids = {}
+            self._pending = []
+            self._claimed = {}
+            self._digests = {}
+        # Only complete documents join the page tree; a failed one leaves unused objects
+        self.page_ids.extend(new_ids)
+        return len(new_ids)
+
+    def append(self, pdf_path):
+        """Copy every page of a PDF file, closing it again straight away"""
+        with open(pdf_path, 'rb') as f:
+            return self.append_pages(open_pdf_reader(f))
+
+    def close(self):
+        """Write the page tree, catalog, xref and trailer"""
+        if self._file is None:
+            return
+        # The Kids array is written in slices rather than built as one object
+        self._offsets[PAGES_ID] = self._file.tell()
+        self._file.write(f"{PAGES_ID} 0 obj\n<< /Type /Pages /Count {len(self.page_ids)} /Kids [".encode('ascii'))
+        for start in range(0, len(self.page_ids), 1000):
+            chunk = self.page_ids[start:start + 1000]
+            self._file.write("".join(f"{page_id} 0 R " for page_id in chunk).encode('ascii'))
+        self._file.write(b"] >>\nendobj\n")
+        self._emit(CATALOG_ID, DictionaryObject({
+            NameObject('/Type'): NameObject('/Catalog'),
+            NameObject('/Pages'): IndirectObject(PAGES_ID, 0, None),
+        }))
+
+        if self.optimize:
+            self._flush_object_stream()
+            xref_offset = self._write_xref_stream()
+        else:
+            xref_offset = self._file.tell()
+            self._file.write(f"xref\n0 {len(self._offsets)}\n".encode('ascii'))
+            self._file.write(b"0000000000 65535 f \n")
+            for offset in self._offsets[1:]:
+                # Objects reserved for a document that failed part-way are left free
+                entry = f"{offset:010d} 00000 n \n" if offset >= 0 else "0000000000 00000 f \n"
+                self._file.write(entry.encode('ascii'))
+            self._file.write(f"trailer\n<< /Size {len(self._offsets)} /Root {CATALOG_ID} 0 R >>\n".encode('ascii'))
+        self._file.write(f"startxref\n{xref_offset}\n%%EOF\n".encode('ascii'))
+        self._file.close()
+        self._file = None
+
+    def _write_xref_stream(self):
+        """Cross-reference stream - needed to point into object streams"""
+        xref_id = self._allocate()
+        xref_offset = self._file.tell()
+        self._offsets[xref_id] = xref_offset
+        width = max(1, (max(xref_offset, len(self._offsets)).bit_length() + 7) // 8)
+        rows = bytearray()
+        for object_id, (offset, container) in enumerate(zip(self._offsets, self._containers)):
+            if object_id == 0:
+                rows += b'\x00' + bytes(width) + b'\xff\xff'
+            elif container >= 0:
+                rows += b'\x02' + container.to_bytes(width, 'big') + offset.to_bytes(2, 'big')
+            elif offset >= 0:
+                rows += b'\x01' + offset.to_bytes(width, 'big') + b'\x00\x00'
+            else:
+                # Objects reserved for a document that failed part-way are left free
+                rows += b'\x00' + bytes(width) + b'\x00\x00'
+        stream = EncodedStreamObject()
+        stream._data = zlib.compress(bytes(rows), 6)
+        stream[NameObject('/Type')] = NameObject('/XRef')
+        stream[NameObject('/Size')] = NumberObject(len(self._offsets))
+        stream[NameObject('/W')] = ArrayObject([NumberObject(1), NumberObject(width), NumberObject(2)])
+        stream[NameObject('/Root')] = IndirectObject(CATALOG_ID, 0, None)
+        stream[NameObject('/Filter')] = NameObject('/FlateDecode')
+        self._write_direct(xref_id, stream)
+        return xref_offset
+
+    def abort(self):
+        """Close and delete a partial output"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def _file_page_count(pdf_path):
+    with open(pdf_path, 'rb') as f:
+        return page_count(open_pdf_reader(f))
+
+
+def plan_volumes(pdf_files, max_pages=None, max_mb=None):
+    """Split sorted PDF files into volumes of at most ``max_pages`` pages / ``max_mb`` MB
+
+    A volume closes before the file that would push it over either limit
+    (0 = no limit); a single file larger than a limit gets a volume of
+    its own. File sizes stand in for the merged size. Files that cannot
+    be read are kept, with 0 pages, so the merge reports them.
+    """
+    max_pages = ProductionConfig.PRINT_VOLUME_MAX_PAGES if max_pages is None else max_pages
+    max_mb = ProductionConfig.PRINT_VOLUME_MAX_MB if max_mb is None else max_mb
+    max_bytes = max_mb * 1024 * 1024
+
+    volumes = []
+    current, pages, size = [], 0, 0
+    for pdf_path in pdf_files:
+        try:
+            file_pages = _file_page_count(pdf_path)
+        except Exception:
+            file_pages = 0
+        file_size = os.path.getsize(pdf_path)
+        if current and ((max_pages and pages + file_pages > max_pages) or
+                        (max_bytes and size + file_size > max_bytes)):
+            volumes.append(current)
+            current, pages, size = [], 0, 0
+        current.append(str(pdf_path))
+        pages += file_pages
+        size += file_size
+    if current:
+        volumes.append(current)
+    return volumes
+
+
+def merge_volume(output_path, pdf_files):
+    """Merge one volume; returns what went where for the index
+
+    Runs in a worker process, so errors are reported rather than shown.
+    """
+    contents = []
+    failed = []
+    input_size = 0
+    with StreamingPdfWriter(output_path) as writer:
+        for pdf_path in pdf_files:
+            first_page = writer.pages_written
+            try:
+                writer.append(pdf_path)
+            except Exception as e:
+                failed.append((os.path.basename(pdf_path), str(e)))
+                continue
+            contents.append((os.path.basename(pdf_path), first_page + 1, writer.pages_written - first_page))
+            input_size += os.path.getsize(pdf_path)
+        total_pages = writer.pages_written
+    return {
+        'path': output_path,
+        'files': contents,
+        'failed': failed,
+        'pages': total_pages,
+        'size': os.path.getsize(output_path),
+        'input_size': input_size,
+        'stats': writer.stats,
+    }
+
+
+def merge_volumes(pdf_files, output_prefix, max_pages=None, max_mb=None, max_workers=1, progress_callback=None):
+    """Merge sorted PDF files into numbered print volumes, several at a time
+
+    Volumes are ``<output_prefix>_vol001.pdf``, ... in the order of
+    ``pdf_files``, built by a process pool when ``max_workers`` > 1, and
+    ``<output_prefix>_index.csv`` lists each file's volume and first page.
+    Returns ``(volumes, index_path)`` with the volume results in order.
+    """
+    # Volumes left over from a longer earlier run would look like part of this one
+    for old_volume in glob.glob(f"{glob.escape(output_prefix)}_vol*.pdf"):
+        os.remove(old_volume)
+    plan = plan_volumes(pdf_files, max_pages, max_mb)
+    outputs = [f"{output_prefix}_vol{number:03d}.pdf" for number in range(1, len(plan) + 1)]
+
+    if max_workers <= 1 or len(plan) <= 1:
+        volumes = []
+        for output_path, files in zip(outputs, plan):
+            volumes.append(merge_volume(output_path, files))
+            if progress_callback:
+                progress_callback(len(volumes), len(plan))
+    else:
+        # Streamlit runs scripts on threads, so spawn workers instead of forking
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(merge_volume, output_path, files) for output_path, files in zip(outputs, plan)]
+            volumes = []
+            for future in futures:
+                volumes.append(future.result())
+                if progress_callback:
+                    progress_callback(len(volumes), len(plan))
+
+    index_path = f"{output_prefix}_index.csv"
+    with open(index_path, 'w', newline='') as f:
+        index = csv.writer(f)
+        index.writerow(['volume', 'file', 'first_page', 'pages'])
+        for volume in volumes:
+            for name, first_page, pages in volume['files']:
+                index.writerow([os.path.basename(volume['path']), name, first_page, pages])
+    return volumes, index_path
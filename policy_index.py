@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Policy lookup index built once per run from the Excel policy list
+"""
+import pandas as pd
+
+# Candidate columns, in order of preference
+EMAIL_COLUMNS = ['Owner 1 Email', 'Email', 'Owner Email', 'email']
+NIC_COLUMN = 'NIC'
+POLICY_COLUMN = 'Policy No'
+
+
+def normalize_policy_keys(policy_number):
+    """Return the (exact, slash-stripped, zero-stripped) forms of a policy number"""
+    policy_number = str(policy_number).strip()
+    return (
+        policy_number,
+        policy_number.replace('/', ''),
+        policy_number.lstrip('0'),
+    )
+
+
+class PolicyRecord:
+    """Email/NIC details for one Excel row"""
+    __slots__ = ('policy_no', 'email', 'nic', 'row_id')
+
+    def __init__(self, policy_no, email, nic, row_id):
+        self.policy_no = policy_no
+        self.email = email
+        self.nic = nic
+        self.row_id = row_id
+
+    @property
+    def has_email(self):
+        return bool(self.email) and '@' in self.email
+
+    def __repr__(self):
+        return f"PolicyRecord({self.policy_no!r}, email={self.email!r}, nic={self.nic!r}, row={self.row_id})"
+
+
+class PolicyIndex:
+    """O(1) policy lookup using the same three matching rules as the Excel scan"""
+
+    def __init__(self, records, exact, no_slash, no_zero, duplicates, ambiguous):
+        self.records = records
+        self._exact = exact
+        self._no_slash = no_slash
+        self._no_zero = no_zero
+        # policy number -> row ids sharing that exact policy number
+        self.duplicates = duplicates
+        # normalized key -> distinct policy numbers that collapse onto it
+        self.ambiguous = ambiguous
+
+    def __len__(self):
+        return len(self.records)
+
+    def lookup(self, policy_number):
+        """Find the Excel row for a policy number found in the PDF
+
+        Matches the old row-by-row scan: the first row (in Excel order) that
+        matches on the exact, slash-stripped or zero-stripped form wins.
+        """
+        exact, no_slash, no_zero = normalize_policy_keys(policy_number)
+        candidates = [
+            self._exact.get(exact),
+            self._no_slash.get(no_slash),
+            self._no_zero.get(no_zero) if no_zero else None,
+        ]
+        candidates = [row_id for row_id in candidates if row_id is not None]
+        if not candidates:
+            return None
+        return self.records[min(candidates)]
+
+    def missing_policies(self, found_policy_numbers):
+        """Excel policies that none of the found policy numbers resolve to"""
+        found = set()
+        for policy_number in found_policy_numbers:
+            record = self.lookup(policy_number)
+            if record is not None:
+                found.add(record.policy_no)
+        missing = []
+        for record in self.records:
+            if record.policy_no not in found:
+                found.add(record.policy_no)  # report duplicates once
+                missing.append(record.policy_no)
+        return missing
+
+    def problems(self):
+        """Human-readable list of duplicate and ambiguous keys"""
+        messages = []
+        for policy_no, row_ids in self.duplicates.items():
+            rows = ", ".join(str(row_id + 2) for row_id in row_ids)  # Excel rows (header is row 1)
+            messages.append(f"Policy {policy_no} appears on Excel rows {rows}; the first row is used")
+        for key, policy_numbers in self.ambiguous.items():
+            messages.append(f"Policies {', '.join(policy_numbers)} all match '{key}'; the first row is used")
+        return messages
+
+
+def _clean_text_column(series):
+    """Strip non-null cells to strings, leaving missing cells as None"""
+    cleaned = pd.Series([None] * len(series), index=series.index, dtype=object)
+    present = series.notna()
+    cleaned[present] = series[present].astype(str).str.strip()
+    return cleaned
+
+
+def email_cells(df):
+    """First non-null email cell per row across EMAIL_COLUMNS, like the old per-row loop
+
+    Shared with the pre-send validation so a policy is checked against the
+    address the split routed it by.
+    """
+    emails = pd.Series([None] * len(df), index=df.index, dtype=object)
+    for email_col in EMAIL_COLUMNS:
+        if email_col in df.columns:
+            emails = emails.where(emails.notna(), _clean_text_column(df[email_col]))
+    return emails
+
+
+def _first_key_rows(keys, policies):
+    """Map each key to its first row id, plus keys shared by different policies"""
+    frame = pd.DataFrame({'key': keys.values, 'policy': policies.values})
+    frame = frame[frame['key'] != '']
+    first_rows = frame.drop_duplicates('key', keep='first')
+    lookup = dict(zip(first_rows['key'], first_rows.index))
+
+    distinct = frame.drop_duplicates(['key', 'policy'])
+    shared = distinct[distinct.duplicated('key', keep=False)]
+    ambiguous = {
+        key: list(group['policy'])
+        for key, group in shared.groupby('key', sort=False)
+    }
+    return lookup, ambiguous
+
+
+def build_policy_index(df):
+    """Build a PolicyIndex from the Excel DataFrame"""
+    df = df.reset_index(drop=True)
+
+    # Resolve columns once instead of once per row
+    if POLICY_COLUMN in df.columns:
+        policies = df[POLICY_COLUMN].astype(str).str.strip()
+    else:
+        policies = df.iloc[:, 0].astype(str).str.strip()
+
+    emails = email_cells(df)
+
+    if NIC_COLUMN in df.columns:
+        nics = _clean_text_column(df[NIC_COLUMN])
+    else:
+        nics = pd.Series([None] * len(df), index=df.index, dtype=object)
+
+    records = [
+        PolicyRecord(policy_no, email, nic or None, row_id)
+        for row_id, (policy_no, email, nic) in enumerate(zip(policies, emails, nics))
+    ]
+
+    exact, _ = _first_key_rows(policies, policies)
+    no_slash, ambiguous_slash = _first_key_rows(policies.str.replace('/', '', regex=False), policies)
+    no_zero, ambiguous_zero = _first_key_rows(policies.str.lstrip('0'), policies)
+
+    repeated = policies[policies.duplicated(keep=False)]
+    duplicates = {
+        policy_no: list(row_ids)
+        for policy_no, row_ids in repeated.groupby(repeated, sort=False).groups.items()
+    }
+
+    ambiguous = dict(ambiguous_slash)
+    ambiguous.update(ambiguous_zero)
+
+    return PolicyIndex(records, exact, no_slash, no_zero, duplicates, ambiguous)
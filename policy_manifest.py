@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Run manifest for incremental re-processing of policy PDFs
+"""
+import os
+import json
+import hashlib
+import weakref
+from pathlib import Path
+from datetime import datetime
+
+MANIFEST_FILE = "policies_manifest.json"
+
+# Bump when the output format changes so every policy is rewritten once
+MANIFEST_VERSION = 4
+
+# Document info entry of each emailed policy PDF holding its fingerprint - the send ledger key
+FINGERPRINT_METADATA_KEY = '/PolicyFingerprint'
+
+# Stream hashes per reader - pages of one PDF share their fonts and images
+_stream_digests = weakref.WeakKeyDictionary()
+
+
+def _stream_digest(pdf_reader, key, stream):
+    """Hash of a stream's stored data, computed once per reader for indirect streams"""
+    if pdf_reader is None or key is None:
+        return hashlib.sha256(stream._data).hexdigest()
+    digests = _stream_digests.setdefault(pdf_reader, {})
+    if key not in digests:
+        digests[key] = hashlib.sha256(stream._data).hexdigest()
+    return digests[key]
+
+
+def _describe(value, pdf_reader=None, visited=None):
+    """Stable text form of a PDF object
+
+    References are followed, so a changed font or image changes the text
+    too, and streams are described by a hash of their data. Object numbers
+    are left out - an object seen before is written as its visit order,
+    which keeps cycles finite and survives a renumbered source PDF.
+    """
+    try:
+        from PyPDF2.generic import IndirectObject
+    except ImportError:
+        return repr(value)
+
+    visited = {} if visited is None else visited
+    key = None
+    if isinstance(value, IndirectObject):
+        key = (value.idnum, value.generation)
+        if key in visited:
+            return f"@{visited[key]}"
+        visited[key] = len(visited)
+        value = value.get_object()
+    if isinstance(value, dict):
+        # dict.__getitem__ keeps references unresolved - DictionaryObject resolves them
+        text = "{" + ",".join(f"{name}:{_describe(dict.__getitem__(value, name), pdf_reader, visited)}"
+                              for name in sorted(value)) + "}"
+        if getattr(value, '_data', None) is not None:
+            text += "stream:" + _stream_digest(pdf_reader, key, value)
+        return text
+    if isinstance(value, list):
+        return "[" + ",".join(_describe(item, pdf_reader, visited) for item in value) + "]"
+    return repr(value)
+
+
+def _page_digest(pdf_reader, page_num):
+    """Hash of one page's content stream, resources and geometry"""
+    digest = hashlib.sha256()
+    try:
+        page = pdf_reader.pages[page_num]
+    except AttributeError:
+        # Older PyPDF2 version
+        page = pdf_reader.getPage(page_num)
+
+    # Raw content streams - no need to parse the operators
+    contents = page.get('/Contents')
+    if contents is not None:
+        contents = contents.get_object()
+        streams = contents if isinstance(contents, list) else [contents]
+        for stream in streams:
+            digest.update(stream.get_object().get_data())
+    for key in ('/Resources', '/MediaBox', '/CropBox', '/Rotate'):
+        if key in page:
+            digest.update(f"{key}={_describe(page[key], pdf_reader)}".encode())
+    return digest.hexdigest()
+
+
+def policy_fingerprint(pdf_reader, job):
+    """Fingerprint of everything that ends up in a policy's output file
+
+    Covers the page content, the Excel row (email and NIC) and the
+    compaction settings, so a corrected email or NIC rewrites that
+    policy while untouched policies are skipped.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"v{MANIFEST_VERSION}|{job['path']}|{job['email'] or ''}|{job['password'] or ''}|"
+                  f"{job.get('compact', False)}|{job.get('max_image_dpi', 0)}".encode())
+    for page_num in job['pages']:
+        digest.update(_page_digest(pdf_reader, page_num).encode())
+    return digest.hexdigest()
+
+
+def load_manifest(path=MANIFEST_FILE):
+    """Return {policy_number: {'path', 'fingerprint'}} from the last run, or None"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != MANIFEST_VERSION:
+        return None
+    return manifest.get('policies', {})
+
+
+def save_manifest(entries, path=MANIFEST_FILE):
+    """Write the manifest atomically so an interrupted run leaves the old one"""
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'updated_at': datetime.now().isoformat(timespec='seconds'),
+        'policies': entries,
+    }
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(temp_path, path)
+
+
+def written_fingerprints(folder, path=None):
+    """Fingerprints of the policy files in ``folder`` as the last run wrote them
+
+    Reads the manifest next to ``folder`` (or ``path``) and returns
+    {resolved file path: fingerprint} for the files not modified since the
+    manifest was saved, so the sender can key its ledger without opening
+    a single PDF.
+    """
+    folder = Path(folder).resolve()
+    path = Path(path) if path else folder.parent / MANIFEST_FILE
+    policies = load_manifest(path)
+    if not policies:
+        return {}
+    saved_at = os.path.getmtime(path)
+    known = {}
+    for entry in policies.values():
+        file_path = (path.parent / entry['path']).resolve()
+        try:
+            if file_path.parent == folder and os.path.getmtime(file_path) <= saved_at:
+                known[file_path] = entry['fingerprint']
+        except OSError:
+            continue
+    return known
+
+
+def discard_manifest(path=MANIFEST_FILE):
+    """Remove the manifest, so the next incremental run does a full rebuild"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def plan_incremental(previous, jobs, fingerprints):
+    """Compare this run with the previous manifest
+
+    Returns (jobs_to_write, unchanged_count, stale_paths, entries) where
+    stale_paths are files of vanished or moved policies and entries is
+    the manifest for this run.
+    """
+    jobs_to_write = []
+    unchanged = 0
+    entries = {}
+
+    for job in jobs:
+        fingerprint = fingerprints[job['policy_number']]
+        entries[job['policy_number']] = {'path': job['path'], 'fingerprint': fingerprint}
+
+        old = previous.get(job['policy_number'])
+        if old and old['fingerprint'] == fingerprint and old['path'] == job['path'] and os.path.exists(job['path']):
+            unchanged += 1
+        else:
+            jobs_to_write.append(job)
+
+    current_paths = {entry['path'] for entry in entries.values()}
+    stale_paths = sorted(
+        old['path'] for old in previous.values()
+        if old['path'] not in current_paths and os.path.exists(old['path'])
+    )
+    return jobs_to_write, unchanged, stale_paths, entries
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Aho-Corasick matcher for the policy numbers listed in the Excel file
+"""
+import re
+from collections import deque
+
+
+def _search_forms(policy_number):
+    """Forms of an Excel policy number to look for in page text
+
+    Leading zeros are stripped here and allowed back in at match time, so
+    '407/0054316' in Excel still finds '00407/0054316' on the page. A
+    12-digit number is also searched in the printed 00407/0054316 layout.
+    """
+    policy_number = str(policy_number).strip()
+    forms = {policy_number.lstrip('0')}
+    if len(policy_number) == 12 and policy_number.isdigit():
+        forms.add(f"{policy_number[:5]}/{policy_number[5:]}".lstrip('0'))
+    return {form for form in forms if form}
+
+
+def _is_word_char(char):
+    """Same definition of a word character as the regex \\b boundary"""
+    return char.isalnum() or char == '_'
+
+
+class PolicyMatcher:
+    """Finds every known policy number in a page in a single pass
+
+    The automaton only runs over stretches of text made of characters that
+    appear in policy numbers, so letters and whitespace are skipped at
+    regex speed.
+    """
+
+    def __init__(self, policy_numbers):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self.size = 0
+
+        alphabet = set()
+        for policy_number in policy_numbers:
+            for form in _search_forms(policy_number):
+                self._add(form)
+                alphabet.update(form)
+        self._build_failure_links()
+
+        if alphabet:
+            chars = ''.join(re.escape(char) for char in sorted(alphabet))
+            self._runs = re.compile(f'[{chars}]+')
+        else:
+            self._runs = None
+
+    def __len__(self):
+        return self.size
+
+    def _add(self, pattern):
+        node = 0
+        for char in pattern:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append(())
+            node = next_node
+        if len(pattern) not in self._output[node]:
+            self._output[node] += (len(pattern),)
+            self.size += 1
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def find_all(self, text):
+        """Return (start, end, policy_number) for each known number in the text
+
+        Matches must sit on word boundaries, like the \\b in the generic
+        regexes; the returned policy number is the text as printed.
+        """
+        if not text or self._runs is None:
+            return []
+
+        goto, fail, output = self._goto, self._fail, self._output
+        text_length = len(text)
+        matches = []
+        for run in self._runs.finditer(text):
+            run_start = run.start()
+            node = 0
+            for offset, char in enumerate(run.group(0)):
+                while node and char not in goto[node]:
+                    node = fail[node]
+                node = goto[node].get(char, 0)
+                if not output[node]:
+                    continue
+
+                end = run_start + offset + 1
+                if end < text_length and _is_word_char(text[end]):
+                    continue
+                for length in output[node]:
+                    start = end - length
+                    # Allow back the leading zeros stripped in _search_forms
+                    while start > 0 and text[start - 1] == '0':
+                        start -= 1
+                    if start > 0 and _is_word_char(text[start - 1]):
+                        continue
+                    matches.append((start, end, text[start:end]))
+        matches.sort(key=lambda match: (match[0], -match[1]))
+        return matches
+
+    def first_match(self, text):
+        """Return the earliest known policy number in the text, or None"""
+        matches = self.find_all(text)
+        return matches[0][2] if matches else None
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Per-policy PDF writing and password protection
+"""
+import os
+import json
+import mmap
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from pdf_compact import compact_page, new_compaction_state, pruned_bytes
+from pdf_stream_merge import StreamingPdfWriter
+from policy_manifest import FINGERPRINT_METADATA_KEY, policy_fingerprint
+from policy_scanner import open_pdf_reader
+from production_config import ProductionConfig
+
+WITH_EMAIL_FOLDER = "policies_with_email"
+WITHOUT_EMAIL_FOLDER = "policies_without_email"
+
+# Printable bundle of the policies without email, and where each policy sits in it.
+# Not policies_for_printing.pdf - the print merge deletes and rewrites that file
+PRINT_BUNDLE_FILE = "policies_print_bundle.pdf"
+PRINT_BUNDLE_INDEX = "policies_print_bundle_index.json"
+
+# Policies handed to a worker at a time
+WRITE_BATCH_SIZE = 20
+
+
+def policy_filename(policy_number):
+    """Output filename for a policy - replace invalid filename characters"""
+    safe_policy_number = policy_number.replace('/', '_').replace('\\', '_')
+    return f"{safe_policy_number}.pdf"
+
+
+def plan_policy_output(policy_number, page_numbers, policy_index):
+    """Decide folder and password for a policy without touching the PDF
+
+    Returns a picklable job dict for write_policy_pdf.
+    """
+    has_email = False
+    email = None
+    nic_password = None
+    warnings = []
+
+    # Look for policy in Excel (exact, slash-stripped and zero-stripped forms)
+    record = policy_index.lookup(policy_number)
+    if record is not None:
+        has_email = record.has_email
+        if has_email:
+            email = record.email
+        if record.nic:
+            nic_password = record.nic
+
+    # Add password protection ONLY if policy has email (will be sent electronically)
+    if has_email and not nic_password:
+        warnings.append(f"⚠️ Policy {policy_number} has email but no NIC for password protection")
+
+    folder = WITH_EMAIL_FOLDER if has_email else WITHOUT_EMAIL_FOLDER
+    return {
+        'policy_number': policy_number,
+        'pages': list(page_numbers),
+        'path': str(Path(folder) / policy_filename(policy_number)),
+        'password': nic_password if has_email else None,
+        'has_email': has_email,
+        'email': email,
+        'compact': ProductionConfig.PDF_COMPACT,
+        # Printed policies keep their full image resolution
+        'max_image_dpi': ProductionConfig.PDF_MAX_IMAGE_DPI if has_email else 0,
+        'warnings': warnings,
+    }
+
+
+def _new_writer(pdf_reader, page_numbers, compact=False, max_image_dpi=0):
+    """Create new PDF - handle both old and new PyPDF2 versions
+
+    With ``compact`` each page is added as a copy from compact_page, so
+    the writer never copies the resources the page does not use.
+    Returns the writer and the estimated bytes saved.
+    """
+    saved = 0
+    state = None
+
+    def prepare(page):
+        nonlocal saved
+        if not compact:
+            return page
+        page, page_saved = compact_page(page, pdf_reader, max_image_dpi, state)
+        saved += page_saved
+        return page
+
+    try:
+        from PyPDF2 import PdfWriter
+        writer = PdfWriter()
+        state = new_compaction_state(getattr(writer, '_add_object', None) or getattr(writer, '_addObject', None))
+
+        for page_num in page_numbers:
+            try:
+                if page_num < len(pdf_reader.pages):
+                    writer.add_page(prepare(pdf_reader.pages[page_num]))
+            except AttributeError:
+                # Older PyPDF2 version
+                if page_num < pdf_reader.numPages:
+                    writer.addPage(prepare(pdf_reader.getPage(page_num)))
+    except ImportError:
+        # Very old PyPDF2 version
+        from PyPDF2 import PdfFileWriter
+        writer = PdfFileWriter()
+        state = new_compaction_state(writer._addObject)
+
+        for page_num in page_numbers:
+            if page_num < pdf_reader.numPages:
+                writer.addPage(prepare(pdf_reader.getPage(page_num)))
+    return writer, saved + pruned_bytes(state)
+
+
+def write_policy_pdf(pdf_reader, job):
+    """Write one planned policy PDF and report what happened
+
+    Warnings are returned rather than shown so this can run in a worker.
+    An emailed policy carries its fingerprint (``job['fingerprint']`` when
+    the caller has it) for the send ledger.
+    """
+    writer, saved = _new_writer(pdf_reader, job['pages'], job.get('compact', False), job.get('max_image_dpi', 0))
+    warnings = list(job['warnings'])
+    encrypted = False
+
+    fingerprint = job.get('fingerprint')
+    if fingerprint is None and job['has_email']:
+        fingerprint = policy_fingerprint(pdf_reader, job)
+    if fingerprint:
+        try:
+            writer.add_metadata({FINGERPRINT_METADATA_KEY: fingerprint})
+        except AttributeError:
+            # Older PyPDF2 version
+            writer.addMetadata({FINGERPRINT_METADATA_KEY: fingerprint})
+
+    if job['password']:
+        try:
+            # For newer PyPDF2 versions
+            writer.encrypt(job['password'])
+            encrypted = True
+        except AttributeError:
+            try:
+                # For older PyPDF2 versions
+                writer.encrypt(user_pwd=job['password'], owner_pwd=job['password'])
+                encrypted = True
+            except Exception:
+                # If encryption fails, continue without password
+                warnings.append(f"⚠️ Could not encrypt PDF for policy {job['policy_number']}")
+
+    with open(job['path'], 'wb') as output_file:
+        writer.write(output_file)
+
+    return {
+        'policy_number': job['policy_number'],
+        'path': job['path'],
+        'size': os.path.getsize(job['path']),
+        'compact_saved': saved,
+        'encrypted': encrypted,
+        'has_email': job['has_email'],
+        'warnings': warnings,
+    }
+
+
+# Source PDF opened once per worker process by _init_write_worker
+_worker_reader = None
+
+
+def _init_write_worker(pdf_path):
+    global _worker_reader
+    # Mapped read-only and kept open for the life of the worker process
+    with open(pdf_path, 'rb') as pdf_file_handle:
+        mapped = mmap.mmap(pdf_file_handle.fileno(), 0, access=mmap.ACCESS_READ)
+    _worker_reader = open_pdf_reader(mapped)
+
+
+def _write_batch(jobs):
+    """Worker: write a batch of policies from the worker's own reader"""
+    return [write_policy_pdf(_worker_reader, job) for job in jobs]
+
+
+def write_uses_pool(job_count, max_workers):
+    """Whether write_policy_pdfs will start workers - only then is ``pdf_path`` opened"""
+    return max_workers > 1 and job_count > WRITE_BATCH_SIZE
+
+
+def write_policy_pdfs(pdf_reader, pdf_path, jobs, max_workers=1, progress_callback=None):
+    """Write every planned policy PDF, in a process pool when max_workers > 1
+
+    Workers open ``pdf_path`` themselves and receive batches of jobs (page
+    numbers plus password); with one worker ``pdf_reader`` is used in this
+    process. Returns the result dicts in job order.
+    """
+    for folder in {os.path.dirname(job['path']) for job in jobs}:
+        os.makedirs(folder, exist_ok=True)
+
+    if not write_uses_pool(len(jobs), max_workers):
+        results = []
+        for job in jobs:
+            results.append(write_policy_pdf(pdf_reader, job))
+            if progress_callback:
+                progress_callback(len(results), job['policy_number'])
+        return results
+
+    batches = [jobs[i:i + WRITE_BATCH_SIZE] for i in range(0, len(jobs), WRITE_BATCH_SIZE)]
+    results_by_batch = {}
+    written = 0
+    # Streamlit runs scripts on threads, so spawn workers instead of forking
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_write_worker,
+                             initargs=(pdf_path,)) as executor:
+        futures = {executor.submit(_write_batch, batch): i for i, batch in enumerate(batches)}
+        for future in as_completed(futures):
+            batch_results = future.result()
+            results_by_batch[futures[future]] = batch_results
+            written += len(batch_results)
+            if progress_callback:
+                progress_callback(written, batch_results[-1]['policy_number'])
+
+    return [result for i in range(len(batches)) for result in results_by_batch[i]]
+
+
+def write_print_bundle(pdf_reader, jobs, output_path=PRINT_BUNDLE_FILE, index_path=PRINT_BUNDLE_INDEX,
+                       progress_callback=None):
+    """Copy the pages of the given policies from the source reader into one printable PDF
+
+    Skips writing and re-parsing one file per policy. Policies go in
+    file-name order, the order merging the folder would give, and the
+    index records each policy's page range for extract_bundled_policies.
+    """
+    jobs = sorted(jobs, key=lambda job: os.path.basename(job['path']))
+    entries = []
+    with StreamingPdfWriter(output_path) as writer:
+        for job in jobs:
+            first_page = writer.pages_written
+            writer.append_pages(pdf_reader, job['pages'])
+            entries.append({
+                'policy_number': job['policy_number'],
+                'path': job['path'],
+                'first_page': first_page,
+                'pages': writer.pages_written - first_page,
+            })
+            if progress_callback:
+                progress_callback(len(entries), job['policy_number'])
+        total_pages = writer.pages_written
+
+    with open(index_path, 'w') as f:
+        json.dump({'bundle': output_path, 'policies': entries}, f, indent=1)
+    return {
+        'path': output_path,
+        'index_path': index_path,
+        'policies': len(entries),
+        'pages': total_pages,
+        'size': os.path.getsize(output_path),
+    }
+
+
+def extract_bundled_policies(index_path=PRINT_BUNDLE_INDEX, policy_numbers=None):
+    """Write individual policy PDFs back out of the print bundle, on demand
+
+    All bundled policies by default; returns the paths written.
+    """
+    with open(index_path) as f:
+        index = json.load(f)
+    wanted = set(policy_numbers) if policy_numbers is not None else None
+    paths = []
+    with open(index['bundle'], 'rb') as bundle_file:
+        bundle_reader = open_pdf_reader(bundle_file)
+        for entry in index['policies']:
+            if wanted is not None and entry['policy_number'] not in wanted:
+                continue
+            first_page = entry['first_page']
+            writer, _ = _new_writer(bundle_reader, range(first_page, first_page + entry['pages']))
+            os.makedirs(os.path.dirname(entry['path']) or '.', exist_ok=True)
+            with open(entry['path'], 'wb') as output_file:
+                writer.write(output_file)
+            paths.append(entry['path'])
+    return paths
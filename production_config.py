@@ -5,9 +5,12 @@ Production configuration for VPS deployment
 import os
 from pathlib import Path
 
-# Load environment variables
-from dotenv import load_dotenv
-load_dotenv()
+# Load environment variables (python-dotenv is only installed on the VPS)
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
 
 class ProductionConfig:
     # Server Configuration
@@ -26,11 +29,60 @@ class ProductionConfig:
     PDF_WITHOUT_EMAIL_PATH = STORAGE_PATH / "generated_pdfs" / "without_email"
     UPLOADED_FILES_PATH = STORAGE_PATH / "uploaded_files"
     
+    # PDF Scanning - header band (left, bottom, right, top as page fractions)
+    # and how much of each page's content stream the header fast path parses
+    SCAN_HEADER_REGION = tuple(float(v) for v in os.getenv('SCAN_HEADER_REGION', '0,0.6,1,1').split(','))
+    SCAN_HEADER_BYTES = int(os.getenv('SCAN_HEADER_BYTES', 4096))
+    
+    # Per-job spill files for PDF worker processes (tmpfs when available)
+    SPILL_PATH = os.getenv('SPILL_PATH') or ('/dev/shm' if os.path.isdir('/dev/shm') else None)
+    
+    # Single-pass split: pages read between dropping the PDF reader's object cache
+    STREAM_WINDOW_PAGES = int(os.getenv('STREAM_WINDOW_PAGES', 100))
+    
+    # Page scan cache (keyed by the SHA-256 of the uploaded PDF)
+    SCAN_CACHE_MAX_MB = int(os.getenv('SCAN_CACHE_MAX_MB', 50))
+    SCAN_CACHE_MAX_AGE_DAYS = int(os.getenv('SCAN_CACHE_MAX_AGE_DAYS', 30))
+    
+    # Per-policy PDFs: drop unused resources and compress content streams; with
+    # PDF_MAX_IMAGE_DPI > 0 (needs Pillow) emailed policies get images drawn above it resampled
+    PDF_COMPACT = os.getenv('PDF_COMPACT', 'true').lower() in ('1', 'true', 'yes')
+    PDF_MAX_IMAGE_DPI = int(os.getenv('PDF_MAX_IMAGE_DPI', 0))
+    
+    # Print volumes: merged print files are split at whichever limit comes first (0 = no limit)
+    PRINT_VOLUME_MAX_PAGES = int(os.getenv('PRINT_VOLUME_MAX_PAGES', 500))
+    PRINT_VOLUME_MAX_MB = int(os.getenv('PRINT_VOLUME_MAX_MB', 50))
+    # Share identical fonts/images and compress streams in merged print files
+    PRINT_OPTIMIZE = os.getenv('PRINT_OPTIMIZE', 'true').lower() in ('1', 'true', 'yes')
+    
     # Email Configuration
     BREVO_API_KEY = os.getenv('BREVO_API_KEY')
-    MAX_WORKERS = int(os.getenv('MAX_WORKERS', 2))  # Reduced for 1 CPU
+    MAX_WORKERS = int(os.getenv('MAX_WORKERS', 2))  # Reduced for 1 CPU (also concurrent email sends)
     BATCH_SIZE = int(os.getenv('BATCH_SIZE', 25))   # Smaller batches
-    EMAIL_RATE_LIMIT = float(os.getenv('EMAIL_RATE_LIMIT', 1.0))  # Slower rate
+    EMAIL_RATE_LIMIT = float(os.getenv('EMAIL_RATE_LIMIT', 1.0))  # Brevo requests/second - match your plan (0 = no limit)
+    # Adaptive send concurrency: starts at MAX_WORKERS, grows up to
+    # EMAIL_MAX_CONCURRENCY while Brevo keeps up, halves on 429s/latency spikes
+    EMAIL_ADAPTIVE_CONCURRENCY = os.getenv('EMAIL_ADAPTIVE_CONCURRENCY', 'true').lower() in ('1', 'true', 'yes')
+    EMAIL_MAX_CONCURRENCY = int(os.getenv('EMAIL_MAX_CONCURRENCY', 16))
+    EMAIL_PREFETCH_MB = int(os.getenv('EMAIL_PREFETCH_MB', 64))  # Encoded attachments held ready to send
+    # Pre-send validation: larger PDFs are rejected; with EMAIL_REQUIRE_NIC a
+    # policy without a NIC (unprotected PDF) is not emailed at all
+    EMAIL_MAX_ATTACHMENT_MB = int(os.getenv('EMAIL_MAX_ATTACHMENT_MB', 10))
+    EMAIL_REQUIRE_NIC = os.getenv('EMAIL_REQUIRE_NIC', 'false').lower() in ('1', 'true', 'yes')
+    # One email per recipient with all of their policies (--group-by-recipient)
+    EMAIL_GROUP_BY_RECIPIENT = os.getenv('EMAIL_GROUP_BY_RECIPIENT', 'false').lower() in ('1', 'true', 'yes')
+    EMAIL_GROUP_MAX_ATTACHMENTS = int(os.getenv('EMAIL_GROUP_MAX_ATTACHMENTS', 10))
+    EMAIL_GROUP_MAX_MB = int(os.getenv('EMAIL_GROUP_MAX_MB', 10))  # PDF bytes per grouped email
+    RETRY_ATTEMPTS = int(os.getenv('RETRY_ATTEMPTS', 3))  # Retries for 429/5xx/timeouts before dead-lettering
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 1.0))  # Seconds; backoff window doubles per retry
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 60.0))
+    # Brevo HTTP transport: pool size 0 = one connection per send worker
+    BREVO_POOL_SIZE = int(os.getenv('BREVO_POOL_SIZE', 0))
+    BREVO_CONNECT_TIMEOUT = float(os.getenv('BREVO_CONNECT_TIMEOUT', 10.0))  # Seconds
+    BREVO_READ_TIMEOUT = float(os.getenv('BREVO_READ_TIMEOUT', 60.0))  # Seconds; large attachments upload slowly
+    BREVO_CONNECT_RETRIES = int(os.getenv('BREVO_CONNECT_RETRIES', 2))  # Failed connects only - nothing was sent
+    BREVO_PROXY = os.getenv('BREVO_PROXY')  # e.g. http://proxy.internal:3128
+    SENDER_SOCKET = os.getenv('SENDER_SOCKET', '')  # Resident sender's Unix socket (default: storage/sender.sock)
     
     # Backup Configuration
     BACKUP_ENABLED = True
@@ -62,6 +114,22 @@ class ProductionConfig:
             directory.mkdir(parents=True, exist_ok=True)
             print(f"✅ Created directory: {directory}")
     
+    @classmethod
+    def storage_root(cls):
+        """Persistent storage on the VPS, ./storage in local development"""
+        return cls.STORAGE_PATH if cls.BASE_PATH.exists() else Path("storage")
+    
+    @classmethod
+    def sender_socket(cls):
+        """Unix socket the resident email sender listens on"""
+        return Path(cls.SENDER_SOCKET) if cls.SENDER_SOCKET else cls.storage_root() / "sender.sock"
+    
+    @classmethod
+    def worker_count(cls, requested=None):
+        """Number of worker processes to use, capped at the CPUs available"""
+        workers = requested if requested else cls.MAX_WORKERS
+        return max(1, min(int(workers), os.cpu_count() or 1))
+    
     @classmethod
     def validate_config(cls):
         """Validate production configuration"""
@@ -10,6 +10,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import queue
 import threading
 
+from production_config import ProductionConfig
+
 # Configure logging for production
 logging.basicConfig(
     level=logging.INFO,
@@ -77,7 +79,7 @@ PRODUCTION_CONFIG = {
     "MAX_WORKERS": 5,  # Concurrent email sending threads
     "BATCH_SIZE": 50,  # Files per batch
     "RATE_LIMIT_DELAY": 0.5,  # Seconds between emails
-    "RETRY_ATTEMPTS": 3,  # Retry failed emails
+    "RETRY_ATTEMPTS": ProductionConfig.RETRY_ATTEMPTS,  # Retry failed emails (see send_retry.py)
     "BACKUP_ENABLED": True,  # Backup processed files
     "MONITORING_ENABLED": True  # Enable detailed logging
 }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of PDF page -> policy assignments for re-uploaded PDFs
+"""
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import logging
+
+from production_config import ProductionConfig
+
+# Bump when the scanning rules change so old assignments are not reused
+SCAN_CACHE_VERSION = 1
+
+
+class ScanCache:
+    """SQLite-backed cache keyed by the SHA-256 of the uploaded PDF"""
+
+    def __init__(self, path=None, max_bytes=None, max_age_days=None):
+        self.path = path or ProductionConfig.storage_root() / "scan_cache.sqlite3"
+        self.max_bytes = max_bytes or ProductionConfig.SCAN_CACHE_MAX_MB * 1024 * 1024
+        self.max_age_days = max_age_days or ProductionConfig.SCAN_CACHE_MAX_AGE_DAYS
+
+    @staticmethod
+    def make_key(pdf_sha256, known_policies, header_only=False):
+        """Cache key: the PDF plus everything that changes how pages are assigned"""
+        digest = hashlib.sha256()
+        digest.update(f"v{SCAN_CACHE_VERSION}:{pdf_sha256}:{int(bool(header_only))}".encode())
+        for policy_number in sorted(set(known_policies)):
+            digest.update(b'\0' + policy_number.encode())
+        return digest.hexdigest()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.path), timeout=10)
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS page_scans (
+                cache_key   TEXT PRIMARY KEY,
+                pdf_sha256  TEXT NOT NULL,
+                total_pages INTEGER NOT NULL,
+                assignment  BLOB NOT NULL,
+                size_bytes  INTEGER NOT NULL,
+                created_at  REAL NOT NULL,
+                last_used   REAL NOT NULL
+            )
+        """)
+        return connection
+
+    def get(self, cache_key):
+        """Return the cached policy_pages dict, or None on a miss"""
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    row = connection.execute(
+                        "SELECT assignment FROM page_scans WHERE cache_key = ?", (cache_key,)
+                    ).fetchone()
+                    if row is None:
+                        return None
+                    connection.execute(
+                        "UPDATE page_scans SET last_used = ? WHERE cache_key = ?", (time.time(), cache_key)
+                    )
+            finally:
+                connection.close()
+            # Stored as a list of pairs to keep the page order of the scan
+            return {policy_number: pages for policy_number, pages in json.loads(zlib.decompress(row[0]))}
+        except (sqlite3.Error, OSError, ValueError, zlib.error) as e:
+            logging.warning(f"Scan cache unavailable: {e}")
+            return None
+
+    def put(self, cache_key, pdf_sha256, total_pages, policy_pages):
+        """Store the page assignment for a scanned PDF, then evict old entries"""
+        assignment = zlib.compress(json.dumps(list(policy_pages.items())).encode())
+        now = time.time()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO page_scans VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (cache_key, pdf_sha256, total_pages, assignment, len(assignment), now, now)
+                    )
+                    self._evict(connection, now)
+            finally:
+                connection.close()
+            return True
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"Could not update scan cache: {e}")
+            return False
+
+    def _evict(self, connection, now):
+        """Drop entries past the age limit, then least recently used over the size limit"""
+        connection.execute(
+            "DELETE FROM page_scans WHERE last_used < ?", (now - self.max_age_days * 86400,)
+        )
+        total_bytes = 0
+        for cache_key, size_bytes in connection.execute(
+            "SELECT cache_key, size_bytes FROM page_scans ORDER BY last_used DESC"
+        ).fetchall():
+            total_bytes += size_bytes
+            if total_bytes > self.max_bytes:
+                connection.execute("DELETE FROM page_scans WHERE cache_key = ?", (cache_key,))
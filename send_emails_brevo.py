@@ -6,30 +6,41 @@ import os
 from pathlib import Path
 import time
 
-def setup_brevo_client(api_key):
-    """Setup Brevo API client"""
+from brevo_transport import build_pool_manager, connection_stats
+from email_dispatch import AIMDController, TokenBucket, send_concurrently
+from policy_manifest import written_fingerprints
+from production_config import ProductionConfig
+from send_events import EventStream
+from send_ledger import DEAD_LETTER, SendLedger, attachment_fingerprint, attachment_hash
+from send_retry import SendFailed, call_with_retries
+from send_validation import REJECTS_REPORT_FILE, save_rejects_report, validate_send_list
+
+def setup_brevo_client(api_key, pool_size=None):
+    """Setup Brevo API client
+    
+    The HTTP pool holds one keep-alive connection per send worker (or
+    ``pool_size``), with the BREVO_* timeouts and connect retries.
+    """
     configuration = sib_api_v3_sdk.Configuration()
     configuration.api_key['api-key'] = api_key
-    return sib_api_v3_sdk.TransactionalEmailsApi(sib_api_v3_sdk.ApiClient(configuration))
+    if ProductionConfig.BREVO_PROXY:
+        configuration.proxy = ProductionConfig.BREVO_PROXY
+    api_client = sib_api_v3_sdk.ApiClient(configuration)
+    api_client.rest_client.pool_manager = build_pool_manager(configuration, pool_size)
+    return sib_api_v3_sdk.TransactionalEmailsApi(api_client)
 
-def send_policy_emails():
-    """Send emails with PDF attachments using Brevo"""
-    
-    # CONFIGURATION - UPDATE THESE VALUES
-    SENDER_EMAIL = "CashBack@niclmauritius.site"    # Your verified sender email
-    SENDER_NAME = "NIC Life Insurance Mauritius"     # Your company name
-    REPLY_TO_EMAIL = "customerservice@nicl.mu"            # Reply-to email
-    REPLY_TO_NAME = "NIC Life Insurance"             # Reply-to name
-    
-    # Verify sender email first
-    print(f"🔍 Using sender: {SENDER_NAME} <{SENDER_EMAIL}>")
-    print(f"📧 Reply-to: {REPLY_TO_NAME} <{REPLY_TO_EMAIL}>")
-    print("⚠️  IMPORTANT: Make sure sender domain is verified in your Brevo account!")
-    
-    # Email template - subject line with dynamic policy number
-    SUBJECT_TEMPLATE = "NIC Life Insurance - Cash Back Benefit - Policy {policy_number}"
-    # Professional HTML email template with formal content
-    EMAIL_TEMPLATE_HTML = """
+# CONFIGURATION - UPDATE THESE VALUES
+SENDER_EMAIL = "CashBack@niclmauritius.site"    # Your verified sender email
+SENDER_NAME = "NIC Life Insurance Mauritius"     # Your company name
+REPLY_TO_EMAIL = "customerservice@nicl.mu"            # Reply-to email
+REPLY_TO_NAME = "NIC Life Insurance"             # Reply-to name
+
+# Email template - subject line with dynamic policy number
+SUBJECT_TEMPLATE = "NIC Life Insurance - Cash Back Benefit - Policy {policy_number}"
+# Subject when several of a customer's policies go out in one email
+GROUP_SUBJECT_TEMPLATE = "NIC Life Insurance - Cash Back Benefit - Policies {policy_numbers}"
+# Professional HTML email template with formal content
+EMAIL_TEMPLATE_HTML = """
 <!DOCTYPE html>
 <html>
 <head>
@@ -107,8 +118,8 @@ def send_policy_emails():
 </html>
 """
 
-    # Plain text version for email clients that don't support HTML
-    EMAIL_TEMPLATE_TEXT = """
+# Plain text version for email clients that don't support HTML
+EMAIL_TEMPLATE_TEXT = """
 Dear Valued Client,
 
 Greetings from NIC.
@@ -134,161 +145,440 @@ Kind Regards,
 NIC - Serving you, Serving the Nation
 
 """
+
+def describe_api_error(e):
+    """Plain-language reason for a Brevo API error"""
+    # Enhanced error reporting for Brevo API errors
+    error_details = str(e)
+    status = str(getattr(e, 'status', '') or '')
+    if status.startswith('5') and status != "500":
+        return f"Brevo server error ({status}) - temporary issue"
+    if "401" in error_details:
+        return "Invalid API key or authentication failed"
+    elif "402" in error_details:
+        return "Insufficient credits or plan limit exceeded"
+    elif "400" in error_details:
+        return "Invalid email format or request data"
+    elif "403" in error_details:
+        return "Sender domain not verified or forbidden"
+    elif "429" in error_details:
+        return "Rate limit exceeded - too many requests"
+    elif "500" in error_details:
+        return "Brevo server error - temporary issue"
+    return f"API Error: {error_details}"
+
+def build_policy_message(task):
+    """Read and encode the PDF(s) and render the email for a send task
     
-    # Get API key from environment variable
-    BREVO_API_KEY = os.getenv('BREVO_API_KEY')
-    if not BREVO_API_KEY:
-        print("❌ Error: BREVO_API_KEY environment variable not set")
-        print("Please set your Brevo API key as an environment variable:")
-        print("Windows: set BREVO_API_KEY=your-api-key-here")
-        print("Linux/Mac: export BREVO_API_KEY=your-api-key-here")
-        return
+    A grouped task (see group_tasks_by_recipient) carries all of one
+    customer's policies as attachments of a single message. Returns the
+    SendSmtpEmail and its payload size in bytes.
+    """
+    policies = task.get('policies') or [task]
+    policy_lookup = ", ".join(policy['policy_number'] for policy in policies)
+    
+    # Read PDF files and encode to base64
+    attachments = []
+    attachment_bytes = 0
+    for policy in policies:
+        with open(policy['pdf_file'], 'rb') as f:
+            pdf_content = f.read()
+            pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
+        attachments.append({
+            "content": pdf_base64,
+            "name": f"Policy_{policy['filename']}.pdf"
+        })
+        attachment_bytes += len(pdf_base64)
+    
+    # Extract customer name (basic extraction from policy number)
+    customer_name = "Valued Client"  # Updated to match the formal greeting
+    
+    # Create dynamic subject line with policy number(s)
+    if len(policies) > 1:
+        email_subject = GROUP_SUBJECT_TEMPLATE.format(policy_numbers=policy_lookup)
+    else:
+        email_subject = SUBJECT_TEMPLATE.format(policy_number=policy_lookup)
+    
+    # Prepare email content (both HTML and text versions)
+    email_content_html = EMAIL_TEMPLATE_HTML.format(
+        customer_name=customer_name,
+        policy_number=policy_lookup,
+        sender_name=SENDER_NAME
+    )
+    
+    email_content_text = EMAIL_TEMPLATE_TEXT.format(
+        customer_name=customer_name,
+        policy_number=policy_lookup,
+        sender_name=SENDER_NAME
+    )
     
-    # Setup Brevo client
+    # Create email object with professional HTML template
+    send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
+        to=[{"email": task['email']}],
+        sender={"name": SENDER_NAME, "email": SENDER_EMAIL},
+        reply_to={"name": REPLY_TO_NAME, "email": REPLY_TO_EMAIL},
+        subject=email_subject,
+        html_content=email_content_html,
+        text_content=email_content_text,
+        attachment=attachments
+    )
+    return send_smtp_email, attachment_bytes + len(email_content_html) + len(email_content_text)
+
+def group_tasks_by_recipient(tasks, max_attachments=None, max_bytes=None):
+    """Bucket policy tasks by normalized recipient address
+    
+    Each bucket becomes one message, split further so no message has
+    more than ``max_attachments`` PDFs or ``max_bytes`` of them. Single
+    policies are returned unchanged; groups keep their policy tasks in
+    ``policies`` so each one is still tracked in the ledger.
+    """
+    max_attachments = max_attachments or ProductionConfig.EMAIL_GROUP_MAX_ATTACHMENTS
+    max_bytes = max_bytes or ProductionConfig.EMAIL_GROUP_MAX_MB * 1024 * 1024
+    
+    by_recipient = {}
+    for task in tasks:
+        by_recipient.setdefault(task['email'].strip().lower(), []).append(task)
+    
+    grouped = []
+    for policies in by_recipient.values():
+        chunks = []
+        chunk, chunk_bytes = [], 0
+        for task in policies:
+            size = os.path.getsize(task['pdf_file'])
+            if chunk and (len(chunk) >= max_attachments or chunk_bytes + size > max_bytes):
+                chunks.append(chunk)
+                chunk, chunk_bytes = [], 0
+            chunk.append(task)
+            chunk_bytes += size
+        chunks.append(chunk)
+        
+        for chunk in chunks:
+            if len(chunk) == 1:
+                grouped.append(chunk[0])
+            else:
+                grouped.append({
+                    'email': chunk[0]['email'],
+                    'policy_number': ", ".join(task['policy_number'] for task in chunk),
+                    'policies': chunk,
+                })
+    return grouped
+
+def prepare_policy_email(task):
+    """Prefetch stage: build the message ahead of the network workers
+    
+    Errors are kept on the task so send_policy_email reports them in order.
+    """
     try:
-        api_instance = setup_brevo_client(BREVO_API_KEY)
-        print("✅ Brevo API client initialized successfully")
+        message, size = build_policy_message(task)
     except Exception as e:
-        print(f"❌ Error setting up Brevo client: {e}")
-        return
+        return dict(task, prepare_error=e), 0
+    return dict(task, message=message), size
+
+def send_policy_email(api_instance, task, rate_limiter=None, concurrency=None, events=None):
+    """Send one policy PDF to its recipient
+    
+    Runs on a worker thread, so output is collected in ``lines`` for the
+    caller to print in one piece. The message is built here unless
+    prepare_policy_email already did. 429, 5xx and network errors are
+    retried with backoff (each retry takes a ``rate_limiter`` token); a
+    send that runs out of retries is flagged ``dead_letter`` for a later
+    replay. 429s are reported to the ``concurrency`` controller and
+    retries to ``events`` as they happen.
+    """
+    recipient_email = task['email']
+    policy_lookup = task['policy_number']
+    policies = task.get('policies') or [task]
+    lines = []
+    ok = False
+    message_id = None
+    latency_ms = None
+    error = None
+    error_code = None
+    attempts = 1
+    dead_letter = False
+    throttled = False
+    
+    try:
+        if task.get('prepare_error') is not None:
+            raise task['prepare_error']
+        send_smtp_email = task.get('message')
+        if send_smtp_email is None:
+            send_smtp_email, _ = build_policy_message(task)
+        
+        def send_once():
+            nonlocal latency_ms
+            started = time.perf_counter()
+            try:
+                return api_instance.send_transac_email(send_smtp_email)
+            finally:
+                latency_ms = (time.perf_counter() - started) * 1000
+        
+        def note_retry(attempt, delay, e):
+            nonlocal throttled
+            if getattr(e, 'status', None) == 429:
+                throttled = True
+                if concurrency is not None:
+                    concurrency.throttled()
+            reason = describe_api_error(e) if isinstance(e, ApiException) else str(e)
+            lines.append(f"🔁 Retry {attempt} for policy {policy_lookup} in {delay:.1f}s - {reason}")
+            if events is not None:
+                events.emit('retry', policy=policy_lookup, email=recipient_email, attempt=attempt,
+                            delay=round(delay, 2), error_code=getattr(e, 'status', None), error=reason)
+        
+        # Send email, retrying transient Brevo errors
+        api_response, attempts = call_with_retries(
+            send_once,
+            before_retry=rate_limiter.acquire if rate_limiter is not None else None,
+            on_retry=note_retry
+        )
+        message_id = getattr(api_response, 'message_id', None)
+        for policy in policies:
+            lines.append(f"✅ Sent to {recipient_email} - Policy: {policy['policy_number']}")
+        ok = True
+        
+    except SendFailed as e:
+        attempts = e.attempts
+        dead_letter = e.retryable
+        error_code = getattr(e.error, 'status', None)
+        error = describe_api_error(e.error) if isinstance(e.error, ApiException) else str(e.error)
+        for policy in policies:
+            lines.append(f"❌ Failed to send to {recipient_email} - Policy: {policy['policy_number']}")
+        lines.append(f"   Reason: {error}")
+        if dead_letter:
+            lines.append(f"   📮 Moved to dead letters after {attempts} attempts - replay later")
+        
+    except Exception as e:
+        error = str(e)
+        lines.append(f"❌ Unexpected error for policy {policy_lookup} - Email: {recipient_email}")
+        lines.append(f"   Reason: {error}")
+    
+    return {
+        'policy_number': policy_lookup,
+        'email': recipient_email,
+        # Every policy in the message, for the ledger
+        'policies': [(policy['policy_number'], policy.get('attachment_hash')) for policy in policies],
+        'ok': ok,
+        'message_id': message_id,
+        'latency_ms': latency_ms,
+        # A 429 on the way - the adaptive window must not grow on this send
+        'throttled': throttled,
+        'attempts': attempts,
+        'dead_letter': dead_letter,
+        'error': error,
+        'error_code': error_code,
+        'lines': lines,
+    }
+
+# Default input/output locations
+DEFAULT_EXCEL_FILE = "Compile CBOpt Nov25.xlsx"
+DEFAULT_PDF_FOLDER = "policies_with_email"
+REPORT_FILE = "email_sending_report.txt"
+
+def send_policy_emails(api_instance=None, excel_path=DEFAULT_EXCEL_FILE, pdf_folder=DEFAULT_PDF_FOLDER,
+                       report_path=REPORT_FILE, rejects_path=REJECTS_REPORT_FILE, campaign=None, ledger=None, replay_dead_letters=False,
+                       group_by_recipient=None, events=None, rate_limiter=None, concurrency=None,
+                       policy_table=None):
+    """Send emails with PDF attachments using Brevo
+    
+    Pass ``api_instance`` to use an existing transport (e.g. a mock in the
+    benchmark); by default a client is built from BREVO_API_KEY.
+    The run report goes to ``report_path`` and the rejects to ``rejects_path``.
+    Every send is recorded in the ledger under ``campaign`` (default: the
+    Excel file name), and policies already sent with the same PDF are
+    skipped, so an interrupted run can simply be started again.
+    With ``replay_dead_letters`` only the campaign's dead letters are sent.
+    ``group_by_recipient`` (default EMAIL_GROUP_BY_RECIPIENT) sends one
+    email per address carrying all of that customer's policies.
+    Progress goes to ``events`` (default: the SEND_EVENTS_FD pipe, when
+    the app started this run) as JSON lines.
+    The resident sender passes its shared ``rate_limiter`` and
+    ``concurrency`` controller and an already loaded ``policy_table``.
+    """
+    own_events = events is None
+    events = events or EventStream()
+    
+    # Verify sender email first
+    print(f"🔍 Using sender: {SENDER_NAME} <{SENDER_EMAIL}>")
+    print(f"📧 Reply-to: {REPLY_TO_NAME} <{REPLY_TO_EMAIL}>")
+    print("⚠️  IMPORTANT: Make sure sender domain is verified in your Brevo account!")
+    
+    if api_instance is None:
+        # Get API key from environment variable
+        BREVO_API_KEY = os.getenv('BREVO_API_KEY')
+        if not BREVO_API_KEY:
+            print("❌ Error: BREVO_API_KEY environment variable not set")
+            print("Please set your Brevo API key as an environment variable:")
+            print("Windows: set BREVO_API_KEY=your-api-key-here")
+            print("Linux/Mac: export BREVO_API_KEY=your-api-key-here")
+            events.emit('error', message="BREVO_API_KEY environment variable not set")
+            return
+        
+        # Setup Brevo client
+        try:
+            api_instance = setup_brevo_client(BREVO_API_KEY)
+            print("✅ Brevo API client initialized successfully")
+        except Exception as e:
+            print(f"❌ Error setting up Brevo client: {e}")
+            events.emit('error', message=f"Error setting up Brevo client: {e}")
+            return
     
     # Read Excel file to get policy-email mapping
     try:
-        df = pd.read_excel("Compile CBOpt Nov25.xlsx")
+        df = pd.read_excel(excel_path) if policy_table is None else policy_table
         print(f"📊 Loaded {len(df)} policies from Excel")
     except Exception as e:
         print(f"❌ Error reading Excel file: {e}")
+        events.emit('error', message=f"Error reading Excel file: {e}")
         return
     
     # Check if policies_with_email folder exists
-    pdf_folder = Path("policies_with_email")
+    pdf_folder = Path(pdf_folder)
     if not pdf_folder.exists():
-        print("❌ 'policies_with_email' folder not found. Run create_complete_analysis.py first.")
+        print(f"❌ '{pdf_folder}' folder not found. Run create_complete_analysis.py first.")
+        events.emit('error', message=f"'{pdf_folder}' folder not found")
         return
     
     # Get list of available PDF files
     pdf_files = list(pdf_folder.glob("*.pdf"))
     print(f"📁 Found {len(pdf_files)} PDF files ready for sending")
     
-    # Create policy-email mapping
-    policy_email_map = {}
-    for _, row in df.iterrows():
-        policy_str = str(row['Policy No'])
-        email = row['Owner 1 Email']
-        if pd.notna(email) and email.strip():  # Check for valid email
-            policy_email_map[policy_str] = email
+    # Validate the whole send list up front - bad addresses, missing rows,
+    # empty or oversized PDFs never cost a Brevo round trip
+    tasks, rejects = validate_send_list(df, pdf_folder)
+    print(f"📧 Found {len(tasks)} valid email addresses")
     
-    print(f"📧 Found {len(policy_email_map)} valid email addresses")
-    
-    # Send emails
-    sent_count = 0
     failed_count = 0
     failed_policies = []
+    not_sent = rejects[rejects['action'] == 'not sent']
+    rejected_count = len(not_sent)
+    if len(rejects):
+        for category, count in rejects['category'].value_counts().items():
+            print(f"⚠️  {category.replace('_', ' ').capitalize()}: {count}")
+        for row in not_sent.itertuples(index=False):
+            print(f"⚠️  Rejected policy {row.policy_number} - {row.detail}")
+        print(f"📋 Rejects report saved to: {save_rejects_report(rejects, rejects_path)}")
     
-    for pdf_file in pdf_files:
-        # Extract policy number from filename
-        filename = pdf_file.stem  # filename without extension
-        
-        # Convert filename back to policy format for lookup
-        if '_' in filename and not filename.isdigit():
-            # Slash format: 00407_0054316 -> 00407/0054316
-            policy_lookup = filename.replace('_', '/', 1)
+    # Skip what this campaign already sent - resumes after a crash or restart
+    campaign = campaign or Path(excel_path).stem
+    ledger = ledger or SendLedger()
+    # The split's fingerprints from its manifest - a PDF is only opened when it is not listed
+    known = written_fingerprints(pdf_folder)
+    for task in tasks:
+        task['attachment_hash'] = attachment_fingerprint(task['pdf_file'], task['email'], task.get('nic'),
+                                                         known.get(Path(task['pdf_file']).resolve()))
+    already_sent = ledger.sent_keys(campaign)
+    sent_policies = {policy_number for policy_number, _ in already_sent}
+    dead_letters = ledger.keys_with_status(campaign, DEAD_LETTER) if replay_dead_letters else None
+    skipped_count = 0
+    pending = []
+    for task in tasks:
+        key = (task['policy_number'], task['attachment_hash'])
+        # Rows recorded before the ledger used content fingerprints hold the file hash
+        legacy_sent = (key not in already_sent and task['policy_number'] in sent_policies
+                       and (task['policy_number'], attachment_hash(task['pdf_file'])) in already_sent)
+        if key in already_sent or legacy_sent or (dead_letters is not None and key not in dead_letters):
+            skipped_count += 1
         else:
-            # Numeric format: 29031933 -> 29031933
-            policy_lookup = filename
-        
-        # Find email for this policy
-        if policy_lookup not in policy_email_map:
-            print(f"⚠️  No email found for policy: {policy_lookup}")
-            failed_count += 1
-            failed_policies.append(policy_lookup)
-            continue
-        
-        recipient_email = policy_email_map[policy_lookup]
-        
-        try:
-            # Read PDF file and encode to base64
-            with open(pdf_file, 'rb') as f:
-                pdf_content = f.read()
-                pdf_base64 = base64.b64encode(pdf_content).decode('utf-8')
-            
-            # Extract customer name (basic extraction from policy number)
-            customer_name = "Valued Client"  # Updated to match the formal greeting
-            
-            # Create dynamic subject line with policy number
-            email_subject = SUBJECT_TEMPLATE.format(policy_number=policy_lookup)
-            
-            # Prepare email content (both HTML and text versions)
-            email_content_html = EMAIL_TEMPLATE_HTML.format(
-                customer_name=customer_name,
-                policy_number=policy_lookup,
-                sender_name=SENDER_NAME
-            )
-            
-            email_content_text = EMAIL_TEMPLATE_TEXT.format(
-                customer_name=customer_name,
-                policy_number=policy_lookup,
-                sender_name=SENDER_NAME
-            )
-            
-            # Create email object with professional HTML template
-            send_smtp_email = sib_api_v3_sdk.SendSmtpEmail(
-                to=[{"email": recipient_email}],
-                sender={"name": SENDER_NAME, "email": SENDER_EMAIL},
-                reply_to={"name": REPLY_TO_NAME, "email": REPLY_TO_EMAIL},
-                subject=email_subject,
-                html_content=email_content_html,
-                text_content=email_content_text,
-                attachment=[{
-                    "content": pdf_base64,
-                    "name": f"Policy_{filename}.pdf"
-                }]
-            )
-            
-            # Send email
-            api_response = api_instance.send_transac_email(send_smtp_email)
-            print(f"✅ Sent to {recipient_email} - Policy: {policy_lookup}")
-            sent_count += 1
-            
-            # Rate limiting - Brevo free tier has limits
-            time.sleep(0.1)  # Small delay between emails
-            
-        except ApiException as e:
-            # Enhanced error reporting for Brevo API errors
-            error_details = str(e)
-            if "401" in error_details:
-                error_reason = "Invalid API key or authentication failed"
-            elif "402" in error_details:
-                error_reason = "Insufficient credits or plan limit exceeded"
-            elif "400" in error_details:
-                error_reason = "Invalid email format or request data"
-            elif "403" in error_details:
-                error_reason = "Sender domain not verified or forbidden"
-            elif "429" in error_details:
-                error_reason = "Rate limit exceeded - too many requests"
-            elif "500" in error_details:
-                error_reason = "Brevo server error - temporary issue"
+            pending.append(task)
+    tasks = pending
+    ledger.queue(campaign, tasks)
+    if replay_dead_letters:
+        print(f"📮 Campaign '{campaign}': replaying {len(tasks)} dead letters")
+    else:
+        print(f"📒 Campaign '{campaign}': {skipped_count} already sent, {len(tasks)} to send")
+    
+    # Optionally one email per customer address, the ledger still tracks each policy
+    if group_by_recipient is None:
+        group_by_recipient = ProductionConfig.EMAIL_GROUP_BY_RECIPIENT
+    policy_task_count = len(tasks)
+    if group_by_recipient:
+        tasks = group_tasks_by_recipient(tasks)
+        print(f"👥 Grouped {policy_task_count} policies into {len(tasks)} emails by recipient")
+    
+    events.emit('start', campaign=campaign, total=policy_task_count, emails=len(tasks),
+                rejected=rejected_count, skipped=skipped_count)
+    started = time.monotonic()
+    
+    # Send emails concurrently - Brevo plan limits are enforced by the token bucket,
+    # and the adaptive controller finds how many sends Brevo takes in parallel
+    max_workers = ProductionConfig.MAX_WORKERS
+    rate_limiter = rate_limiter or TokenBucket(ProductionConfig.EMAIL_RATE_LIMIT)
+    if concurrency is None and ProductionConfig.EMAIL_ADAPTIVE_CONCURRENCY:
+        concurrency = AIMDController(max_workers, maximum=ProductionConfig.EMAIL_MAX_CONCURRENCY)
+    last_stats = time.monotonic()
+    
+    def send_one(task):
+        """Send one policy email; returns its result and output lines"""
+        return send_policy_email(api_instance, task, rate_limiter, concurrency, events)
+    
+    def report_result(result):
+        nonlocal last_stats
+        # Recorded and printed from the main thread so each policy's lines stay together
+        ledger.record(campaign, result)
+        print("\n".join(result['lines']), flush=True)
+        for policy_number, _ in result['policies']:
+            if result['ok']:
+                events.emit('sent', policy=policy_number, email=result['email'],
+                            latency_ms=result['latency_ms'], attempts=result['attempts'])
             else:
-                error_reason = f"API Error: {error_details}"
-            
-            print(f"❌ Failed to send to {recipient_email} - Policy: {policy_lookup}")
-            print(f"   Reason: {error_reason}")
-            failed_count += 1
-            failed_policies.append(policy_lookup)
-            
-        except Exception as e:
-            print(f"❌ Unexpected error for policy {policy_lookup} - Email: {recipient_email}")
-            print(f"   Reason: {str(e)}")
-            failed_count += 1
-            failed_policies.append(policy_lookup)
+                events.emit('failed', policy=policy_number, email=result['email'],
+                            latency_ms=result['latency_ms'], attempts=result['attempts'],
+                            error_code=result['error_code'], error=result['error'],
+                            dead_letter=result['dead_letter'])
+        
+        # Window and throughput for the progress UI, every couple of seconds
+        if concurrency is not None and time.monotonic() - last_stats >= 2:
+            last_stats = time.monotonic()
+            stats = concurrency.stats()
+            latency = f"{stats['latency_ms']:.0f} ms" if stats['latency_ms'] else "-"
+            print(f"📈 Send window: {stats['window']:.1f} in flight, {stats['throughput']:.1f} emails/s, "
+                  f"latency {latency}", flush=True)
+            events.emit('window', **stats)
+    
+    if concurrency is not None:
+        print(f"🚀 Sending with an adaptive window (start {max_workers}, max {concurrency.maximum}) "
+              f"at up to {ProductionConfig.EMAIL_RATE_LIMIT:g} emails/second")
+    else:
+        print(f"🚀 Sending with {max_workers} worker(s) at up to {ProductionConfig.EMAIL_RATE_LIMIT:g} emails/second")
+    # Attachments are read, encoded and rendered ahead of the senders, within a memory budget
+    results = send_concurrently(tasks, send_one, max_workers, rate_limiter, on_result=report_result,
+                                concurrency=concurrency, prepare=prepare_policy_email,
+                                max_prefetch_bytes=ProductionConfig.EMAIL_PREFETCH_MB * 1024 * 1024)
+    
+    # Counted per policy, grouped emails carry several
+    sent_count = sum(len(result['policies']) for result in results if result['ok'])
+    dead_letter_count = sum(len(result['policies']) for result in results if result['dead_letter'])
+    emails_sent = sum(result['ok'] for result in results)
+    for result in results:
+        if not result['ok']:
+            failed_count += len(result['policies'])
+            failed_policies.extend(policy_number for policy_number, _ in result['policies'])
+    
+    # Confirms sends reuse pooled connections instead of paying a handshake each
+    connections = connection_stats(api_instance)
+    
+    events.emit('done', sent=sent_count, failed=failed_count, rejected=rejected_count,
+                skipped=skipped_count, dead_letters=dead_letter_count, emails=emails_sent,
+                elapsed=round(time.monotonic() - started, 1), connections=connections)
+    if own_events:
+        events.close()
     
     # Final summary
     print(f"\n🎉 EMAIL SENDING COMPLETED!")
     print(f"📊 SUMMARY:")
     print(f"- Total PDFs processed: {len(pdf_files)}")
     print(f"- Emails sent successfully: {sent_count}")
+    if group_by_recipient:
+        print(f"- Brevo messages (grouped by recipient): {emails_sent}")
     print(f"- Failed to send: {failed_count}")
-    print(f"- Success rate: {sent_count/(sent_count+failed_count)*100:.1f}%")
+    print(f"- Rejected before sending: {rejected_count}")
+    print(f"- Skipped (already sent): {skipped_count}")
+    print(f"- Dead letters (retries exhausted): {dead_letter_count}")
+    print(f"- Success rate: {sent_count/max(sent_count+failed_count, 1)*100:.1f}%")
+    if connections:
+        handshake = f"{connections['handshake_ms']:.0f} ms" if connections['handshake_ms'] else "-"
+        print(f"- Connections: {connections['connections']} opened for {connections['requests']} requests "
+              f"({connections['reuse_rate']*100:.0f}% reused, avg handshake {handshake})")
     
     if failed_policies:
         print(f"\n⚠️  Failed policies:")
@@ -304,8 +594,14 @@ NIC - Serving you, Serving the Nation
 SUMMARY:
 - Total PDFs processed: {len(pdf_files)}
 - Emails sent successfully: {sent_count}
+- Brevo messages sent: {emails_sent}{" (grouped by recipient)" if group_by_recipient else ""}
 - Failed to send: {failed_count}
-- Success rate: {sent_count/(sent_count+failed_count)*100:.1f}%
+- Rejected before sending: {rejected_count} (see {rejects_path})
+- Skipped (already sent): {skipped_count}
+- Dead letters (retries exhausted): {dead_letter_count}
+- Success rate: {sent_count/max(sent_count+failed_count, 1)*100:.1f}%
+
+CAMPAIGN: {campaign}
 
 CONFIGURATION USED:
 - Sender: {SENDER_NAME} <{SENDER_EMAIL}>
@@ -315,16 +611,19 @@ CONFIGURATION USED:
 FAILED POLICIES:
 {chr(10).join([f"- {policy}" for policy in failed_policies])}
 
+REJECTED POLICIES:
+{chr(10).join([f"- {row.policy_number}: {row.detail}" for row in not_sent.itertuples(index=False)])}
+
 NEXT STEPS:
 - Review failed policies and retry if needed
 - Check Brevo dashboard for delivery statistics
 - Monitor bounce rates and spam reports
 """
     
-    with open("email_sending_report.txt", "w") as f:
+    with open(report_path, "w") as f:
         f.write(report_content)
     
-    print(f"\n📄 Detailed report saved to: email_sending_report.txt")
+    print(f"\n📄 Detailed report saved to: {report_path}")
 
 def install_requirements():
     """Install required packages"""
@@ -337,6 +636,17 @@ if __name__ == "__main__":
     # Check if running in automated mode (from web interface)
     automated_mode = len(sys.argv) > 1 and sys.argv[1] == "--automated"
     
+    # Optional campaign name for the send ledger: --campaign "Nov25"
+    campaign = None
+    if "--campaign" in sys.argv[1:-1]:
+        campaign = sys.argv[sys.argv.index("--campaign") + 1]
+    
+    # Resend only the sends that ran out of retries last time
+    replay_dead_letters = "--replay-dead-letters" in sys.argv
+    
+    # One email per customer carrying all of their policies
+    group_by_recipient = True if "--group-by-recipient" in sys.argv else None
+    
     if not automated_mode:
         print("BREVO EMAIL SENDER FOR POLICY DOCUMENTS")
         print("=" * 50)
@@ -366,7 +676,8 @@ if __name__ == "__main__":
     
     # Run the email sending
     try:
-        send_policy_emails()
+        send_policy_emails(campaign=campaign, replay_dead_letters=replay_dead_letters,
+                           group_by_recipient=group_by_recipient)
     except Exception as e:
         print(f"❌ Email sending failed: {str(e)}")
         sys.exit(1)
\ No newline at end of file
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+JSON-lines progress events from the email sender to the Streamlit app
+
+The sender writes one JSON object per line to a dedicated pipe whose file
+descriptor (or Windows handle) is passed in SEND_EVENTS_FD, so the UI no
+longer has to scrape the human-readable stdout.
+
+Events: start, sent, failed, retry, window, done and error (the run
+stopped before sending). The resident sender streams the same events
+over its Unix socket.
+"""
+import os
+import sys
+import json
+import time
+import threading
+
+EVENTS_FD_ENV = 'SEND_EVENTS_FD'
+
+
+class EventStream:
+    """Writes progress events to the pipe named in SEND_EVENTS_FD
+
+    Or to an open text ``file``, e.g. a client socket of the resident
+    sender. Without either (a run from the terminal) every emit is a
+    no-op. Safe to call from the send worker threads.
+    """
+
+    def __init__(self, fd=None, file=None):
+        if fd is None and file is None:
+            fd = os.getenv(EVENTS_FD_ENV)
+        self._file = file
+        self._lock = threading.Lock()
+        if fd and file is None:
+            try:
+                self._file = os.fdopen(_child_fd(int(fd)), 'w', encoding='utf-8', buffering=1)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Progress events disabled: {e}")
+
+    def emit(self, event, **fields):
+        if self._file is None:
+            return
+        line = json.dumps(dict(fields, event=event, time=round(time.time(), 3)), default=str)
+        with self._lock:
+            if self._file is None:
+                return
+            try:
+                self._file.write(line + "\n")
+                self._file.flush()
+            except (OSError, ValueError):
+                # The UI went away - keep sending, just stop reporting
+                self._file = None
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                try:
+                    self._file.close()
+                except OSError:
+                    pass
+                self._file = None
+
+
+def _child_fd(value):
+    """File descriptor for the inherited pipe end (Windows passes a handle)"""
+    if sys.platform == 'win32':
+        import msvcrt
+        return msvcrt.open_osfhandle(value, os.O_WRONLY)
+    return value
+
+
+def open_event_pipe(env, popen_kwargs):
+    """Create the event pipe for a sender subprocess
+
+    Adds SEND_EVENTS_FD to ``env`` and the inheritance settings to
+    ``popen_kwargs``. Returns ``(reader, write_fd)`` - close ``write_fd``
+    once the process has started so the reader sees EOF when it exits.
+    """
+    read_fd, write_fd = os.pipe()
+    if sys.platform == 'win32':
+        import msvcrt
+        import subprocess
+        handle = msvcrt.get_osfhandle(write_fd)
+        os.set_handle_inheritable(handle, True)
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.lpAttributeList = {'handle_list': [handle]}
+        popen_kwargs['startupinfo'] = startupinfo
+        env[EVENTS_FD_ENV] = str(handle)
+    else:
+        popen_kwargs['pass_fds'] = (write_fd,)
+        env[EVENTS_FD_ENV] = str(write_fd)
+    return os.fdopen(read_fd, 'r', encoding='utf-8'), write_fd
+
+
+def read_events(reader):
+    """Yield event dicts from the pipe until the sender closes it"""
+    for line in reader:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            continue
+
+
+def format_event(event):
+    """One line of activity log for an event, in the sender's own wording"""
+    kind = event.get('event')
+    if kind == 'start':
+        return f"📒 Campaign '{event['campaign']}': {event['skipped']} already sent, {event['total']} to send"
+    if kind == 'sent':
+        return f"✅ Sent to {event['email']} - Policy: {event['policy']}"
+    if kind == 'failed':
+        return f"❌ Failed to send to {event['email']} - Policy: {event['policy']} - {event['error']}"
+    if kind == 'retry':
+        return f"🔁 Retry {event['attempt']} for policy {event['policy']} in {event['delay']:.1f}s - {event['error']}"
+    if kind == 'window':
+        return f"📈 Send window: {event['window']:.1f} in flight, {event['throughput']:.1f} emails/s"
+    if kind == 'done':
+        return f"🎉 EMAIL SENDING COMPLETED! {event['sent']} sent, {event['failed']} failed"
+    if kind == 'error':
+        return f"❌ {event['message']}"
+    return json.dumps(event)
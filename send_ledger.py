@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Durable ledger of policy emails so an interrupted campaign can resume
+"""
+import io
+import time
+import sqlite3
+import hashlib
+import logging
+
+from policy_manifest import FINGERPRINT_METADATA_KEY
+from policy_scanner import open_pdf_reader
+from production_config import ProductionConfig
+
+QUEUED = 'queued'
+SENT = 'sent'
+FAILED = 'failed'        # Permanent error (bad address, no credits, ...)
+DEAD_LETTER = 'dead'     # Retryable error that ran out of retries
+
+
+def attachment_hash(path):
+    """SHA-256 of a policy PDF file"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _embedded_fingerprint(data, nic):
+    """The fingerprint the split wrote into a policy PDF, or None"""
+    try:
+        reader = open_pdf_reader(io.BytesIO(data))
+        try:
+            encrypted = reader.is_encrypted
+        except AttributeError:
+            # Older PyPDF2 version
+            encrypted = reader.isEncrypted
+        if encrypted:
+            if not nic or not reader.decrypt(nic):
+                return None
+        try:
+            info = reader.metadata
+        except AttributeError:
+            # Older PyPDF2 version
+            info = reader.getDocumentInfo()
+        value = info.get(FINGERPRINT_METADATA_KEY) if info else None
+        return str(value) if value else None
+    except Exception:
+        return None
+
+
+def attachment_fingerprint(path, email, nic=None, known=None):
+    """Ledger key of a policy PDF - the split's fingerprint plus the recipient
+
+    Encryption gives a protected PDF new bytes on every write, so the file
+    hash would change each time the policies are re-processed and a re-run
+    would email everyone again. The split fingerprints each policy's
+    pages, Excel row and output settings instead: ``known`` passes it from
+    the manifest (written_fingerprints), otherwise it is read from the PDF
+    in one read, decrypted with ``nic``. A PDF the split did not write is
+    keyed on its file hash.
+    """
+    if known is None:
+        with open(path, 'rb') as f:
+            data = f.read()
+        known = _embedded_fingerprint(data, nic) or hashlib.sha256(data).hexdigest()
+    return hashlib.sha256(f"{known}|{email}".encode()).hexdigest()
+
+
+class SendLedger:
+    """SQLite ledger keyed by campaign + policy + attachment fingerprint
+
+    The ``attachment_hash`` column holds attachment_fingerprint.
+
+    Every send is recorded as it completes, so after a crash or restart
+    a re-run skips the rows already marked sent.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or ProductionConfig.storage_root() / "send_ledger.sqlite3"
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        connection = sqlite3.connect(str(self.path), timeout=10)
+        # WAL keeps one commit per send cheap and lets the UI read while sending
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("""
+            CREATE TABLE IF NOT EXISTS sends (
+                campaign        TEXT NOT NULL,
+                policy_number   TEXT NOT NULL,
+                attachment_hash TEXT NOT NULL,
+                email           TEXT NOT NULL,
+                status          TEXT NOT NULL,
+                message_id      TEXT,
+                latency_ms      REAL,
+                attempts        INTEGER NOT NULL DEFAULT 0,
+                error           TEXT,
+                updated_at      REAL NOT NULL,
+                PRIMARY KEY (campaign, policy_number, attachment_hash)
+            )
+        """)
+        return connection
+
+    def keys_with_status(self, campaign, status):
+        """Set of (policy_number, attachment_hash) in a campaign with the given status"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT policy_number, attachment_hash FROM sends WHERE campaign = ? AND status = ?",
+                (campaign, status)
+            ).fetchall()
+        finally:
+            connection.close()
+        return set(rows)
+
+    def sent_keys(self, campaign):
+        """Set of (policy_number, attachment_hash) already sent in a campaign"""
+        return self.keys_with_status(campaign, SENT)
+
+    def dead_letters(self, campaign=None):
+        """Dead-lettered sends as dicts, newest first - all campaigns by default"""
+        query = "SELECT campaign, policy_number, email, attempts, error, updated_at FROM sends WHERE status = ?"
+        params = [DEAD_LETTER]
+        if campaign is not None:
+            query += " AND campaign = ?"
+            params.append(campaign)
+        connection = self._connect()
+        try:
+            rows = connection.execute(query + " ORDER BY updated_at DESC", params).fetchall()
+        finally:
+            connection.close()
+        columns = ('campaign', 'policy_number', 'email', 'attempts', 'error', 'updated_at')
+        return [dict(zip(columns, row)) for row in rows]
+
+    def queue(self, campaign, tasks):
+        """Mark tasks as queued, keeping the state of rows that were already sent"""
+        now = time.time()
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany("""
+                    INSERT INTO sends (campaign, policy_number, attachment_hash, email, status, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (campaign, policy_number, attachment_hash)
+                    DO UPDATE SET status = excluded.status, email = excluded.email,
+                                  updated_at = excluded.updated_at
+                    WHERE sends.status != 'sent'
+                """, [
+                    (campaign, task['policy_number'], task['attachment_hash'], task['email'], QUEUED, now)
+                    for task in tasks
+                ])
+        finally:
+            connection.close()
+
+    def record(self, campaign, result):
+        """Store the outcome of one send (a result dict from send_policy_email)
+
+        A grouped email updates the row of every policy it carried.
+        """
+        if result['ok']:
+            status = SENT
+        elif result.get('dead_letter'):
+            status = DEAD_LETTER
+        else:
+            status = FAILED
+        policies = result.get('policies') or [(result['policy_number'], result.get('attachment_hash'))]
+        now = time.time()
+        try:
+            connection = self._connect()
+            try:
+                with connection:
+                    connection.executemany("""
+                        UPDATE sends
+                        SET status = ?, message_id = ?, latency_ms = ?, attempts = attempts + ?,
+                            error = ?, updated_at = ?
+                        WHERE campaign = ? AND policy_number = ? AND attachment_hash = ?
+                    """, [
+                        (status, result.get('message_id'), result.get('latency_ms'), result.get('attempts', 1),
+                         result.get('error'), now, campaign, policy_number, policy_hash)
+                        for policy_number, policy_hash in policies
+                    ])
+            finally:
+                connection.close()
+        except sqlite3.Error as e:
+            # Never lose the send itself over a ledger problem
+            logging.warning(f"Could not record send for policy {result['policy_number']}: {e}")
+
+    def summary(self, campaign):
+        """{status: count} for a campaign"""
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT status, COUNT(*) FROM sends WHERE campaign = ? GROUP BY status", (campaign,)
+            ).fetchall()
+        finally:
+            connection.close()
+        return dict(rows)
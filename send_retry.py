@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Retry policy for Brevo API calls - error classification and backoff
+"""
+import time
+import random
+import socket
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+
+from production_config import ProductionConfig
+
+# Brevo rate-limit headers: seconds until the window resets
+RATE_LIMIT_RESET_HEADER = 'x-sib-ratelimit-reset'
+RATE_LIMIT_REMAINING_HEADER = 'x-sib-ratelimit-remaining'
+
+
+class SendFailed(Exception):
+    """A send that failed for good, after ``attempts`` tries"""
+
+    def __init__(self, error, attempts, retryable):
+        super().__init__(str(error))
+        self.error = error
+        self.attempts = attempts
+        self.retryable = retryable
+
+
+def _status(error):
+    status = getattr(error, 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """Retry 429, 5xx, timeouts and connection drops
+
+    Everything else is permanent - 400/401/402/403 (bad request, bad key,
+    no credits, unverified sender) will not succeed on a retry.
+    """
+    status = _status(error)
+    if status is not None and status > 0:
+        return status == 429 or status >= 500
+    if isinstance(error, (TimeoutError, socket.timeout, ConnectionError)):
+        return True
+    try:
+        import urllib3.exceptions
+        # The Brevo SDK surfaces network problems as raw urllib3 errors
+        if isinstance(error, (urllib3.exceptions.TimeoutError, urllib3.exceptions.ProtocolError,
+                              urllib3.exceptions.MaxRetryError, urllib3.exceptions.NewConnectionError)):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def _header(error, name):
+    headers = getattr(error, 'headers', None) or {}
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def server_delay(error):
+    """Seconds the server asked us to wait (Retry-After or rate-limit reset), or None"""
+    retry_after = _header(error, 'retry-after')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            try:
+                # HTTP-date form
+                when = parsedate_to_datetime(retry_after)
+                return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+            except (TypeError, ValueError):
+                pass
+
+    reset = _header(error, RATE_LIMIT_RESET_HEADER)
+    remaining = _header(error, RATE_LIMIT_REMAINING_HEADER)
+    if reset and (_status(error) == 429 or remaining in ('0', 0)):
+        try:
+            return max(0.0, float(reset))
+        except ValueError:
+            pass
+    return None
+
+
+def backoff_delay(attempt, error=None, base_delay=None, max_delay=None):
+    """Delay before retry number ``attempt`` (1-based)
+
+    The server's Retry-After or rate-limit reset wins; otherwise full
+    jitter over an exponentially growing window, so parallel senders
+    that failed together do not retry together.
+    """
+    base_delay = ProductionConfig.RETRY_BASE_DELAY if base_delay is None else base_delay
+    max_delay = ProductionConfig.RETRY_MAX_DELAY if max_delay is None else max_delay
+
+    requested = server_delay(error) if error is not None else None
+    if requested is not None:
+        # A little jitter on top so queued senders spread out after the reset
+        return min(max_delay, requested) + random.uniform(0, base_delay)
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+def call_with_retries(func, retries=None, before_retry=None, on_retry=None, sleep=time.sleep):
+    """Call ``func()``, retrying retryable errors up to ``retries`` times
+
+    ``before_retry`` runs before each retry (e.g. to take a rate-limit
+    token) and ``on_retry(attempt, delay, error)`` before each backoff.
+    Returns ``(result, attempts_used)``; raises SendFailed when the error
+    is permanent or the retries run out.
+    """
+    retries = ProductionConfig.RETRY_ATTEMPTS if retries is None else retries
+    attempts = max(0, retries) + 1
+    for attempt in range(1, attempts + 1):
+        if before_retry is not None and attempt > 1:
+            before_retry()
+        try:
+            return func(), attempt
+        except Exception as e:
+            retryable = is_retryable(e)
+            if not retryable or attempt == attempts:
+                raise SendFailed(e, attempt, retryable) from e
+            delay = backoff_delay(attempt, e)
+            if on_retry is not None:
+                on_retry(attempt, delay, e)
+            sleep(delay)
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Pre-send validation of the policy-email list, so doomed sends never reach Brevo
+"""
+import os
+from pathlib import Path
+
+import pandas as pd
+
+from policy_index import email_cells
+from production_config import ProductionConfig
+
+REJECTS_REPORT_FILE = "email_rejects_report.csv"
+
+# Practical address check: one @, no spaces, a dotted domain with a 2+ letter TLD
+EMAIL_PATTERN = r"[A-Za-z0-9.!#$%&'*+/=?^_`{|}~-]+@[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?(?:\.[A-Za-z0-9](?:[A-Za-z0-9-]*[A-Za-z0-9])?)*\.[A-Za-z]{2,}"
+
+# Reject categories, in the order they are checked
+NO_EXCEL_ROW = 'no_excel_row'
+DUPLICATE_POLICY = 'duplicate_policy'
+MISSING_ATTACHMENT = 'missing_attachment'
+MISSING_EMAIL = 'missing_email'
+INVALID_EMAIL = 'invalid_email'
+EMPTY_ATTACHMENT = 'empty_attachment'
+OVERSIZED_ATTACHMENT = 'oversized_attachment'
+MISSING_NIC = 'missing_nic'
+
+
+def _match_key(policy_numbers):
+    """Join key tolerant of the slash and leading zeros ('00407/0054316' == '407/0054316')"""
+    return policy_numbers.str.replace('/', '', regex=False).str.replace('_', '', regex=False).str.lstrip('0')
+
+
+def normalize_emails(emails):
+    """Trim, drop 'mailto:' and <...> wrappers and lower-case; non-text cells become ''"""
+    text = emails.where(emails.map(lambda value: isinstance(value, str)), '')
+    return (text.str.strip()
+                .str.replace(r'^mailto:', '', case=False, regex=True)
+                .str.strip('<>')
+                .str.strip()
+                .str.lower())
+
+
+def _policy_text(values):
+    """Policy numbers as text - Excel turns 8-digit numbers into floats when a cell is blank"""
+    return values.map(
+        lambda value: str(int(value)) if isinstance(value, float) and value.is_integer() else str(value)
+    ).str.strip()
+
+
+def _list_pdfs(pdf_folder):
+    """One row per PDF in the folder with its policy number and size"""
+    entries = [
+        (entry.name, entry.path, entry.stat().st_size)
+        for entry in os.scandir(pdf_folder)
+        if entry.is_file() and entry.name.lower().endswith('.pdf')
+    ]
+    files = pd.DataFrame(entries, columns=['file_name', 'pdf_file', 'size'])
+    files = files.sort_values('file_name', ignore_index=True)
+    stems = files['file_name'].str[:-4]
+    # Slash format: 00407_0054316 -> 00407/0054316; numeric names stay as they are
+    files['policy_number'] = stems.where(~stems.str.contains('_'), stems.str.replace('_', '/', n=1))
+    files['filename'] = stems
+    files['key'] = _match_key(stems)
+    return files
+
+
+def validate_send_list(df, pdf_folder, max_attachment_mb=None, require_nic=None):
+    """Check every PDF ready for sending against the Excel policy list
+
+    Works column-wise over the whole table: address syntax and
+    normalisation, duplicate policy rows, attachment presence and size and the NIC
+    that protects the PDF. Returns ``(tasks, rejects)`` - send tasks for
+    the PDFs that can succeed and a DataFrame of rejects with
+    policy_number, email, category, detail and action. A missing NIC
+    only rejects the send when ``require_nic`` is set; otherwise it is
+    reported with the action 'sent unprotected'.
+    """
+    max_bytes = (max_attachment_mb or ProductionConfig.EMAIL_MAX_ATTACHMENT_MB) * 1024 * 1024
+    require_nic = ProductionConfig.EMAIL_REQUIRE_NIC if require_nic is None else require_nic
+
+    files = _list_pdfs(pdf_folder)
+
+    excel = pd.DataFrame({
+        'excel_policy': _policy_text(df['Policy No']),
+        'raw_email': email_cells(df),
+        'nic': df['NIC'].where(df['NIC'].notna(), '').astype(str).str.strip() if 'NIC' in df.columns else '',
+    })
+    excel['email'] = normalize_emails(excel['raw_email'])
+    excel['key'] = _match_key(excel['excel_policy'])
+    # Excel rows are read in order, so the first row of a policy wins like in the split
+    excel['duplicate'] = excel['key'].duplicated(keep='first')
+    first_rows = excel[~excel['duplicate']]
+
+    merged = files.merge(first_rows, on='key', how='left', indicator=True)
+    has_row = merged['_merge'] == 'both'
+    merged['email'] = merged['email'].fillna('')
+    merged['nic'] = merged['nic'].fillna('')
+    valid_syntax = merged['email'].str.fullmatch(EMAIL_PATTERN).fillna(False).astype(bool)
+
+    missing_nic = merged['nic'] == ''
+    checks = [
+        (NO_EXCEL_ROW, ~has_row, "PDF has no matching row in the Excel file"),
+        (MISSING_EMAIL, merged['email'] == '', "Email cell is empty or not text"),
+        (INVALID_EMAIL, ~valid_syntax, "Email address is not valid"),
+        (EMPTY_ATTACHMENT, merged['size'] == 0, "PDF file is empty"),
+        (OVERSIZED_ATTACHMENT, merged['size'] > max_bytes,
+         f"PDF is larger than {max_bytes // (1024 * 1024)} MB"),
+    ]
+    if require_nic:
+        checks.append((MISSING_NIC, missing_nic, "No NIC - the PDF is not password protected"))
+
+    # First failing check decides the category
+    merged['category'] = None
+    merged['detail'] = None
+    for category, failed, detail in checks:
+        pending = merged['category'].isna() & failed
+        merged.loc[pending, 'category'] = category
+        merged.loc[pending, 'detail'] = detail
+
+    rejected = merged[merged['category'].notna()]
+    rejects = rejected[['policy_number', 'raw_email', 'category', 'detail']].rename(columns={'raw_email': 'email'})
+    rejects = rejects.assign(action='not sent')
+    clean = merged[merged['category'].isna()]
+
+    if not require_nic:
+        unprotected = clean[missing_nic[clean.index]]
+        rejects = pd.concat([rejects, pd.DataFrame({
+            'policy_number': unprotected['policy_number'],
+            'email': unprotected['raw_email'],
+            'category': MISSING_NIC,
+            'detail': "No NIC - the PDF is not password protected",
+            'action': 'sent unprotected',
+        })], ignore_index=True)
+
+    # Policies with a usable address but no PDF in the folder
+    orphans = first_rows[first_rows['email'].str.fullmatch(EMAIL_PATTERN).fillna(False).astype(bool)
+                         & ~first_rows['key'].isin(files['key'])]
+    if len(orphans):
+        rejects = pd.concat([rejects, pd.DataFrame({
+            'policy_number': orphans['excel_policy'],
+            'email': orphans['raw_email'],
+            'category': MISSING_ATTACHMENT,
+            'detail': "Policy has an email address but no PDF in the folder",
+            'action': 'not sent',
+        })], ignore_index=True)
+
+    # Later Excel rows for a policy are ignored by the split as well - report them too
+    duplicates = excel[excel['duplicate'] & excel['key'].isin(files['key'])]
+    if len(duplicates):
+        rejects = pd.concat([rejects, pd.DataFrame({
+            'policy_number': duplicates['excel_policy'],
+            'email': duplicates['raw_email'],
+            'category': DUPLICATE_POLICY,
+            'detail': "Policy appears more than once in the Excel file - the first row is used",
+            'action': 'first row used',
+        })], ignore_index=True)
+
+    tasks = [
+        {
+            'pdf_file': Path(row.pdf_file),
+            'filename': row.filename,
+            'policy_number': row.policy_number,
+            'email': row.email,
+            'nic': row.nic or None,
+        }
+        for row in clean.itertuples(index=False)
+    ]
+    return tasks, rejects.reset_index(drop=True)
+
+
+def save_rejects_report(rejects, path=REJECTS_REPORT_FILE):
+    """Write the rejects as CSV for review; returns the path"""
+    rejects.to_csv(path, index=False)
+    return path
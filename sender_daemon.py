@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""
+Resident email sender - campaign jobs over a local Unix socket
+
+Keeps pandas, the Brevo SDK and a pooled API client loaded, so a send
+starts at once instead of after a fresh interpreter start-up. All jobs
+share one rate limiter and adaptive window, so several app sessions stay
+within the Brevo plan together.
+
+Protocol: the client sends one JSON line, e.g.
+    {"campaign": "Nov25", "excel_path": "...", "pdf_folder": "...",
+     "replay_dead_letters": false, "group_by_recipient": null}
+and reads JSON-lines progress events (see send_events) until the
+connection closes. {"action": "ping"} answers with a "pong" event.
+"""
+import os
+import io
+import re
+import sys
+import time
+import json
+import itertools
+import signal
+import socket
+import threading
+import socketserver
+from pathlib import Path
+
+import pandas as pd
+
+from email_dispatch import AIMDController, TokenBucket
+from production_config import ProductionConfig
+from send_emails_brevo import DEFAULT_EXCEL_FILE, DEFAULT_PDF_FOLDER, send_policy_emails, setup_brevo_client
+from send_events import EventStream, read_events
+from send_ledger import SendLedger
+
+CONNECT_TIMEOUT = 2.0  # Seconds to reach the daemon before the app falls back to a subprocess
+
+
+def job_report_paths(campaign, job_id):
+    """Report and rejects file names for one job - concurrent jobs share the working directory"""
+    name = re.sub(r'[^\w.-]+', '_', campaign) + f"_{job_id}"
+    return f"email_sending_report_{name}.txt", f"email_rejects_report_{name}.csv"
+
+
+class SenderState:
+    """What the daemon keeps warm between jobs"""
+
+    def __init__(self, api_instance):
+        self.api_instance = api_instance
+        self.ledger = SendLedger()
+        self.rate_limiter = TokenBucket(ProductionConfig.EMAIL_RATE_LIMIT)
+        self.concurrency = None
+        if ProductionConfig.EMAIL_ADAPTIVE_CONCURRENCY:
+            self.concurrency = AIMDController(ProductionConfig.MAX_WORKERS,
+                                              maximum=ProductionConfig.EMAIL_MAX_CONCURRENCY)
+        self._tables = {}
+        self._running = set()
+        self._job_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def policy_table(self, excel_path):
+        """The Excel policy table, re-read only when the file changes"""
+        path = Path(excel_path).resolve()
+        mtime = path.stat().st_mtime
+        with self._lock:
+            cached = self._tables.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+        table = pd.read_excel(path)
+        with self._lock:
+            self._tables[path] = (mtime, table)
+        return table
+
+    def claim(self, campaign):
+        """Only one job per campaign at a time - two would race on the same ledger rows"""
+        with self._lock:
+            if campaign in self._running:
+                return False
+            self._running.add(campaign)
+            return True
+
+    def next_job_id(self):
+        """Unique per daemon run, and time-stamped so a restart does not reuse names"""
+        with self._lock:
+            return f"{time.strftime('%Y%m%d-%H%M%S')}-{next(self._job_ids)}"
+
+    def finish(self, campaign):
+        with self._lock:
+            self._running.discard(campaign)
+
+
+class SendJobHandler(socketserver.StreamRequestHandler):
+    """Runs one campaign job and streams its events back to the client"""
+
+    def handle(self):
+        state = self.server.state
+        events = EventStream(file=io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True))
+        try:
+            job = json.loads(self.rfile.readline() or b'{}')
+        except ValueError as e:
+            events.emit('error', message=f"Bad job request: {e}")
+            return
+        if job.get('action') == 'ping':
+            events.emit('pong', pid=os.getpid())
+            return
+
+        excel_path = job.get('excel_path') or DEFAULT_EXCEL_FILE
+        campaign = job.get('campaign') or Path(excel_path).stem
+        if not state.claim(campaign):
+            events.emit('error', message=f"Campaign '{campaign}' is already being sent")
+            return
+        try:
+            try:
+                table = state.policy_table(excel_path)
+            except Exception as e:
+                events.emit('error', message=f"Error reading Excel file: {e}")
+                return
+            report_path, rejects_path = job_report_paths(campaign, state.next_job_id())
+            print(f"📨 Job for campaign '{campaign}' from {excel_path} - report: {report_path}", flush=True)
+            send_policy_emails(
+                api_instance=state.api_instance,
+                excel_path=excel_path,
+                pdf_folder=job.get('pdf_folder') or DEFAULT_PDF_FOLDER,
+                report_path=report_path,
+                rejects_path=rejects_path,
+                campaign=campaign,
+                ledger=state.ledger,
+                replay_dead_letters=bool(job.get('replay_dead_letters')),
+                group_by_recipient=job.get('group_by_recipient'),
+                events=events,
+                rate_limiter=state.rate_limiter,
+                concurrency=state.concurrency,
+                policy_table=table,
+            )
+        except Exception as e:
+            print(f"❌ Job for campaign '{campaign}' failed: {e}", flush=True)
+            events.emit('error', message=str(e))
+        finally:
+            state.finish(campaign)
+
+
+class SenderServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path=None, api_instance=None):
+    """Run the daemon until SIGTERM/SIGINT"""
+    socket_path = Path(socket_path or ProductionConfig.sender_socket())
+    if api_instance is None:
+        api_key = os.getenv('BREVO_API_KEY')
+        if not api_key:
+            print("❌ Error: BREVO_API_KEY environment variable not set")
+            sys.exit(1)
+        api_instance = setup_brevo_client(api_key)
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    if socket_path.exists():
+        socket_path.unlink()
+    server = SenderServer(str(socket_path), SendJobHandler)
+    server.state = SenderState(api_instance)
+    os.chmod(socket_path, 0o660)
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, so call it off the main thread
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    print(f"📮 Email sender listening on {socket_path}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if socket_path.exists():
+            socket_path.unlink()
+        print("👋 Email sender stopped", flush=True)
+
+
+def submit_send_job(job, socket_path=None):
+    """Send a job to the running daemon and return an iterator of its events
+
+    Raises OSError when no daemon is listening, so the caller can fall
+    back to running send_emails_brevo.py as a subprocess.
+    """
+    socket_path = socket_path or ProductionConfig.sender_socket()
+    if not hasattr(socket, 'AF_UNIX'):
+        raise OSError("Unix sockets are not available on this platform")
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(str(socket_path))
+        # A campaign can take hours - no timeout once connected
+        client.settimeout(None)
+        client.sendall((json.dumps(job) + "\n").encode('utf-8'))
+    except OSError:
+        client.close()
+        raise
+    reader = client.makefile('r', encoding='utf-8')
+    client.close()  # The file keeps the connection open
+    return read_events(reader)
+
+
+if __name__ == "__main__":
+    serve()
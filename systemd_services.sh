@@ -30,6 +30,37 @@ ReadWritePaths=/var/www/cashback/storage /var/www/cashback/backups /var/www/cash
 WantedBy=multi-user.target
 EOF
 
+# Create resident email sender (the app hands it campaigns over storage/sender.sock)
+sudo tee /etc/systemd/system/nic-sender.service > /dev/null <<EOF
+[Unit]
+Description=NIC Policy Processor - Email Sender
+After=network.target
+Before=nic-cashback.service
+
+[Service]
+Type=simple
+User=nicapp
+Group=nicapp
+WorkingDirectory=/var/www/cashback
+Environment=PATH=/var/www/cashback/venv/bin
+Environment=PYTHONUNBUFFERED=1
+ExecStart=/var/www/cashback/venv/bin/python sender_daemon.py
+Restart=always
+RestartSec=10
+
+# Environment variables
+EnvironmentFile=/var/www/cashback/.env
+
+# Security settings - send reports are written to the working directory
+NoNewPrivileges=true
+PrivateTmp=true
+ProtectSystem=strict
+ReadWritePaths=/var/www/cashback
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
 # Create backup service
 sudo tee /etc/systemd/system/nic-backup.service > /dev/null <<EOF
 [Unit]
@@ -72,18 +103,22 @@ sudo systemctl daemon-reload
 
 # Enable and start services
 sudo systemctl enable nic-cashback.service
+sudo systemctl enable nic-sender.service
 sudo systemctl enable nic-backup.timer
 
 echo "✅ Systemd services created and enabled"
 echo ""
 echo "To start services:"
+echo "sudo systemctl start nic-sender"
 echo "sudo systemctl start nic-cashback"
 echo "sudo systemctl start nic-backup.timer"
 echo ""
 echo "To check status:"
 echo "sudo systemctl status nic-cashback"
+echo "sudo systemctl status nic-sender"
 echo "sudo systemctl status nic-backup.timer"
 echo ""
 echo "To view logs:"
 echo "sudo journalctl -u nic-cashback -f"
+echo "sudo journalctl -u nic-sender -f"
 echo "sudo journalctl -u nic-backup -f"
\ No newline at end of file
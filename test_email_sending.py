@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Tests for the email sender - retries, send-list validation and the send ledger
+Run with: python -m pytest test_email_sending.py
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from email_dispatch import TokenBucket
+from send_ledger import SendLedger
+from send_retry import SendFailed, backoff_delay, call_with_retries, is_retryable, server_delay
+from send_validation import (DUPLICATE_POLICY, EMPTY_ATTACHMENT, INVALID_EMAIL, MISSING_ATTACHMENT,
+                             MISSING_EMAIL, MISSING_NIC, NO_EXCEL_ROW, OVERSIZED_ATTACHMENT, validate_send_list)
+
+
+class ApiError(Exception):
+    """Shaped like the Brevo SDK's ApiException"""
+
+    def __init__(self, status, headers=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.headers = headers or {}
+
+
+def test_retryable_errors():
+    assert is_retryable(ApiError(429))
+    assert is_retryable(ApiError(503))
+    assert is_retryable(TimeoutError())
+    assert is_retryable(ConnectionResetError())
+    assert not is_retryable(ApiError(400))
+    assert not is_retryable(ApiError(401))
+    assert not is_retryable(ValueError("bad payload"))
+
+
+def test_server_delay_headers():
+    assert server_delay(ApiError(429, {'Retry-After': '3'})) == 3.0
+    assert server_delay(ApiError(429, {'x-sib-ratelimit-reset': '7'})) == 7.0
+    # The reset header only counts once the window is used up
+    assert server_delay(ApiError(503, {'x-sib-ratelimit-reset': '7', 'x-sib-ratelimit-remaining': '5'})) is None
+    assert server_delay(ApiError(503)) is None
+
+
+def test_backoff_delay_bounds():
+    for attempt in range(1, 8):
+        assert 0 <= backoff_delay(attempt, base_delay=1.0, max_delay=8.0) <= min(8.0, 2 ** (attempt - 1))
+    # The server's Retry-After wins, capped at max_delay plus a little jitter
+    delay = backoff_delay(1, ApiError(429, {'Retry-After': '30'}), base_delay=1.0, max_delay=8.0)
+    assert 8.0 <= delay <= 9.0
+
+
+def test_call_with_retries_recovers():
+    errors = [ApiError(503), ApiError(429, {'Retry-After': '0'})]
+    sleeps, tokens = [], []
+
+    def send():
+        if errors:
+            raise errors.pop(0)
+        return 'sent'
+
+    result = call_with_retries(send, retries=3, before_retry=lambda: tokens.append(1), sleep=sleeps.append)
+    assert result == ('sent', 3)
+    assert len(sleeps) == 2 and len(tokens) == 2
+
+
+def test_call_with_retries_gives_up():
+    with pytest.raises(SendFailed) as permanent:
+        call_with_retries(lambda: (_ for _ in ()).throw(ApiError(400)), retries=3, sleep=lambda delay: None)
+    assert (permanent.value.attempts, permanent.value.retryable) == (1, False)
+
+    with pytest.raises(SendFailed) as exhausted:
+        call_with_retries(lambda: (_ for _ in ()).throw(ApiError(503)), retries=2, sleep=lambda delay: None)
+    assert (exhausted.value.attempts, exhausted.value.retryable) == (3, True)
+
+
+def test_validate_send_list(tmp_path):
+    """Each kind of bad row is rejected once, with the first failing check as its category"""
+    for name, size in [('1001', 10), ('1002', 10), ('1003', 10), ('00407_0054316', 10),
+                       ('1005', 0), ('1006', 2 * 1024 * 1024), ('9999', 10), ('1007', 10)]:
+        (tmp_path / f"{name}.pdf").write_bytes(b'x' * size)
+    df = pd.DataFrame({
+        'Policy No': [1001.0, '1002', '1003', '407/0054316', '1005', '1006', '1007', '1001', '2000'],
+        'Owner 1 Email': [' A@B.com ', np.nan, 'bad@', ' mailto:<x@y.mu>', 'e@f.com', 'g@h.com',
+                          'i@j.com', 'z@z.com', 'k@l.com'],
+        'NIC': ['N1', 'N2', 'N3', np.nan, 'N5', 'N6', 'N7', 'N8', 'N9'],
+    })
+
+    tasks, rejects = validate_send_list(df, tmp_path, max_attachment_mb=1, require_nic=False)
+
+    sent = {task['policy_number']: task for task in tasks}
+    assert sorted(sent) == ['00407/0054316', '1001', '1007']
+    assert sent['1001']['email'] == 'a@b.com'
+    assert sent['00407/0054316']['email'] == 'x@y.mu'
+    assert sent['00407/0054316']['nic'] is None
+
+    categories = dict(zip(rejects['policy_number'], rejects['category']))
+    assert categories == {
+        '1002': MISSING_EMAIL, '1003': INVALID_EMAIL, '1005': EMPTY_ATTACHMENT,
+        '1006': OVERSIZED_ATTACHMENT, '9999': NO_EXCEL_ROW, '00407/0054316': MISSING_NIC,
+        '2000': MISSING_ATTACHMENT, '1001': DUPLICATE_POLICY,
+    }
+    unprotected = rejects[rejects['category'] == MISSING_NIC]
+    assert list(unprotected['action']) == ['sent unprotected']
+
+
+def test_validate_send_list_can_require_nic(tmp_path):
+    (tmp_path / "1001.pdf").write_bytes(b'x' * 10)
+    df = pd.DataFrame({'Policy No': ['1001'], 'Owner 1 Email': ['a@b.com'], 'NIC': [np.nan]})
+
+    tasks, rejects = validate_send_list(df, tmp_path, require_nic=True)
+
+    assert tasks == []
+    assert list(rejects['action']) == ['not sent']
+
+
+def test_validate_send_list_reads_later_email_columns(tmp_path):
+    """A policy routed to with_email by a later email column is sent to that address"""
+    from policy_index import build_policy_index
+
+    for name in ('1001', '1002'):
+        (tmp_path / f"{name}.pdf").write_bytes(b'x' * 10)
+    df = pd.DataFrame({'Policy No': ['1001', '1002'], 'Owner 1 Email': ['a@b.com', np.nan],
+                       'Email': ['ignored@b.com', 'c@d.com'], 'NIC': ['N1', 'N2']})
+
+    tasks, rejects = validate_send_list(df, tmp_path)
+
+    assert {task['policy_number']: task['email'] for task in tasks} == {'1001': 'a@b.com', '1002': 'c@d.com'}
+    assert build_policy_index(df).lookup('1002').email == 'c@d.com'
+    assert len(rejects) == 0
+
+
+@pytest.fixture
+def policy_run(tmp_path, monkeypatch):
+    """Policy PDFs split from a small synthetic upload, ready for sending"""
+    from benchmark_pipeline import generate_dataset
+    from policy_index import build_policy_index
+    from policy_manifest import policy_fingerprint, save_manifest
+    from policy_scanner import open_pdf_reader, page_count, scan_policy_pages
+    from policy_writer import plan_policy_output, write_policy_pdfs
+
+    monkeypatch.chdir(tmp_path)
+    dataset = generate_dataset(tmp_path, policies=8, email_ratio=1.0, nic_ratio=1.0)
+
+    def split(manifest=False):
+        """Write the policy PDFs - with ``manifest`` also the run manifest, like the two-pass app run"""
+        index = build_policy_index(pd.read_excel(dataset['excel_path']))
+        with open(dataset['pdf_path'], 'rb') as f:
+            reader = open_pdf_reader(f)
+            pages = scan_policy_pages(reader, dataset['pdf_path'], page_count(reader),
+                                      known_policies=[record.policy_no for record in index.records])
+            jobs = [plan_policy_output(policy_number, found, index) for policy_number, found in pages.items()]
+            write_policy_pdfs(reader, dataset['pdf_path'], jobs)
+            if manifest:
+                save_manifest({job['policy_number']: {'path': job['path'], 'fingerprint': policy_fingerprint(reader, job)}
+                               for job in jobs})
+
+    split()
+    dataset['split'] = split
+    dataset['ledger'] = SendLedger(tmp_path / "ledger.sqlite3")
+    return dataset
+
+
+def send(policy_run):
+    """Send the run's policies through a mock Brevo API; returns the API calls made"""
+    from benchmark_pipeline import MockTransactionalEmailsApi
+    from send_emails_brevo import send_policy_emails
+
+    transport = MockTransactionalEmailsApi(latency=0)
+    send_policy_emails(api_instance=transport, excel_path=policy_run['excel_path'], campaign='test',
+                       ledger=policy_run['ledger'], rate_limiter=TokenBucket(0), group_by_recipient=False)
+    return transport.calls
+
+
+def test_ledger_skips_policies_already_sent(policy_run):
+    assert send(policy_run) == 8
+    assert policy_run['ledger'].summary('test') == {'sent': 8}
+    assert send(policy_run) == 0
+
+
+def test_ledger_skips_reprocessed_policies(policy_run):
+    """Encrypting again gives the PDFs new bytes but the same letters - nothing is re-sent"""
+    send(policy_run)
+    policy_run['split']()
+    assert send(policy_run) == 0
+
+
+def test_ledger_resends_changed_address(policy_run):
+    send(policy_run)
+    df = pd.read_excel(policy_run['excel_path'])
+    df.loc[0, 'Owner 1 Email'] = "corrected@example.com"
+    df.to_excel(policy_run['excel_path'], index=False)
+    policy_run['split']()
+
+    assert send(policy_run) == 1
+
+
+def test_ledger_keys_come_from_the_manifest(policy_run, monkeypatch):
+    """With the split's manifest in place no PDF is opened to key the ledger"""
+    import send_ledger
+
+    policy_run['split'](manifest=True)
+    monkeypatch.setattr(send_ledger, '_embedded_fingerprint', lambda data, nic: pytest.fail("PDF opened"))
+
+    assert send(policy_run) == 8
+    assert send(policy_run) == 0
+
+
+def test_manifest_and_pdf_give_the_same_ledger_key(policy_run):
+    """A file keyed from the manifest in one run and from the PDF in another is not sent twice"""
+    from policy_manifest import written_fingerprints
+    from send_ledger import attachment_fingerprint
+
+    # One policy without a NIC is written unencrypted
+    df = pd.read_excel(policy_run['excel_path'])
+    df.loc[0, 'NIC'] = np.nan
+    df.to_excel(policy_run['excel_path'], index=False)
+    policy_run['split'](manifest=True)
+    known = written_fingerprints('policies_with_email')
+    tasks, _ = validate_send_list(pd.read_excel(policy_run['excel_path']), 'policies_with_email')
+
+    assert len(known) == len(tasks) == 8
+    assert any(task['nic'] is None for task in tasks)
+    for task in tasks:
+        path = task['pdf_file'].resolve()
+        assert (attachment_fingerprint(path, task['email'], task['nic'], known[path])
+                == attachment_fingerprint(path, task['email'], task['nic']))
+
+    # A file changed after the manifest was saved is not taken from it
+    os.utime(tasks[0]['pdf_file'], (time.time() + 60, time.time() + 60))
+    assert tasks[0]['pdf_file'].resolve() not in written_fingerprints('policies_with_email')
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+Tests for the PDF output - print volumes, the streaming merge and policy compaction
+Run with: python -m pytest test_pdf_output.py
+"""
+import os
+
+import pytest
+from PyPDF2 import PdfReader
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfgen import canvas
+
+from pdf_stream_merge import StreamingPdfWriter, merge_volumes, plan_volumes
+from policy_scanner import extract_page_text, open_pdf_reader, page_count
+from policy_writer import write_policy_pdf
+
+
+def make_pdf(path, pages, label=None, image=None, compress=True):
+    """A policy-like PDF; ``image`` is drawn 2 inches wide at the top of every page"""
+    pdf = canvas.Canvas(str(path), pagesize=A4, pageCompression=1 if compress else 0)
+    width, height = A4
+    label = label or os.path.basename(str(path))
+    for page in range(pages):
+        pdf.setFont("Helvetica-Bold", 14)
+        pdf.drawString(50, height - 50, "NIC Life Insurance Mauritius")
+        pdf.setFont("Helvetica", 10)
+        pdf.drawString(50, height - 75, f"{label} page {page + 1} of {pages}")
+        for line_no in range(30):
+            pdf.drawString(50, height - 110 - line_no * 15, f"Clause {line_no}: lorem ipsum dolor sit amet")
+        if image is not None:
+            pdf.drawImage(str(image), width - 194, height - 194, 144, 144)
+        pdf.showPage()
+    pdf.save()
+    return str(path)
+
+
+def page_texts(path):
+    with open(path, 'rb') as f:
+        reader = open_pdf_reader(f)
+        return [extract_page_text(reader, page_num) for page_num in range(page_count(reader))]
+
+
+def test_streaming_merge_is_strictly_readable(tmp_path):
+    """Pages come out in order and the result parses without repairs"""
+    files = [make_pdf(tmp_path / f"{name}.pdf", 2) for name in 'abc']
+    output = tmp_path / "merged.pdf"
+
+    with StreamingPdfWriter(str(output), optimize=False) as writer:
+        for path in files:
+            assert writer.append(path) == 2
+
+    assert len(PdfReader(str(output), strict=True).pages) == 6
+    assert page_texts(output) == [text for path in files for text in page_texts(path)]
+
+
+def test_streaming_merge_discards_failed_document(tmp_path):
+    good = make_pdf(tmp_path / "a.pdf", 2)
+    broken = tmp_path / "b.pdf"
+    broken.write_bytes(b"%PDF-1.4\nbroken")
+    output = tmp_path / "merged.pdf"
+
+    with StreamingPdfWriter(str(output), optimize=False) as writer:
+        writer.append(good)
+        with pytest.raises(Exception):
+            writer.append(str(broken))
+
+    assert len(PdfReader(str(output), strict=True).pages) == 2
+
+
+def test_plan_volumes_page_limit(tmp_path):
+    files = [make_pdf(tmp_path / f"{name}.pdf", pages) for name, pages in
+             [('a', 2), ('b', 2), ('c', 2), ('d', 6), ('e', 1)]]
+
+    volumes = plan_volumes(files, max_pages=5, max_mb=0)
+
+    # 'd' is larger than the limit on its own and gets a volume of its own
+    assert [[os.path.basename(path)[0] for path in volume] for volume in volumes] == [['a', 'b'], ['c'], ['d'], ['e']]
+
+
+def test_plan_volumes_size_limit(tmp_path):
+    files = [make_pdf(tmp_path / f"{name}.pdf", 1) for name in 'abcde']
+    largest = max(os.path.getsize(path) for path in files)
+
+    volumes = plan_volumes(files, max_pages=0, max_mb=largest * 2.5 / (1024 * 1024))
+
+    assert [len(volume) for volume in volumes] == [2, 2, 1]
+    assert plan_volumes(files, max_pages=0, max_mb=0) == [files]
+
+
+def test_plan_volumes_keeps_unreadable_files(tmp_path):
+    good = make_pdf(tmp_path / "a.pdf", 3)
+    broken = tmp_path / "b.pdf"
+    broken.write_bytes(b"not a pdf")
+
+    assert plan_volumes([good, str(broken)], max_pages=3, max_mb=0) == [[good, str(broken)]]
+
+
+def test_merge_volumes_index(tmp_path):
+    files = [make_pdf(tmp_path / f"{name}.pdf", pages) for name, pages in [('a', 2), ('b', 3), ('c', 1)]]
+
+    volumes, index_path = merge_volumes(files, str(tmp_path / "print"), max_pages=4, max_mb=0)
+
+    assert [volume['pages'] for volume in volumes] == [2, 4]
+    assert [entry[0] for entry in volumes[1]['files']] == ['b.pdf', 'c.pdf']
+    assert page_texts(volumes[1]['path']) == page_texts(files[1]) + page_texts(files[2])
+    assert os.path.exists(index_path)
+
+
+@pytest.fixture
+def photo(tmp_path):
+    """A 1200x1200 JPEG - 600 DPI when drawn 2 inches wide"""
+    Image = pytest.importorskip("PIL.Image")
+    path = tmp_path / "photo.jpg"
+    picture = Image.effect_noise((1200, 1200), 40).convert('RGB')
+    picture.save(path, 'JPEG', quality=90)
+    return path
+
+
+def image_objects(path):
+    """Distinct image XObjects drawn by the pages of a PDF"""
+    reader = PdfReader(str(path))
+    images = set()
+    for page in reader.pages:
+        xobjects = page['/Resources'].get('/XObject', {})
+        for name in xobjects:
+            reference = xobjects.raw_get(name)
+            if xobjects[name]['/Subtype'] == '/Image':
+                images.add(reference.idnum)
+    return images
+
+
+def test_optimized_merge_shares_fonts_and_images(tmp_path, photo):
+    """Identical fonts and images are written once, still readable with strict parsing"""
+    files = [make_pdf(tmp_path / f"{name}.pdf", 2, image=photo, compress=False) for name in 'abc']
+    output = tmp_path / "merged.pdf"
+
+    with StreamingPdfWriter(str(output), optimize=True) as writer:
+        for path in files:
+            writer.append(path)
+
+    assert len(PdfReader(str(output), strict=True).pages) == 6
+    assert page_texts(output) == [text for path in files for text in page_texts(path)]
+    assert writer.stats['duplicates'] > 0
+    assert writer.stats['compressed_streams'] > 0
+    assert len(image_objects(output)) == 1
+    assert os.path.getsize(output) < sum(os.path.getsize(path) for path in files)
+
+
+def write_policy(source, output, compact, max_image_dpi=0):
+    with open(source, 'rb') as f:
+        reader = open_pdf_reader(f)
+        return write_policy_pdf(reader, {
+            'policy_number': '1001', 'pages': list(range(page_count(reader))), 'path': str(output),
+            'password': None, 'has_email': True, 'email': 'client@example.com', 'compact': compact,
+            'max_image_dpi': max_image_dpi,
+            'warnings': [],
+        })
+
+
+def test_compaction_keeps_page_content(tmp_path, photo):
+    source = make_pdf(tmp_path / "source.pdf", 3, image=photo, compress=False)
+    plain = write_policy(source, tmp_path / "plain.pdf", compact=False)
+    compact = write_policy(source, tmp_path / "compact.pdf", compact=True)
+
+    assert page_texts(compact['path']) == page_texts(plain['path'])
+    for plain_page, compact_page in zip(PdfReader(plain['path']).pages, PdfReader(compact['path']).pages):
+        assert plain_page.mediabox == compact_page.mediabox
+        assert set(plain_page['/Resources']['/Font']) == set(compact_page['/Resources']['/Font'])
+    assert compact['size'] < plain['size']
+    assert compact['compact_saved'] > 0
+
+
+def test_compaction_resamples_shared_image_once(tmp_path, photo):
+    source = make_pdf(tmp_path / "source.pdf", 3, image=photo)
+    plain = write_policy(source, tmp_path / "plain.pdf", compact=False)
+    compact = write_policy(source, tmp_path / "compact.pdf", compact=True, max_image_dpi=150)
+
+    assert page_texts(compact['path']) == page_texts(plain['path'])
+    images = image_objects(compact['path'])
+    assert len(images) == 1
+    image = PdfReader(compact['path']).get_object(images.pop())
+    assert (image['/Width'], image['/Height']) == (300, 300)
+    # The saving is counted once, not once per page
+    assert 0 < compact['compact_saved'] <= plain['size'] - compact['size'] + 4096
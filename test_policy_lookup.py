@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Tests for the Excel policy index and the page-text policy matcher
+Run with: python -m pytest test_policy_lookup.py
+"""
+import pandas as pd
+
+from policy_index import build_policy_index
+from policy_matcher import PolicyMatcher
+
+
+def make_index(policies, emails=None, nics=None):
+    return build_policy_index(pd.DataFrame({
+        'Policy No': policies,
+        'Owner 1 Email': emails or [f"client{i}@example.com" for i in range(len(policies))],
+        'NIC': nics or [f"N{i}" for i in range(len(policies))],
+    }))
+
+
+def test_lookup_exact_slash_and_zero_forms():
+    """A PDF number finds its row with or without the slash and leading zeros"""
+    index = make_index(['00407/0054316', '12345678'])
+
+    assert index.lookup('00407/0054316').policy_no == '00407/0054316'
+    assert index.lookup('004070054316').policy_no == '00407/0054316'
+    assert index.lookup('0012345678').policy_no == '12345678'
+    assert index.lookup(' 12345678 ').policy_no == '12345678'
+    assert index.lookup('99999999') is None
+
+
+def test_lookup_prefers_first_excel_row():
+    """Duplicate and colliding rows resolve to the first row, and are reported"""
+    index = make_index(['1234', '1234', '01234'], emails=['a@example.com', 'b@example.com', 'c@example.com'])
+
+    assert index.lookup('1234').email == 'a@example.com'
+    # '01234' also matches the first row without its zero - the earlier row wins, like the old scan
+    assert index.lookup('01234').email == 'a@example.com'
+    assert index.duplicates == {'1234': [0, 1]}
+    assert index.ambiguous == {'1234': ['1234', '01234']}
+    assert len(index.problems()) == 2
+
+
+def test_lookup_reads_email_and_nic():
+    index = make_index(['1001', '1002'], emails=[' a@example.com ', None], nics=['N1', None])
+
+    first, second = index.lookup('1001'), index.lookup('1002')
+    assert (first.email, first.nic, first.has_email) == ('a@example.com', 'N1', True)
+    assert (second.email, second.nic, second.has_email) == (None, None, False)
+
+
+def test_missing_policies():
+    index = make_index(['1001', '00407/0054316', '1003'])
+
+    assert index.missing_policies(['1001', '004070054316']) == ['1003']
+
+
+def test_matcher_ignores_numbers_inside_noise_digits():
+    """A policy number glued to other digits is part of a different number"""
+    matcher = PolicyMatcher(['12345678'])
+
+    assert matcher.find_all("Amount 9123456789 and 112345678 and 123456789") == []
+    assert matcher.first_match("Ref 912345678, Policy No: 12345678") == '12345678'
+    assert matcher.first_match("Policy No:12345678.") == '12345678'
+
+
+def test_matcher_allows_leading_zeros_back():
+    matcher = PolicyMatcher(['407/0054316'])
+
+    assert matcher.first_match("Policy No: 00407/0054316") == '00407/0054316'
+    assert matcher.first_match("Policy No: 100407/0054316") is None
+
+
+def test_matcher_finds_printed_layout_of_12_digit_numbers():
+    matcher = PolicyMatcher(['004070054316'])
+
+    assert matcher.first_match("Policy No: 00407/0054316") == '00407/0054316'
+    assert matcher.first_match("Policy No: 004070054316") == '004070054316'
+
+
+def test_matcher_returns_matches_in_text_order():
+    matcher = PolicyMatcher(['1001', '2002', '3003'])
+
+    matches = matcher.find_all("3003 then 1001 then 2002 and x1001")
+    assert [match[2] for match in matches] == ['3003', '1001', '2002']
+    assert matcher.find_all("") == []
+    assert PolicyMatcher([]).find_all("1001") == []
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Tests for the policy page scan
+Run with: python -m pytest test_policy_scan.py
+"""
+import pandas as pd
+
+from benchmark_pipeline import generate_dataset
+from policy_index import build_policy_index
+from policy_scanner import PARALLEL_MIN_PAGES, open_pdf_reader, page_count, scan_policy_pages, scan_uses_pool
+from policy_writer import plan_policy_output, write_policy_pdfs, write_uses_pool
+
+
+def test_pool_scan_matches_serial_scan(tmp_path):
+    """Workers open the PDF once each and find the same pages as the serial scan"""
+    dataset = generate_dataset(tmp_path, policies=100)
+    assert dataset['pages'] >= PARALLEL_MIN_PAGES
+    known_policies = [str(policy_no) for policy_no in pd.read_excel(dataset['excel_path'])['Policy No']]
+
+    with open(dataset['pdf_path'], 'rb') as f:
+        reader = open_pdf_reader(f)
+        total_pages = page_count(reader)
+        serial = scan_policy_pages(reader, dataset['pdf_path'], total_pages, known_policies=known_policies)
+        pooled = scan_policy_pages(reader, dataset['pdf_path'], total_pages, max_workers=2,
+                                   known_policies=known_policies)
+
+    assert pooled == serial
+    assert serial == dataset['expected']
+
+
+def test_small_runs_need_no_spill_file(tmp_path, monkeypatch):
+    """Below the pool thresholds several workers still scan and write without ``pdf_path``"""
+    monkeypatch.chdir(tmp_path)
+    dataset = generate_dataset(tmp_path, policies=10)
+    index = build_policy_index(pd.read_excel(dataset['excel_path']))
+
+    with open(dataset['pdf_path'], 'rb') as f:
+        reader = open_pdf_reader(f)
+        total_pages = page_count(reader)
+        assert not scan_uses_pool(total_pages, max_workers=4)
+        pages = scan_policy_pages(reader, None, total_pages, max_workers=4)
+        jobs = [plan_policy_output(policy_number, found, index) for policy_number, found in pages.items()]
+        assert not write_uses_pool(len(jobs), max_workers=4)
+        results = write_policy_pdfs(reader, None, jobs, max_workers=4)
+
+    assert pages == dataset['expected']
+    assert len(results) == len(jobs) == 10